@@ -0,0 +1,99 @@
+import asyncio
+import importlib.util
+import math
+import os
+import socket
+import stat
+import sys
+import tempfile
+import threading
+
+# Root of the repository, where every bot-* directory lives
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_bot_module(bot_dir, filename="app.py"):
+    """
+    Imports a bot script (e.g. bot-llama3.1-base/app.py) as a module.
+    The bot directories are not packages, so the file is loaded by path and its
+    directory is put on sys.path so sibling modules resolve like they do when
+    the script is run directly.
+    """
+    directory = os.path.join(REPO_ROOT, bot_dir)
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+
+    module_name = "bench_" + "".join(c if c.isalnum() else "_" for c in f"{bot_dir}_{filename[:-3]}")
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(directory, filename))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[module_name]
+        raise
+    return module
+
+
+def install_fake_op(secret="sk-stub"):
+    """
+    Puts a fake 1Password `op` CLI on PATH so the OpenAI bots can resolve their
+    API key at import time without a real vault.
+    """
+    directory = tempfile.mkdtemp(prefix="bench-op-")
+    path = os.path.join(directory, "op")
+    with open(path, "w") as f:
+        f.write(f"#!/bin/sh\necho {secret}\n")
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    os.environ["PATH"] = directory + os.pathsep + os.environ.get("PATH", "")
+    return directory
+
+
+class EventLoopThread:
+    """
+    An asyncio event loop running in a daemon thread, so the thread-pool based
+    load generator can drive async bots. Every coroutine runs on the same loop,
+    like the requests of a single bot process.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name="bench-event-loop", daemon=True).start()
+
+    def run(self, coro):
+        """Runs a coroutine on the loop and blocks until it returns."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+
+def free_port():
+    """Returns a TCP port that is free on localhost."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of numbers (None when empty)."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(samples):
+    """p50/p95/p99 and mean of a list of durations in seconds."""
+    return {
+        "p50": percentile(samples, 50),
+        "p95": percentile(samples, 95),
+        "p99": percentile(samples, 99),
+        "mean": sum(samples) / len(samples) if samples else None,
+    }
+
+
+def format_ms(value):
+    """Formats a duration in seconds as milliseconds for report tables."""
+    return "-" if value is None else f"{value * 1000:.1f}"
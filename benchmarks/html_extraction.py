@@ -0,0 +1,98 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from bs4 import BeautifulSoup
+
+from benchmarks.harness import format_ms, summarize
+from common import html_extract
+
+# The Legal Guides pages indexed by the RAG bots
+LEGAL_PAGE_IDS = [
+    '756056110', '2328166682', '152338450', '2160722036', '2666594400',
+    '2971795516', '93126701', '2868445326', '872251404', '1634533508',
+    '1902674264', '772407317', '68354666', '772735036', '772735051',
+    '771096867', '791412877', '2975596629', '2847507373', '2716074132',
+    '275152964'
+]
+
+
+def load_html_dir(directory):
+    """Reads <page_id>.html files saved by a previous --save-dir run."""
+    pages = {}
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".html"):
+            with open(os.path.join(directory, name), encoding="utf-8") as f:
+                pages[name[:-5]] = f.read()
+    return pages
+
+
+def fetch_html(page_ids):
+    import requests
+    from requests.auth import HTTPBasicAuth
+
+    base_url = os.environ["CONFLUENCE_BASE_URL"]
+    auth = HTTPBasicAuth(os.environ["CONFLUENCE_USERNAME"], os.environ["CONFLUENCE_API_TOKEN"])
+    pages = {}
+    for page_id in page_ids:
+        response = requests.get(f"{base_url}/rest/api/content/{page_id}?expand=body.view", auth=auth)
+        response.raise_for_status()
+        pages[page_id] = response.json()["body"]["view"]["value"]
+    return pages
+
+
+def bench(name, extract, pages, repeat):
+    samples = []
+    chars = 0
+    for _ in range(repeat):
+        for page_id, html in pages.items():
+            started = time.perf_counter()
+            text = extract(page_id, html)
+            samples.append(time.perf_counter() - started)
+            chars = len(text)
+    stats = summarize(samples)
+    total = sum(samples) / repeat
+    print(f"{name:<28} {format_ms(stats['p50']):>9} {format_ms(stats['p95']):>9} {total * 1000:>10.1f} {chars:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmark of Confluence HTML-to-text extraction.")
+    parser.add_argument("--html-dir", help="Directory of <page_id>.html files (fetched from Confluence if omitted)")
+    parser.add_argument("--save-dir", help="Save the fetched HTML here for offline runs")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.html_dir:
+        pages = load_html_dir(args.html_dir)
+    else:
+        pages = fetch_html(LEGAL_PAGE_IDS)
+        if args.save_dir:
+            os.makedirs(args.save_dir, exist_ok=True)
+            for page_id, html in pages.items():
+                with open(os.path.join(args.save_dir, f"{page_id}.html"), "w", encoding="utf-8") as f:
+                    f.write(html)
+
+    print(f"{len(pages)} pages, {sum(len(h) for h in pages.values()) / 1024:.0f} KiB of HTML, parser={html_extract.HTML_PARSER}")
+    print(f"{'variant':<28} {'p50 ms':>9} {'p95 ms':>9} {'total ms':>10} {'chars*':>8}")
+
+    bench("html.parser get_text", lambda _, html: BeautifulSoup(html, "html.parser").get_text(), pages, args.repeat)
+    if html_extract.HTML_PARSER == "lxml":
+        bench("lxml get_text", lambda _, html: BeautifulSoup(html, "lxml").get_text(), pages, args.repeat)
+    bench("extract_text", lambda _, html: html_extract.extract_text(html), pages, args.repeat)
+
+    cache_dir = tempfile.mkdtemp(prefix="bench-extract-")
+    html_extract.EXTRACT_CACHE_DIR = cache_dir
+    try:
+        for page_id, html in pages.items():
+            html_extract.extract_page_text(html, page_id, 1)
+        bench("extract_page_text (cached)", lambda page_id, html: html_extract.extract_page_text(html, page_id, 1),
+              pages, args.repeat)
+    finally:
+        shutil.rmtree(cache_dir)
+    print("* characters of text extracted from the last page")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,338 @@
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.harness import (
+    REPO_ROOT, EventLoopThread, format_ms, free_port, install_fake_op, load_bot_module, summarize
+)
+from benchmarks.mock_server import MockModelServer, StubConfig
+
+# All load comes from one client here, so the per-client rate limits of the HTTP
+# bots would turn most of it away; measure the bots behind their concurrency caps
+os.environ.setdefault("RATE_LIMIT_PER_SECOND", "0")
+
+# Bot return values that signal a failed call (the bots return errors as text)
+ERROR_PREFIXES = ("Error", "HTTP Request failed")
+
+VISION_IMAGE = os.path.join(REPO_ROOT, "bot-llama3.2-vision", "container", "image1.jpg")
+
+
+def _check_text(result):
+    if not result or result.startswith(ERROR_PREFIXES):
+        raise RuntimeError(result or "Empty response")
+
+
+def _use_stub_openai(stub_url):
+    install_fake_op()
+    os.environ["OPENAI_API_KEY"] = "sk-stub"
+    os.environ["OPENAI_BASE_URL"] = f"{stub_url}/v1"
+
+
+# --- Scenarios -------------------------------------------------------------
+# Each scenario takes the stub server URL and returns a callable that performs
+# one request and raises on failure.
+
+def _use_stub_ollama(stub_url):
+    # Read when the bots build their model router at import time
+    os.environ["API_URL"] = f"{stub_url}/api/generate"
+
+
+def scenario_llama_base(stub_url):
+    _use_stub_ollama(stub_url)
+    module = load_bot_module("bot-llama3.1-base")
+    return lambda i: _check_text(module.send_message_to_bot(f"Question {i}: how do I request legal support?"))
+
+
+def scenario_mistral_base(stub_url):
+    _use_stub_ollama(stub_url)
+    module = load_bot_module("bot-mistral-base")
+    return lambda i: _check_text(module.send_message_to_bot(f"Question {i}: how do I request legal support?"))
+
+
+def scenario_llama_assistant(stub_url):
+    module = load_bot_module("bot-llama3.1-assistant")
+    module.API_URL = f"{stub_url}/api/generate"
+    # One assistant (and worker pool) serving one conversation per load worker
+    assistant = module.ChatAssistant(store=module.get_session_store())
+
+    def call(i):
+        session_id = f"bench-{threading.get_ident()}"
+        _check_text(assistant.submit(session_id, f"Follow-up {i}: what about the signature?").result())
+
+    return call
+
+
+# The OpenAI chat bots are async: worker threads submit their coroutines to one
+# shared event loop, so the bot's connection pool and concurrency limit apply.
+# Their HTTP endpoints are served from the same loop, since a bot module's
+# client and semaphore belong to the loop that used them first.
+_bot_loop = None
+
+
+def _event_loop():
+    global _bot_loop
+    if _bot_loop is None:
+        _bot_loop = EventLoopThread()
+    return _bot_loop
+
+
+# Cleanups registered by the running scenario, run once it is measured
+_cleanups = []
+
+
+def scenario_router_hedge(stub_url):
+    from common.router import ModelRouter, OllamaBackend
+
+    # The preferred backend takes 2s to start answering; the router hedges to
+    # the regular stub after HEDGE_AFTER_SECONDS (default 0.25 here)
+    slow = MockModelServer(config=StubConfig(latency=2.0))
+    slow.start()
+    router = ModelRouter(
+        [OllamaBackend("llama3.1:latest", url=f"{slow.url}/api/generate"),
+         OllamaBackend("mistral:latest", url=f"{stub_url}/api/generate")],
+        hedge_after=float(os.getenv("HEDGE_AFTER_SECONDS", "0.25")),
+    )
+    _cleanups.extend([slow.stop, router.close])
+    messages = [{"role": "user", "content": "How do I request legal support?"}]
+    return lambda i: _check_text(router.chat(messages).text)
+
+
+def scenario_openai_base(stub_url):
+    _use_stub_openai(stub_url)
+    module = load_bot_module("bot-openai-base")
+    loop = _event_loop()
+    return lambda i: _check_text(loop.run(module.get_response(f"Question {i}: summarise our contract policy.")))
+
+
+def scenario_openai_intructions(stub_url):
+    _use_stub_openai(stub_url)
+    module = load_bot_module("bot-openai-intructions")
+    loop = _event_loop()
+    return lambda i: _check_text(loop.run(module.get_response(f"Question {i}: what's the meaning of life?")))
+
+
+def scenario_openai_assistant(stub_url):
+    _use_stub_openai(stub_url)
+    module = load_bot_module("bot-openai-assistant")
+    loop = _event_loop()
+    local = threading.local()
+
+    def call(i):
+        if not hasattr(local, "assistant"):
+            local.assistant = module.ChatAssistant(session_id=f"bench-{threading.get_ident()}")
+        _check_text(loop.run(local.assistant.get_response(f"Question {i}: what's the meaning of life?")))
+
+    return call
+
+
+def scenario_openai_assistant_http(stub_url):
+    import uvicorn
+
+    _use_stub_openai(stub_url)
+    module = load_bot_module("bot-openai-assistant")
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(module.app, host="127.0.0.1", port=port, log_level="warning"))
+    asyncio.run_coroutine_threadsafe(server.serve(), _event_loop().loop)
+    _wait_started(server)
+    local = threading.local()
+
+    def call(i):
+        # One session per worker; the streamed answer is read to the end
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+            local.session_id = f"bench-{threading.get_ident()}"
+        response = local.session.post(
+            f"http://127.0.0.1:{port}/chat",
+            json={"prompt": f"Question {i}: what's the meaning of life?", "session_id": local.session_id},
+        )
+        response.raise_for_status()
+        _check_text(response.text)
+
+    return call
+
+
+def scenario_vision_ask(stub_url):
+    from werkzeug.serving import make_server
+
+    module = load_bot_module("bot-llama3.2-vision")
+    module.MODEL_URL = f"{stub_url}/api/chat"
+    port = free_port()
+    server = make_server("127.0.0.1", port, module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    session = requests.Session()
+
+    def call(i):
+        response = session.post(
+            f"http://127.0.0.1:{port}/ask",
+            json={"prompt": f"Describe image {i}", "image_path": VISION_IMAGE},
+        )
+        response.raise_for_status()
+        if "error" in response.json():
+            raise RuntimeError(response.json()["error"])
+
+    return call
+
+
+def scenario_function_calling_chat(stub_url):
+    import uvicorn
+
+    _use_stub_openai(stub_url)
+    port = free_port()
+    ready = threading.Event()
+    failure = []
+
+    def serve():
+        # The app resolves example.db against the working directory at import
+        # (and seeds it on the first tool call, from the thread running the
+        # event loop), so import it here from a scratch directory so the file
+        # does not land in the repo.
+        previous = os.getcwd()
+        try:
+            os.chdir(tempfile.mkdtemp(prefix="bench-db-"))
+            module = load_bot_module("bot-openai-function-calling")
+        except BaseException as e:
+            failure.append(e)
+            ready.set()
+            return
+        finally:
+            os.chdir(previous)
+        server = uvicorn.Server(uvicorn.Config(module.app, host="127.0.0.1", port=port, log_level="warning"))
+        threading.Thread(target=lambda: (_wait_started(server), ready.set()), daemon=True).start()
+        server.run()
+
+    threading.Thread(target=serve, daemon=True).start()
+    ready.wait()
+    if failure:
+        raise failure[0]
+    session = requests.Session()
+
+    def call(i):
+        # Alternate between a tool call and a plain completion
+        query = "How much is the Laptop?" if i % 2 else f"Tell me something about product {i}"
+        response = session.post(f"http://127.0.0.1:{port}/chat", json={"query": query})
+        response.raise_for_status()
+        if "error" in response.json():
+            raise RuntimeError(response.json()["error"])
+
+    return call
+
+
+def _wait_started(server, timeout=30):
+    deadline = time.monotonic() + timeout
+    while not server.started and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+SCENARIOS = {
+    "llama-base": scenario_llama_base,
+    "mistral-base": scenario_mistral_base,
+    "llama-assistant": scenario_llama_assistant,
+    "router-hedge": scenario_router_hedge,
+    "openai-base": scenario_openai_base,
+    "openai-intructions": scenario_openai_intructions,
+    "openai-assistant": scenario_openai_assistant,
+    "openai-assistant-http": scenario_openai_assistant_http,
+    "vision-ask": scenario_vision_ask,
+    "function-calling-chat": scenario_function_calling_chat,
+}
+
+
+def run_level(call, server, concurrency, total_requests):
+    """Runs `total_requests` calls with `concurrency` workers and summarises them."""
+    server.stats.reset()
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def timed(i):
+        started = time.perf_counter()
+        try:
+            call(i)
+        except Exception as e:
+            with lock:
+                errors.append(str(e))
+            return
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+
+    wall_started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(timed, range(total_requests)))
+    wall = time.perf_counter() - wall_started
+
+    backend = server.stats.snapshot()
+    return {
+        "concurrency": concurrency,
+        "requests": total_requests,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "latency": summarize(latencies),
+        "ttft": summarize(backend["ttft"]),
+        "throughput": len(latencies) / wall if wall else 0.0,
+    }
+
+
+def print_report(name, results):
+    print(f"\n== {name} ==")
+    print(f"{'conc':>5} {'reqs':>5} {'err':>4} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+          f"{'ttft p50':>9} {'ttft p95':>9} {'req/s':>8}")
+    for r in results:
+        print(
+            f"{r['concurrency']:>5} {r['requests']:>5} {r['errors']:>4} "
+            f"{format_ms(r['latency']['p50']):>9} {format_ms(r['latency']['p95']):>9} "
+            f"{format_ms(r['latency']['p99']):>9} {format_ms(r['ttft']['p50']):>9} "
+            f"{format_ms(r['ttft']['p95']):>9} {r['throughput']:>8.1f}"
+        )
+        if r["first_error"]:
+            print(f"      first error: {r['first_error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency and throughput benchmark of the bots against a stub model server.")
+    parser.add_argument("scenarios", nargs="*", default=list(SCENARIOS), help=f"Any of: {', '.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=64, help="Requests per concurrency level")
+    parser.add_argument("--tokens", type=int, default=StubConfig.tokens)
+    parser.add_argument("--token-rate", type=float, default=StubConfig.token_rate)
+    parser.add_argument("--latency", type=float, default=StubConfig.latency)
+    parser.add_argument("--json", dest="json_path", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    unknown = [s for s in args.scenarios if s not in SCENARIOS]
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(unknown)}")
+    levels = [int(c) for c in args.concurrency.split(",") if c]
+
+    config = StubConfig(tokens=args.tokens, token_rate=args.token_rate, latency=args.latency)
+    report = {"config": vars(config), "scenarios": {}}
+    with MockModelServer(config=config) as server:
+        for name in args.scenarios:
+            try:
+                call = SCENARIOS[name](server.url)
+            except Exception as e:
+                print(f"\n== {name} ==\n  skipped: {e}")
+                report["scenarios"][name] = {"skipped": str(e)}
+                continue
+            try:
+                results = [run_level(call, server, level, args.requests) for level in levels]
+            finally:
+                while _cleanups:
+                    _cleanups.pop()()
+            report["scenarios"][name] = results
+            print_report(name, results)
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
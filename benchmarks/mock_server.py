@@ -0,0 +1,414 @@
+import argparse
+import json
+import re
+import sys
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+# Words used to fake model output
+VOCABULARY = (
+    "the contract must be reviewed by legal before signature and stored in the "
+    "agreed location so that every team can find the latest approved version"
+).split()
+
+# Product names that make the fake OpenAI model answer with a function call
+FUNCTION_CALL_TRIGGERS = ("laptop", "mouse")
+
+
+@dataclass
+class StubConfig:
+    """Shape of the fake model responses."""
+    tokens: int = 64            # Tokens generated per response
+    token_rate: float = 200.0   # Tokens per second once generation started
+    latency: float = 0.05       # Seconds before the first token (prompt processing)
+
+
+class StubStats:
+    """Thread-safe record of what the stub served, used for TTFT reporting."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.ttft = []
+            self.durations = []
+
+    def record(self, ttft, duration):
+        with self._lock:
+            self.requests += 1
+            if ttft is not None:
+                self.ttft.append(ttft)
+            self.durations.append(duration)
+
+    def snapshot(self):
+        with self._lock:
+            return {"requests": self.requests, "ttft": list(self.ttft), "durations": list(self.durations)}
+
+
+class _StubHTTPServer(ThreadingHTTPServer):
+    # The default listen backlog of 5 makes bursts of new connections wait for SYN retries
+    request_queue_size = 256
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients that abandon a stream (hedged requests) reset their connection
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return
+        super().handle_error(request, client_address)
+
+
+def _estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+
+class _JSONHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # Keep benchmark output clean
+        pass
+
+    def _send_json(self, payload, status=200):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class _StubHandler(_JSONHandler):
+    def do_POST(self):
+        started = time.perf_counter()
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self._send_json({"error": "invalid JSON"}, status=400)
+            return
+
+        routes = {
+            "/api/generate": self._ollama_generate,
+            "/api/chat": self._ollama_chat,
+            "/v1/chat/completions": self._openai_chat,
+        }
+        handler = routes.get(self.path.split("?")[0])
+        if handler is None:
+            self._send_json({"error": f"Unknown path {self.path}"}, status=404)
+            return
+
+        try:
+            ttft = handler(body, started)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client hung up mid-stream, e.g. the losing call of a hedged request
+            self.close_connection = True
+            return
+        self.server.stats.record(ttft, time.perf_counter() - started)
+
+    # --- helpers -----------------------------------------------------------
+
+    def _start_chunked(self, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _end_chunked(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _tokens(self):
+        """Yields fake tokens at the configured latency and rate."""
+        config = self.server.config
+        time.sleep(config.latency)
+        delay = 1.0 / config.token_rate if config.token_rate > 0 else 0
+        for i in range(config.tokens):
+            if i and delay:
+                time.sleep(delay)
+            yield VOCABULARY[i % len(VOCABULARY)] + " "
+
+    def _full_text(self):
+        return "".join(self._tokens()).strip()
+
+    # --- Ollama ------------------------------------------------------------
+
+    def _ollama_stream(self, body, started, make_part):
+        model = body.get("model", "stub")
+        if body.get("stream", True) is False:
+            text = self._full_text()
+            ttft = time.perf_counter() - started
+            self._send_json({**make_part(text), "model": model, "done": True})
+            return ttft
+
+        self._start_chunked("application/x-ndjson")
+        ttft = None
+        for token in self._tokens():
+            if ttft is None:
+                ttft = time.perf_counter() - started
+            part = {**make_part(token), "model": model, "done": False}
+            self._write_chunk(json.dumps(part).encode("utf-8") + b"\n")
+        final = {**make_part(""), "model": model, "done": True, "eval_count": self.server.config.tokens}
+        self._write_chunk(json.dumps(final).encode("utf-8") + b"\n")
+        self._end_chunked()
+        return ttft
+
+    def _ollama_generate(self, body, started):
+        return self._ollama_stream(body, started, lambda text: {"response": text})
+
+    def _ollama_chat(self, body, started):
+        return self._ollama_stream(
+            body, started, lambda text: {"message": {"role": "assistant", "content": text}}
+        )
+
+    # --- OpenAI ------------------------------------------------------------
+
+    def _openai_chat(self, body, started):
+        model = body.get("model", "stub")
+        messages = body.get("messages", [])
+        prompt_tokens = sum(_estimate_tokens(str(m.get("content", ""))) for m in messages)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": self.server.config.tokens,
+            "total_tokens": prompt_tokens + self.server.config.tokens,
+            "prompt_tokens_details": {"cached_tokens": 0},
+        }
+
+        last_user = next((m for m in reversed(messages) if m.get("role") == "user"), {})
+        wants_function = body.get("functions") and any(
+            word in str(last_user.get("content", "")).lower() for word in FUNCTION_CALL_TRIGGERS
+        )
+        if wants_function:
+            time.sleep(self.server.config.latency)
+            ttft = time.perf_counter() - started
+            product = next(w for w in FUNCTION_CALL_TRIGGERS if w in last_user["content"].lower())
+            message = {
+                "role": "assistant",
+                "content": None,
+                "function_call": {
+                    "name": body["functions"][0]["name"],
+                    "arguments": json.dumps({"product_name": product.capitalize()}),
+                },
+            }
+            self._send_json({
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": message, "finish_reason": "function_call"}],
+                "usage": usage,
+            })
+            return ttft
+
+        if not body.get("stream"):
+            text = self._full_text()
+            ttft = time.perf_counter() - started
+            self._send_json({
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+            return ttft
+
+        def event(delta, finish_reason=None, with_usage=False):
+            chunk = {
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [] if with_usage else [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            if with_usage:
+                chunk["usage"] = usage
+            return b"data: " + json.dumps(chunk).encode("utf-8") + b"\n\n"
+
+        self._start_chunked("text/event-stream")
+        ttft = None
+        self._write_chunk(event({"role": "assistant", "content": ""}))
+        for token in self._tokens():
+            if ttft is None:
+                ttft = time.perf_counter() - started
+            self._write_chunk(event({"content": token}))
+        self._write_chunk(event({}, finish_reason="stop"))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            self._write_chunk(event({}, with_usage=True))
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._end_chunked()
+        return ttft
+
+
+class MockModelServer:
+    """
+    Local HTTP server emulating Ollama's /api/generate and /api/chat NDJSON
+    streaming and OpenAI's /v1/chat/completions, with configurable latency and
+    token rate.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, config=None):
+        self.httpd = _StubHTTPServer((host, port), _StubHandler)
+        self.httpd.config = config or StubConfig()
+        self.httpd.stats = StubStats()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def config(self):
+        return self.httpd.config
+
+    @property
+    def stats(self):
+        return self.httpd.stats
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class _ConfluenceHandler(_JSONHandler):
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+        expand = set(query.get("expand", "").split(","))
+        stub = self.server.stub
+        self.server.stub.requests += 1
+
+        if parsed.path == "/rest/api/content/search":
+            matches = stub.match(query.get("cql", ""))
+            start, limit = int(query.get("start", 0)), int(query.get("limit", 25))
+            window = matches[start:start + limit]
+            links = {"base": stub.url, "context": ""}
+            if start + limit < len(matches):
+                links["next"] = "/rest/api/content/search?" + urlencode({**query, "start": start + limit})
+            self._send_json({
+                "results": [stub.render(page, expand) for page in window],
+                "start": start, "limit": limit, "size": len(window), "_links": links,
+            })
+            return
+
+        match = re.fullmatch(r"/rest/api/content/(\w+)", parsed.path)
+        page = stub.pages.get(match.group(1)) if match else None
+        if page is None:
+            self._send_json({"message": "No content found"}, status=404)
+            return
+        self._send_json(stub.render(page, expand))
+
+
+class MockConfluenceServer:
+    """
+    Local stand-in for the Confluence REST API: content by ID and the paginated
+    CQL content search (type, space in (...) and lastmodified >= "..." clauses).
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.httpd = _StubHTTPServer((host, port), _ConfluenceHandler)
+        self.httpd.stub = self
+        self.pages = {}
+        self.requests = 0
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def put_page(self, page_id, title, space, html, modified=None):
+        """Creates a page, or publishes a new version of an existing one."""
+        previous = self.pages.get(str(page_id))
+        self.pages[str(page_id)] = {
+            "id": str(page_id), "title": title, "space": space, "html": html,
+            "version": previous["version"] + 1 if previous else 1,
+            "modified": modified or datetime.now(timezone.utc),
+        }
+
+    def delete_page(self, page_id):
+        self.pages.pop(str(page_id), None)
+
+    def match(self, cql):
+        spaces = re.search(r"space\s+in\s*\(([^)]*)\)", cql, re.I)
+        space_keys = {s.strip().strip('"') for s in spaces.group(1).split(",")} if spaces else None
+        since = re.search(r'lastmodified\s*>=\s*"([^"]+)"', cql, re.I)
+        since_time = datetime.strptime(since.group(1), "%Y-%m-%d %H:%M").replace(tzinfo=timezone.utc) if since else None
+        return [
+            page for page in sorted(self.pages.values(), key=lambda p: p["id"])
+            if (space_keys is None or page["space"] in space_keys)
+            and (since_time is None or page["modified"] >= since_time)
+        ]
+
+    def render(self, page, expand):
+        result = {
+            "id": page["id"], "type": "page", "title": page["title"],
+            "_links": {"webui": f"/spaces/{page['space']}/pages/{page['id']}/{page['title'].replace(' ', '+')}"},
+        }
+        if "version" in expand:
+            result["version"] = {"number": page["version"], "when": page["modified"].isoformat()}
+        if "space" in expand:
+            result["space"] = {"key": page["space"]}
+        if "body.view" in expand:
+            result["body"] = {"view": {"value": page["html"], "representation": "view"}}
+        return result
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a local Ollama/OpenAI stub server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--tokens", type=int, default=StubConfig.tokens)
+    parser.add_argument("--token-rate", type=float, default=StubConfig.token_rate)
+    parser.add_argument("--latency", type=float, default=StubConfig.latency)
+    parser.add_argument("--confluence-pages", help="Also serve a Confluence stub with the pages in this JSON file "
+                                                   "({page_id: {title, space, html}})")
+    parser.add_argument("--confluence-port", type=int, default=8090)
+    args = parser.parse_args()
+
+    if args.confluence_pages:
+        confluence = MockConfluenceServer(args.host, args.confluence_port)
+        with open(args.confluence_pages) as f:
+            for page_id, page in json.load(f).items():
+                confluence.put_page(page_id, page["title"], page["space"], page["html"])
+        confluence.start()
+        print(f"Stub Confluence listening on {confluence.url} ({len(confluence.pages)} pages)")
+
+    config = StubConfig(tokens=args.tokens, token_rate=args.token_rate, latency=args.latency)
+    server = MockModelServer(args.host, args.port, config)
+    print(f"Stub model server listening on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
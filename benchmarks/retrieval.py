@@ -0,0 +1,284 @@
+import argparse
+import itertools
+import json
+import logging
+import re
+import time
+
+from benchmarks.harness import format_ms, load_bot_module, summarize
+
+# HNSW construction_ef used for every index (ef at query time is swept separately)
+DEFAULT_CONSTRUCTION_EF = 100
+
+
+# --- Chunking strategies ---------------------------------------------------
+# Each chunker returns (part, text) pairs for one page.
+
+def chunk_lines(content):
+    """One chunk per non-empty line, like ChatAssistant.make_collection."""
+    return [(i, line) for i, line in enumerate(content.split("\n"), 1) if line.strip()]
+
+
+def chunk_paragraphs(content):
+    """One chunk per block of text separated by blank lines."""
+    paragraphs = [p.strip() for p in re.split(r"\n\s*\n", content)]
+    return [(i, p) for i, p in enumerate((p for p in paragraphs if p), 1)]
+
+
+def chunk_window(content, size):
+    """Fixed-size character windows on word boundaries with 25% overlap."""
+    words = content.split()
+    chunks, current, length, part = [], [], 0, 1
+    for word in words:
+        current.append(word)
+        length += len(word) + 1
+        if length >= size:
+            chunks.append((part, " ".join(current)))
+            part += 1
+            # Keep the last quarter of the window as overlap
+            keep, kept = [], 0
+            for w in reversed(current):
+                if kept >= size // 4:
+                    break
+                keep.insert(0, w)
+                kept += len(w) + 1
+            current, length = keep, kept
+    if current and (not chunks or length > size // 4):
+        chunks.append((part, " ".join(current)))
+    return chunks
+
+
+def get_chunker(spec):
+    if spec == "line":
+        return chunk_lines
+    if spec == "paragraph":
+        return chunk_paragraphs
+    if spec.startswith("window:"):
+        size = int(spec.split(":", 1)[1])
+        return lambda content: chunk_window(content, size)
+    raise ValueError(f"Unknown chunker: {spec}")
+
+
+# --- Data loading ----------------------------------------------------------
+
+def load_labels(path):
+    """
+    Reads labelled questions from a JSON list or JSONL file. Each entry has a
+    "question" and the "page_id" (or list of "page_ids") that answers it.
+    """
+    with open(path) as f:
+        text = f.read().strip()
+    entries = json.loads(text) if text.startswith("[") else [json.loads(line) for line in text.splitlines() if line.strip()]
+    labels = []
+    for entry in entries:
+        page_ids = entry.get("page_ids") or [entry["page_id"]]
+        labels.append({"question": entry["question"], "page_ids": {str(p) for p in page_ids}})
+    return labels
+
+
+def fetch_pages(spaces=None):
+    """
+    Fetches the text of every page of the Confluence spaces (CONFLUENCE_SPACES by
+    default), not only the labelled ones: the other pages are the distractors
+    that make recall and MRR mean something.
+    """
+    from dotenv import load_dotenv
+
+    from common.confluence import ConfluenceCrawler
+    from common.html_extract import extract_page_text
+
+    load_dotenv()
+    crawler = ConfluenceCrawler.from_env()
+    if spaces:
+        crawler.spaces = spaces
+    result = crawler.sync(full=True)
+    return {page_id: extract_page_text(page.html, page_id, page.version) for page_id, page in result.changed.items()}
+
+
+def check_corpus(pages, labels):
+    """Warns about corpora that would make the scores meaningless; returns the labelled page count."""
+    labelled = {p for label in labels for p in label["page_ids"]}
+    missing = labelled - set(pages)
+    if missing:
+        logging.warning(f"{len(missing)} labelled pages are not in the corpus and count as misses: "
+                        f"{', '.join(sorted(missing)[:10])}")
+    if len(pages) <= len(labelled):
+        logging.warning(f"The corpus holds only the {len(pages)} labelled pages and no distractors; "
+                        f"recall@k and MRR will be inflated")
+    return len(labelled & set(pages))
+
+
+# --- Measurement -----------------------------------------------------------
+
+def score(labels, results, k):
+    """Page-level recall@k and MRR from Chroma query results."""
+    hits, reciprocal_ranks = 0, []
+    for label, metadatas in zip(labels, results["metadatas"]):
+        sources = [m["source"] for m in metadatas[:k]]
+        rank = next((i for i, s in enumerate(sources, 1) if s in label["page_ids"]), None)
+        hits += rank is not None
+        reciprocal_ranks.append(1 / rank if rank else 0.0)
+    return hits / len(labels), sum(reciprocal_ranks) / len(labels)
+
+
+def evaluate(client, labels, chunks, embeddings, query_embeddings, m, ef, n_results_list):
+    """Builds one HNSW index from precomputed embeddings and measures it for every k."""
+    name = f"bench_m{m}_ef{ef}"
+    try:
+        client.delete_collection(name)
+    except Exception:
+        pass
+    collection = client.create_collection(
+        name=name,
+        metadata={
+            "hnsw:space": "cosine",
+            "hnsw:M": m,
+            "hnsw:construction_ef": DEFAULT_CONSTRUCTION_EF,
+            "hnsw:search_ef": ef,
+        },
+    )
+    started = time.perf_counter()
+    batch = 5000
+    for start in range(0, len(chunks), batch):
+        collection.add(
+            ids=[c["id"] for c in chunks[start:start + batch]],
+            documents=[c["text"] for c in chunks[start:start + batch]],
+            metadatas=[{"source": c["source"], "part": c["part"]} for c in chunks[start:start + batch]],
+            embeddings=embeddings[start:start + batch],
+        )
+    build_time = time.perf_counter() - started
+
+    rows = []
+    for k in n_results_list:
+        latencies, metadatas = [], []
+        for query_embedding in query_embeddings:
+            started = time.perf_counter()
+            result = collection.query(query_embeddings=[query_embedding], n_results=min(k, len(chunks)), include=["metadatas"])
+            latencies.append(time.perf_counter() - started)
+            metadatas.append(result["metadatas"][0])
+        recall, mrr = score(labels, {"metadatas": metadatas}, k)
+        rows.append({"n_results": k, "recall": recall, "mrr": mrr, "search": summarize(latencies)})
+    client.delete_collection(name)
+    return build_time, rows
+
+
+def run_benchmark(pages, labels, models, chunkers, n_results_list, m_values, ef_values):
+    import chromadb
+
+    labelled_pages = check_corpus(pages, labels)
+
+    embeddings_module = load_bot_module("bot-llama3.1-RAG", "embeddings.py")
+    client = chromadb.EphemeralClient()
+    report = []
+    questions = [label["question"] for label in labels]
+
+    for model_name in models:
+        # "<model>@<backend>" selects an embedding backend, e.g. all-MiniLM-L6-v2@onnx-int8
+        name, _, backend = model_name.partition("@")
+        # Bypass the embedding cache so encode times are real
+        embedding_func = embeddings_module.LazyEmbeddingFunction(name, backend or embeddings_module.EMBEDDING_BACKEND)
+        started = time.perf_counter()
+        query_embeddings = []
+        query_latencies = []
+        for question in questions:
+            q_started = time.perf_counter()
+            query_embeddings.append(embedding_func([question])[0])
+            query_latencies.append(time.perf_counter() - q_started)
+        print(f"[{model_name}] embedded {len(questions)} questions in {time.perf_counter() - started:.2f}s")
+
+        for chunker_spec in chunkers:
+            chunker = get_chunker(chunker_spec)
+            chunks = [
+                {"id": f"id_{page_id}_{part}", "source": page_id, "part": part, "text": text}
+                for page_id, content in pages.items()
+                for part, text in chunker(content)
+            ]
+            started = time.perf_counter()
+            embeddings = embedding_func([c["text"] for c in chunks])
+            embed_time = time.perf_counter() - started
+            print(f"[{model_name} / {chunker_spec}] embedded {len(chunks)} chunks in {embed_time:.2f}s")
+
+            for m, ef in itertools.product(m_values, ef_values):
+                build_time, rows = evaluate(client, labels, chunks, embeddings, query_embeddings, m, ef, n_results_list)
+                for row in rows:
+                    report.append({
+                        "model": model_name,
+                        "chunker": chunker_spec,
+                        "pages": len(pages),
+                        "labelled_pages": labelled_pages,
+                        "chunks": len(chunks),
+                        "hnsw_m": m,
+                        "hnsw_ef": ef,
+                        "embed_time": embed_time,
+                        "build_time": build_time,
+                        "query_embed": summarize(query_latencies),
+                        **row,
+                    })
+    return report
+
+
+def write_markdown(report, path):
+    lines = [
+        "# Retrieval benchmark",
+        "",
+        "| model | chunker | pages (labelled) | chunks | M | ef | k | recall@k | MRR | embed q p50 ms | search p50 ms | search p95 ms | build s |",
+        "|---|---|---|---|---|---|---|---|---|---|---|---|---|",
+    ]
+    for r in sorted(report, key=lambda r: (-r["recall"], -r["mrr"], r["search"]["p50"] or 0)):
+        lines.append(
+            f"| {r['model']} | {r['chunker']} | {r['pages']} ({r['labelled_pages']}) | {r['chunks']} | {r['hnsw_m']} | {r['hnsw_ef']} | {r['n_results']} "
+            f"| {r['recall']:.3f} | {r['mrr']:.3f} | {format_ms(r['query_embed']['p50'])} "
+            f"| {format_ms(r['search']['p50'])} | {format_ms(r['search']['p95'])} | {r['build_time']:.2f} |"
+        )
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def _csv(value, cast=str):
+    return [cast(v) for v in value.split(",") if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall and latency benchmark for the Chroma vector store.")
+    parser.add_argument("--labels", required=True, help="JSON/JSONL file of {question, page_id} pairs")
+    parser.add_argument("--pages", help="JSON file mapping page_id to page text for the whole corpus "
+                                        "(fetched from Confluence if omitted)")
+    parser.add_argument("--spaces", help="Comma-separated Confluence spaces to index (default: CONFLUENCE_SPACES)")
+    parser.add_argument("--save-pages", help="Write the fetched pages to this JSON file for later runs")
+    parser.add_argument("--models", default="all-MiniLM-L6-v2", help="Comma-separated embedding models, optionally <model>@<backend>")
+    parser.add_argument("--chunkers", default="line,paragraph,window:500", help="line, paragraph or window:<chars>")
+    parser.add_argument("--n-results", default="1,3,5,10", help="Comma-separated values of n_results (k)")
+    parser.add_argument("--hnsw-m", default="16", help="Comma-separated HNSW M values")
+    parser.add_argument("--hnsw-ef", default="10,50,100", help="Comma-separated HNSW search ef values")
+    parser.add_argument("--report", default="retrieval_report.md", help="Markdown comparison report")
+    parser.add_argument("--json", dest="json_path", help="Also write raw results to this JSON file")
+    args = parser.parse_args()
+
+    labels = load_labels(args.labels)
+    if args.pages:
+        with open(args.pages) as f:
+            pages = json.load(f)
+    else:
+        pages = fetch_pages(_csv(args.spaces) if args.spaces else None)
+        if args.save_pages:
+            with open(args.save_pages, "w") as f:
+                json.dump(pages, f)
+
+    report = run_benchmark(
+        pages,
+        labels,
+        models=_csv(args.models),
+        chunkers=_csv(args.chunkers),
+        n_results_list=_csv(args.n_results, int),
+        m_values=_csv(args.hnsw_m, int),
+        ef_values=_csv(args.hnsw_ef, int),
+    )
+    write_markdown(report, args.report)
+    print(f"Wrote {len(report)} rows to {args.report}")
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,31 @@
 import os
+import sys
 import requests
 from dotenv import load_dotenv
 import json
 import threading
 from requests.auth import HTTPBasicAuth
-from bs4 import BeautifulSoup
 import logging
+import time
 import chromadb
-from chromadb.utils import embedding_functions
 from tqdm import tqdm
 from typing import List
 
-# Load environment variables from a .env file
+# Load environment variables from a .env file (before the local modules read their settings)
 load_dotenv()
+
+# Shared helpers live in ../common
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embeddings import get_embedding_function
+from rerank import RERANK_CANDIDATES, RERANK_TOP_K, get_reranker
+from snapshot import VECTOR_SNAPSHOT_PATH, SnapshotCollection
+from common.confluence import ConfluenceCrawler
+from common.html_extract import extract_page_text, extract_text
+from common.metrics import LogAggregator, counter, record_span, span, start_metrics_server
+from common.startup import once, profile
+from common.sync import BackgroundSync
+
 API_URL = os.getenv('API_URL', 'http://localhost:11434/api/generate')
 CONFLUENCE_USERNAME = os.getenv('CONFLUENCE_USERNAME')
 CONFLUENCE_API_TOKEN = os.getenv('CONFLUENCE_API_TOKEN')
@@ -20,6 +33,32 @@ CONFLUENCE_BASE_URL = os.getenv('CONFLUENCE_BASE_URL')
 VECTOR_DB_PATH = os.getenv('VECTOR_DB_PATH', './vector_db')
 EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'all-MiniLM-L6-v2')
 COLLECTION_NAME = os.getenv('COLLECTION_NAME', 'confluence_pages')
+# Pages already indexed and the time of the last Confluence sync
+SYNC_STATE_PATH = os.getenv('SYNC_STATE_PATH', os.path.join(VECTOR_DB_PATH, 'confluence_sync.json'))
+# Name of the collection currently served, which changes with every background rebuild
+ACTIVE_COLLECTION_PATH = os.path.join(VECTOR_DB_PATH, 'active_collection')
+# Rows copied per request when a collection is rebuilt side by side
+COPY_BATCH_SIZE = 1000
+# Retrieval tuning, see benchmarks/retrieval.py to measure recall vs latency
+N_RESULTS = int(os.getenv('N_RESULTS', '5'))
+HNSW_M = os.getenv('HNSW_M')
+HNSW_CONSTRUCTION_EF = os.getenv('HNSW_CONSTRUCTION_EF')
+HNSW_SEARCH_EF = os.getenv('HNSW_SEARCH_EF')
+# Hits less similar to the question than this (cosine similarity, 0-1) are dropped
+MIN_SIMILARITY = float(os.getenv('MIN_SIMILARITY', '0.25'))
+# Confluence spaces searched by default, e.g. 'LEG' (empty searches every indexed space)
+SEARCH_SPACES = os.getenv('SEARCH_SPACES', '')
+# Generation settings
+LLM_MODEL = os.getenv('LLM_MODEL', 'llama3.1:latest')
+# Approximate token budget for retrieved context in the prompt (~4 characters per token)
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '1500'))
+# Previous user/assistant turns kept in the prompt
+HISTORY_TURNS = int(os.getenv('HISTORY_TURNS', '3'))
+
+# Aggregated instead of one log line per page
+INDEXED_CHUNKS = counter("bot_indexed_chunks_total", "Chunks written to the vector store")
+index_log = LogAggregator("Stored vectors", every=100)
+fetch_log = LogAggregator("Fetched Confluence pages", every=100)
 
 # Configure logging to display relevant information
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -31,34 +70,72 @@ class ChatAssistant(threading.Thread):
             You are an intelligent, polite, and helpful assistant. Your goal is to provide clear, concise, and accurate information 
             to the user. Always maintain a professional tone and ensure that your responses are relevant to the user's questions.
             If the user asks follow-up questions, connect them to the context of the previous conversation to ensure continuity.
+            Answer using only the Confluence excerpts provided as context and cite the page IDs you used, like [Page 123].
+            If the excerpts do not cover the question, say so instead of guessing.
         """
         # Context to maintain the flow of conversation
         self.context = [{"role": "system", "content": self.instructions}]
         self.running = True
         self.confluence_pages = {}
+        # Title, space, version and URL of each page, from the Confluence crawler
+        self.page_metadata = {}
 
-        # Initialize ChromaDB client with a persistent storage path
-        self.vs_client = chromadb.PersistentClient(
-            path=VECTOR_DB_PATH, settings=chromadb.Settings(allow_reset=True)
-        )
-        # Define the embedding function for creating vector representations
-        self.embedding_func = embedding_functions.SentenceTransformerEmbeddingFunction(
-            model_name=EMBEDDING_MODEL, trust_remote_code=True
-        )
+        # ChromaDB client, opened on first use (not needed to serve a snapshot)
+        self._vs_client = None
+        # Shared embedding function; the model is only loaded on first use (or warm_up)
+        self.embedding_func = get_embedding_function(EMBEDDING_MODEL)
+        # Optional cross-encoder reordering a wider candidate set (RERANK=1)
+        self.reranker = get_reranker()
         self.collection = None
+        # Spaces questions are restricted to (None for all), changed with /spaces in the chat
+        self.search_spaces = [s.strip() for s in SEARCH_SPACES.split(",") if s.strip()] or None
+        # Timings (seconds) and cited page IDs of the last generated answer
+        self.last_timings = {}
+        self.last_sources = []
+
+    # ChromaDB client with a persistent storage path
+    @property
+    def vs_client(self):
+        if self._vs_client is None:
+            self._vs_client = chromadb.PersistentClient(
+                path=VECTOR_DB_PATH, settings=chromadb.Settings(allow_reset=True)
+            )
+        return self._vs_client
+
+    # Serve questions from a memory-mapped snapshot (see snapshot.py) instead of Chroma
+    def use_snapshot(self, path: str) -> None:
+        self.collection = SnapshotCollection(path, self.embedding_func)
 
     # Set or create a vector collection
     def set_collection(self, collection_name: str, embedding_model: str = None) -> None:
         if embedding_model:
-            self.embedding_func = embedding_functions.SentenceTransformerEmbeddingFunction(
-                model_name=embedding_model, trust_remote_code=True
-            )
-        self.collection = self.vs_client.get_or_create_collection(
+            self.embedding_func = get_embedding_function(embedding_model)
+        self.collection = self.open_collection(collection_name)
+        logging.info(f"Set Collection: {collection_name}. Embedding Model: {self.embedding_func.model_name}")
+
+    # Get or create a vector collection without serving it
+    def open_collection(self, collection_name: str):
+        metadata = {"hnsw:space": "cosine", "embedding_model": self.embedding_func.model_name,
+                    "embedding_backend": self.embedding_func.backend}
+        # Optional HNSW parameters (only applied when the collection is created)
+        for key, value in (("hnsw:M", HNSW_M), ("hnsw:construction_ef", HNSW_CONSTRUCTION_EF),
+                           ("hnsw:search_ef", HNSW_SEARCH_EF)):
+            if value:
+                metadata[key] = int(value)
+        return self.vs_client.get_or_create_collection(
             name=collection_name,
             embedding_function=self.embedding_func,
-            metadata={"hnsw:space": "cosine", "embedding_model": EMBEDDING_MODEL},
+            metadata=metadata,
         )
-        logging.info(f"Set Collection: {collection_name}. Embedding Model: {EMBEDDING_MODEL}")
+
+    # Name of the collection to serve, as left by the last background refresh
+    @staticmethod
+    def active_collection_name() -> str:
+        try:
+            with open(ACTIVE_COLLECTION_PATH) as f:
+                return f.read().strip() or COLLECTION_NAME
+        except FileNotFoundError:
+            return COLLECTION_NAME
 
     # Create a collection by embedding Confluence page content
     def make_collection(self, confluence_data: dict, collection_name: str) -> None:
@@ -68,26 +145,154 @@ class ChatAssistant(threading.Thread):
 
         self.set_collection(collection_name)
 
-        for page_id, content in confluence_data.items():
-            chunks = content.split("\n")
-            logging.info(f"Embedding and storing content for page ID: {page_id}...")
+        for page_id, content in tqdm(confluence_data.items(), total=len(confluence_data)):
+            self.index_page(page_id, content)
+        index_log.flush()
 
-            for i, chunk in tqdm(enumerate(chunks, 1), total=len(chunks)):
-                if not chunk.strip():  # Skip empty lines
-                    continue
+        logging.info(f"Collection '{collection_name}' created with embedded data.")
+        stats = self.embedding_func.cache_stats()
+        if stats:
+            logging.info(
+                f"Embedding cache: {stats['hits']} hits, {stats['misses']} misses "
+                f"({stats['hit_rate']:.0%} hit rate), {stats['entries']} entries."
+            )
+
+    # Split page text into (part, chunk) pairs, one per non-empty line
+    @staticmethod
+    def chunk_page(content: str):
+        return [(i, chunk) for i, chunk in enumerate(content.split("\n"), 1) if chunk.strip()]
+
+    # IDs, documents and metadata of the chunks of one page, as stored in the collection
+    @classmethod
+    def chunk_records(cls, page_id: str, content: str, page: dict):
+        chunks = cls.chunk_page(content)
+        ids = [f"id_{page_id}_{i}" for i, _ in chunks]
+        documents = [chunk for _, chunk in chunks]
+        metadatas = [
+            {"source": page_id, "part": i, "space": page.get("space", ""), "title": page.get("title", "")}
+            for i, _ in chunks
+        ]
+        return ids, documents, metadatas
+
+    # Replace the stored chunks of one page with its current content
+    def index_page(self, page_id: str, content: str, collection=None, page_metadata: dict = None) -> int:
+        collection = collection or self.collection
+        page_metadata = self.page_metadata if page_metadata is None else page_metadata
+        ids, documents, metadatas = self.chunk_records(page_id, content, page_metadata.get(page_id, {}))
+        try:
+            with span("index_page", chunks=len(ids)):
+                collection.delete(where={"source": page_id})
+                if ids:
+                    collection.add(documents=documents, ids=ids, metadatas=metadatas)
+            INDEXED_CHUNKS.inc(len(ids))
+            index_log.add(chunks=len(ids))
+        except Exception as e:
+            logging.error(f"Failed to store vectors for page ID: {page_id}. Error: {e}")
+            raise
+        return len(ids)
+
+    # Bring the collection up to date with the configured Confluence spaces
+    def sync_confluence(self, crawler: ConfluenceCrawler, full: bool = False) -> None:
+        # An empty collection (e.g. a deleted vector_db) needs every page again
+        result = crawler.sync(full=full or self.collection.count() == 0)
+
+        # A page without text is dropped like a removed one instead of indexed empty
+        empty = []
+        for page_id, page in tqdm(result.changed.items(), total=len(result.changed)):
+            self.page_metadata[page_id] = page.metadata()
+            text_content = extract_page_text(page.html, page_id, page.version)
+            if not text_content:
+                logging.warning(f"No content found for page ID: {page_id}.")
+                empty.append(page_id)
+                continue
+            self.confluence_pages[page_id] = text_content
+            self.index_page(page_id, text_content)
+        index_log.flush()
+
+        for page_id in result.removed + empty:
+            self.collection.delete(where={"source": page_id})
+            self.confluence_pages.pop(page_id, None)
+            self.page_metadata.pop(page_id, None)
+        if result.removed:
+            logging.info(f"Removed {len(result.removed)} pages from the collection.")
+
+        crawler.commit(result)
+        self.page_metadata = dict(crawler.pages)
+
+    # Rebuild the index with the latest Confluence changes next to the served one, then swap
+    def refresh_index(self, crawler: ConfluenceCrawler) -> None:
+        result = crawler.sync()
+        if not result:
+            crawler.commit(result)
+            return
+
+        current = self.collection
+        # Nanoseconds, so two refreshes within a second never share a collection
+        new_name = f"{COLLECTION_NAME}_{time.time_ns()}"
+        new_collection = self.open_collection(new_name)
+        stale = list(result.changed) + result.removed
+
+        # Until the swap the served collection, pages and metadata are left untouched,
+        # so a failed build only drops the half-built collection
+        try:
+            # Copy the vectors of unchanged pages instead of embedding them again
+            where = {"source": {"$nin": stale}} if stale else None
+            offset = 0
+            while True:
+                batch = current.get(where=where, include=["embeddings", "documents", "metadatas"],
+                                    limit=COPY_BATCH_SIZE, offset=offset)
+                if not batch["ids"]:
+                    break
+                new_collection.add(ids=batch["ids"], embeddings=batch["embeddings"],
+                                   documents=batch["documents"], metadatas=batch["metadatas"])
+                offset += len(batch["ids"])
 
-                metadata = {"source": page_id, "part": i}
+            pages = dict(self.confluence_pages)
+            metadata = dict(self.page_metadata)
+            for page_id, page in result.changed.items():
+                metadata[page_id] = page.metadata()
+                text_content = extract_page_text(page.html, page_id, page.version)
+                if text_content:
+                    pages[page_id] = text_content
+                else:
+                    logging.warning(f"No content found for page ID: {page_id}.")
+                    pages.pop(page_id, None)
+            for page_id in result.removed:
+                pages.pop(page_id, None)
+                metadata.pop(page_id, None)
+            for page_id in result.changed:
+                if page_id in pages:
+                    self.index_page(page_id, pages[page_id], collection=new_collection, page_metadata=metadata)
+            index_log.flush()
+        except Exception:
+            try:
+                self.vs_client.delete_collection(new_name)
+            except Exception as e:
+                logging.warning(f"Failed to delete unfinished collection '{new_name}': {e}")
+            raise
+
+        # Swap: queries already running keep using the old collection object
+        self.collection = new_collection
+        self.confluence_pages = pages
+        self.page_metadata = metadata
+        with open(ACTIVE_COLLECTION_PATH, "w") as f:
+            f.write(new_name)
+        crawler.commit(result)
+        logging.info(
+            f"Swapped to collection '{new_name}' ({new_collection.count()} vectors, "
+            f"{len(result.changed)} pages changed, {len(result.removed)} removed)."
+        )
+
+        # Drop older generations; the one just replaced stays until the next refresh
+        # because queries started before the swap may still be reading it
+        for collection in self.vs_client.list_collections():
+            name = collection if isinstance(collection, str) else collection.name
+            is_generation = name == COLLECTION_NAME or name.startswith(f"{COLLECTION_NAME}_")
+            if is_generation and name not in (new_name, current.name):
                 try:
-                    self.collection.add(
-                        documents=[chunk],  # Must be a list
-                        ids=[f"id_{page_id}_{i}"],  # Must be a list
-                        metadatas=[metadata],  # Must be a list
-                    )
-                    logging.info(f"Stored vector for page ID: {page_id}, part: {i}.")
+                    self.vs_client.delete_collection(name)
                 except Exception as e:
-                    logging.error(f"Failed to store vector for page ID: {page_id}, part: {i}. Error: {e}")
-
-        logging.info(f"Collection '{collection_name}' created with embedded data.")
+                    logging.warning(f"Failed to delete old collection '{name}': {e}")
 
     # Prepare the vector database for searching
     def setup_vec_store(self, collection_name: str = COLLECTION_NAME) -> None:
@@ -106,19 +311,185 @@ class ChatAssistant(threading.Thread):
         logging.info("Initializing vector database...")
         self.make_collection(self.confluence_pages, collection_name)
 
-    # Search the vector store for a query
-    def search_vector_store(self, query: str):
-        logging.info(f"Searching vector store for query: {query}")
+    # Search the vector store for a query and its reformulations in one request,
+    # returning passages (adjacent parts of a page merged) with their source metadata
+    def search_vector_store(self, query: str, reformulations: List[str] = (), spaces: List[str] = None,
+                            n_results: int = N_RESULTS, min_similarity: float = MIN_SIMILARITY) -> List[dict]:
+        queries = list(dict.fromkeys([query, *reformulations]))
+        logging.debug(f"Searching vector store for {len(queries)} queries: {queries}")
+        where = None
+        if spaces:
+            where = {"space": spaces[0]} if len(spaces) == 1 else {"space": {"$in": list(spaces)}}
         try:
-            results = self.collection.query(
-                query_texts=[query],
-                n_results=5
-            )
-            return results.get("documents", [])
+            with span("vector_search", queries=len(queries)):
+                results = self.collection.query(
+                    query_texts=queries,
+                    n_results=n_results,
+                    where=where,
+                    include=["documents", "metadatas", "distances"],
+                )
         except Exception as e:
             logging.error(f"Failed to search vector store. Error: {e}")
             return []
 
+        # Best score of each chunk over all the queries
+        hits = {}
+        for ids, docs, metas, dists in zip(results["ids"], results["documents"], results["metadatas"], results["distances"]):
+            for id_, doc, meta, dist in zip(ids, docs, metas, dists):
+                similarity = 1.0 - dist  # The collections use cosine distance
+                if similarity < min_similarity:
+                    continue
+                if id_ not in hits or similarity > hits[id_]["similarity"]:
+                    hits[id_] = {
+                        "id": id_, "text": doc, "source": meta.get("source"), "part": meta.get("part", 0),
+                        "space": meta.get("space", ""), "title": meta.get("title", ""),
+                        "distance": dist, "similarity": similarity,
+                    }
+        return self.merge_adjacent(list(hits.values()))
+
+    # Merge hits on consecutive parts of the same page into one passage, best passages first
+    @staticmethod
+    def merge_adjacent(hits: List[dict]) -> List[dict]:
+        passages = []
+        for hit in sorted(hits, key=lambda hit: (hit["source"], hit["part"])):
+            last = passages[-1] if passages else None
+            if last and last["source"] == hit["source"] and hit["part"] == last["parts"][-1] + 1:
+                last["text"] = f"{last['text']}\n{hit['text']}"
+                last["parts"].append(hit["part"])
+                if hit["similarity"] > last["similarity"]:
+                    last["similarity"], last["distance"] = hit["similarity"], hit["distance"]
+            else:
+                passages.append({**hit, "parts": [hit["part"]]})
+        passages.sort(key=lambda passage: passage["similarity"], reverse=True)
+        return passages
+
+    # Queries for a question: the question itself and, for follow-ups, the question
+    # with the previous one, so "and for REV?" still finds the right pages
+    def reformulate(self, question: str) -> List[str]:
+        previous = [msg["content"] for msg in self.context if msg["role"] == "user"]
+        return [f"{previous[-1]} {question}"] if previous else []
+
+    # Select the passages that fit in the token budget and order them by page and part
+    @staticmethod
+    def build_context(hits: List[dict], token_budget: int = CONTEXT_TOKEN_BUDGET):
+        selected, seen, used = [], set(), 0
+        for hit in hits:  # Passages arrive ordered by relevance
+            text = hit["text"].strip()
+            key = " ".join(text.lower().split())
+            if not text or key in seen:
+                continue
+            cost = len(text) // 4 + 1
+            if used + cost > token_budget:
+                continue
+            seen.add(key)
+            used += cost
+            selected.append(hit)
+
+        # Pages in order of their best hit, parts in document order within a page
+        page_rank = {}
+        for hit in selected:
+            page_rank.setdefault(hit["source"], len(page_rank))
+        selected.sort(key=lambda hit: (page_rank[hit["source"]], hit["part"]))
+
+        blocks, current = [], None
+        for hit in selected:
+            if hit["source"] != current:
+                blocks.append(f"[Page {hit['source']}]")
+                current = hit["source"]
+            blocks.append(hit["text"].strip())
+        return "\n".join(blocks), list(page_rank)
+
+    # Build the generation prompt from the instructions, context and recent history
+    def build_prompt(self, question: str, context: str) -> str:
+        history = self.context[1:][-HISTORY_TURNS * 2:]
+        lines = [f"System: {self.instructions.strip()}"]
+        if context:
+            lines.append(f"Context:\n{context}")
+        lines.extend(f"{msg['role'].capitalize()}: {msg['content']}" for msg in history)
+        lines.append(f"User: {question}")
+        lines.append("Assistant:")
+        return "\n".join(lines)
+
+    # Answer a question with retrieved context, yielding the answer token by token
+    def generate_answer(self, question: str):
+        timings = {}
+        started = time.perf_counter()
+        n_results = RERANK_CANDIDATES if self.reranker else N_RESULTS
+        hits = self.search_vector_store(question, self.reformulate(question), spaces=self.search_spaces,
+                                        n_results=n_results)
+        timings["retrieve"] = time.perf_counter() - started
+        if self.reranker:
+            step = time.perf_counter()
+            hits = self.reranker.rerank(question, hits, RERANK_TOP_K)
+            timings["rerank"] = time.perf_counter() - step
+
+        step = time.perf_counter()
+        context, sources = self.build_context(hits)
+        prompt = self.build_prompt(question, context)
+        timings["prompt_build"] = time.perf_counter() - step
+        self.last_timings = timings
+        self.last_sources = sources
+
+        if not context:
+            timings["total"] = time.perf_counter() - started
+            yield "Sorry, I couldn't find relevant information."
+            return
+
+        step = time.perf_counter()
+        answer_parts = []
+        try:
+            for token in self.stream_model(prompt):
+                if "first_token" not in timings:
+                    timings["first_token"] = time.perf_counter() - step
+                answer_parts.append(token)
+                yield token
+        except requests.exceptions.RequestException as e:
+            yield f"HTTP Request failed: {e}"
+            return
+        except RuntimeError as e:
+            yield str(e)
+            return
+        finally:
+            timings["total"] = time.perf_counter() - started
+
+        # Keep the plain question and answer (without the retrieved context) as history
+        self.context.append({"role": "user", "content": question})
+        self.context.append({"role": "assistant", "content": "".join(answer_parts).strip()})
+
+    # Stream the model's answer to a prompt token by token
+    @staticmethod
+    def stream_model(prompt: str):
+        started = time.perf_counter()
+        error = None
+        try:
+            response = requests.post(API_URL, json={"model": LLM_MODEL, "prompt": prompt}, stream=True)
+            if response.status_code != 200:
+                raise RuntimeError(f"Error: Received status code {response.status_code}")
+
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                try:
+                    part = json.loads(line)
+                except json.JSONDecodeError as e:
+                    logging.error(f"Failed to decode part: {line}, Error: {e}")
+                    continue
+                token = part.get("response", "")
+                if token:
+                    yield token
+                if part.get("done", False):
+                    break
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            record_span("llm_call", time.perf_counter() - started, f"ollama/{LLM_MODEL}", error)
+
+    # Link to a Confluence page from its ID
+    def page_url(self, page_id: str) -> str:
+        url = self.page_metadata.get(page_id, {}).get("url")
+        return url or f"{CONFLUENCE_BASE_URL}/pages/viewpage.action?pageId={page_id}"
+
     # Fetch Confluence pages by ID and store their content
     def fetch_confluence_pages(self, page_ids):
         if not page_ids:
@@ -126,29 +497,32 @@ class ChatAssistant(threading.Thread):
             return
 
         for page_id in page_ids:
-            url = f"{CONFLUENCE_BASE_URL}/rest/api/content/{page_id}?expand=body.view"
+            url = f"{CONFLUENCE_BASE_URL}/rest/api/content/{page_id}?expand=body.view,version"
             auth = HTTPBasicAuth(CONFLUENCE_USERNAME, CONFLUENCE_API_TOKEN)
             try:
-                response = requests.get(url, auth=auth)
-                response.raise_for_status()
+                with span("confluence_fetch", "page"):
+                    response = requests.get(url, auth=auth)
+                    response.raise_for_status()
                 data = response.json()
                 html_content = data.get('body', {}).get('view', {}).get('value', '')
                 if not html_content:
                     logging.warning(f"No content found for page ID: {page_id}. Skipping.")
                     continue
 
-                text_content = self.extract_text_from_html(html_content)
+                # Cached per page version, so unchanged pages are not parsed again
+                version = data.get('version', {}).get('number')
+                text_content = extract_page_text(html_content, page_id, version)
                 self.confluence_pages[page_id] = text_content
-                logging.info(f"Fetched and stored content for page ID: {page_id}")
+                fetch_log.add(chars=len(text_content))
             except Exception as e:
                 logging.error(f"Error fetching page {page_id}: {e}")
+        fetch_log.flush()
 
     # Extract plain text from HTML content
     @staticmethod
     def extract_text_from_html(html_content):
         try:
-            soup = BeautifulSoup(html_content, 'html.parser')
-            return soup.get_text()
+            return extract_text(html_content)
         except Exception as e:
             logging.error(f"Error extracting text: {e}")
             return None
@@ -163,32 +537,84 @@ class ChatAssistant(threading.Thread):
                 self.running = False
                 break
             
-            # Search the vector store for relevant information
-            results = self.search_vector_store(user_message)
-            if results:
-                response = "\n\n\n".join([f"Result: {doc}" for doc in results])
-            else:
-                response = "Sorry, I couldn't find relevant information."
+            if user_message.startswith("/spaces"):
+                # e.g. "/spaces LEG,REV" to search only those spaces, "/spaces" to search all
+                self.search_spaces = [s.strip() for s in user_message[len("/spaces"):].split(",") if s.strip()] or None
+                print(f"Searching {', '.join(self.search_spaces) if self.search_spaces else 'all spaces'}.")
+                continue
 
-            print(f"Assistant: {response}")
+            print("Assistant: ", end="", flush=True)
+            for token in self.generate_answer(user_message):
+                print(token, end="", flush=True)
+            print()
+            if self.last_sources:
+                print("Sources:")
+                for page_id in self.last_sources:
+                    print(f"  - [Page {page_id}] {self.page_url(page_id)}")
 
-# Entry point to initialize and run the assistant
-if __name__ == '__main__':
-    if API_URL and CONFLUENCE_USERNAME and CONFLUENCE_API_TOKEN and CONFLUENCE_BASE_URL:
-        assistant = ChatAssistant()
-
-        # Fetch Confluence pages and set up vector store
-        page_ids = [
-            '756056110', '2328166682', '152338450', '2160722036', '2666594400',
-            '2971795516', '93126701', '2868445326', '872251404', '1634533508',
-            '1902674264', '772407317', '68354666', '772735036', '772735051',
-            '771096867', '791412877', '2975596629', '2847507373', '2716074132',
-            '275152964'
-        ]
-        assistant.fetch_confluence_pages(page_ids)
-        assistant.setup_vec_store(COLLECTION_NAME)
+            timings = self.last_timings
+            logging.info(
+                "Timings: " + ", ".join(f"{name}={timings[name] * 1000:.0f}ms"
+                                        for name in ("retrieve", "rerank", "prompt_build", "first_token", "total")
+                                        if name in timings)
+            )
+
+# The launcher leaves marking the bot ready to main(), which can only answer once the index is loaded
+MARKS_READY = True
+
+def configured() -> bool:
+    return bool(API_URL and CONFLUENCE_USERNAME and CONFLUENCE_API_TOKEN and CONFLUENCE_BASE_URL)
 
-        assistant.start()
-        assistant.join()
-    else:
+# The assistant with its index loaded, and the crawler keeping it fresh (None when serving a snapshot)
+@once("index_load")
+def get_assistant():
+    if not configured():
+        raise ValueError("Missing required environment variables")
+    assistant = ChatAssistant()
+
+    # Load the embedding model in the background while Confluence pages are fetched
+    assistant.embedding_func.warm_up()
+    if assistant.reranker:
+        assistant.reranker.warm_up()
+
+    if VECTOR_SNAPSHOT_PATH and os.path.exists(VECTOR_SNAPSHOT_PATH):
+        # Read-only worker: the snapshot is exported by the indexing process
+        # (python snapshot.py export) and picked up again when replaced
+        assistant.use_snapshot(VECTOR_SNAPSHOT_PATH)
+        return assistant, None
+
+    # Index the pages of the configured spaces that changed since the last run
+    crawler = ConfluenceCrawler.from_env(state_path=SYNC_STATE_PATH)
+    assistant.set_collection(assistant.active_collection_name())
+    assistant.sync_confluence(crawler)
+    return assistant, crawler
+
+def prewarm():
+    """Loads the index, the embedding model and the reranker before the first question."""
+    assistant, _ = get_assistant()
+    assistant.embedding_func.load()
+    if assistant.reranker:
+        assistant.reranker.load()
+
+# Entry point to initialize and run the assistant
+def main():
+    if not configured():
         print("Error: Missing required environment variables.")
+        return
+    start_metrics_server()
+    # Waits for the prewarm when the launcher started one
+    assistant, crawler = get_assistant()
+    profile.mark_ready()
+
+    # Keep the knowledge base fresh while serving, without blocking questions
+    syncer = BackgroundSync(lambda: assistant.refresh_index(crawler)) if crawler else None
+    if syncer:
+        syncer.start()
+    assistant.start()
+    assistant.join()
+    if syncer:
+        syncer.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+# Shared helpers live in ../common (also in the spawned worker processes)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from embeddings import EMBEDDING_BACKEND, LazyEmbeddingFunction
+
+# Embedding processes; one core is left to the writer and the pool's plumbing
+BACKFILL_WORKERS = int(os.getenv('BACKFILL_WORKERS', str(max(1, (os.cpu_count() or 2) - 1))))
+# Chunks encoded per task; large enough to amortise inter-process transfer
+BACKFILL_BATCH_SIZE = int(os.getenv('BACKFILL_BATCH_SIZE', '256'))
+
+# The embedding model of a worker process, loaded once by _init_worker
+_worker_model = None
+
+
+def _init_worker(model_name, backend, threads):
+    global _worker_model
+    # Without a limit every worker would start one thread per core and fight over them:
+    # torch takes a process-wide setting, ONNX Runtime one per session
+    if backend == "torch":
+        try:
+            import torch
+
+            torch.set_num_threads(threads)
+        except ImportError:
+            pass
+    _worker_model = LazyEmbeddingFunction(model_name, backend, threads=threads)
+    _worker_model.load()
+
+
+def _encode_batch(task):
+    """Encodes one batch in a worker: (batch number, vectors, worker PID, seconds spent encoding)."""
+    number, texts = task
+    started = time.perf_counter()
+    vectors = np.asarray(_worker_model(texts), dtype=np.float32)
+    return number, vectors, os.getpid(), time.perf_counter() - started
+
+
+class Checkpoint:
+    """
+    Pages (ID and version) whose chunks are all written to the collection, saved
+    after every batch so an interrupted backfill resumes where it stopped. Only
+    a run with the same collection, model and backend resumes from it, since
+    other backends produce different vectors.
+    """
+
+    def __init__(self, path: str, collection: str, model: str, backend: str = EMBEDDING_BACKEND):
+        self.path = path
+        self.key = {"collection": collection, "model": model, "backend": backend}
+        self.done = {}
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    state = json.load(f)
+                if state.get("key") == self.key:
+                    self.done = state.get("done", {})
+                else:
+                    logging.info(f"Ignoring checkpoint {path}, it belongs to another collection, model or backend")
+            except (OSError, json.JSONDecodeError) as e:
+                logging.error(f"Could not read checkpoint {path}, starting over: {e}")
+
+    def is_done(self, page_id, version) -> bool:
+        return self.done.get(page_id) == version
+
+    def mark(self, page_id, version):
+        self.done[page_id] = version
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"key": self.key, "done": self.done}, f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def make_batches(pages, chunk_records, batch_size):
+    """
+    Splits the chunks of every page into batches of about batch_size chunks.
+    Returns the batches (lists of (page_id, id, document, metadata)) and, per
+    page, the number of the batch holding its last chunk (-1 for pages without text).
+    """
+    batches, current, last_batch = [], [], {}
+    for page_id, (content, page) in pages.items():
+        ids, documents, metadatas = chunk_records(page_id, content, page)
+        for row in zip(ids, documents, metadatas):
+            current.append((page_id, *row))
+            if len(current) == batch_size:
+                batches.append(current)
+                current = []
+        if not ids:
+            last_batch[page_id] = -1
+        else:
+            last_batch[page_id] = len(batches) if current else len(batches) - 1
+    if current:
+        batches.append(current)
+    return batches, last_batch
+
+
+def backfill(collection, model_name, pages, removed, checkpoint, chunk_records,
+             workers=BACKFILL_WORKERS, batch_size=BACKFILL_BATCH_SIZE, backend=EMBEDDING_BACKEND) -> dict:
+    """
+    Embeds the chunks of `pages` ({page_id: (text, metadata)}) in `workers`
+    processes and writes them to `collection` from this process only, so Chroma
+    never sees concurrent writers. Pages are recorded in the checkpoint once all
+    their chunks are written.
+    """
+    todo = {page_id: value for page_id, value in pages.items()
+            if not checkpoint.is_done(page_id, value[1].get("version"))}
+    if len(todo) < len(pages):
+        logging.info(f"Resuming: {len(pages) - len(todo)} of {len(pages)} pages already written")
+    batches, last_batch = make_batches(todo, chunk_records, batch_size)
+    # Pages whose batch is written, by batch number
+    finishing = {}
+    for page_id, number in last_batch.items():
+        finishing.setdefault(number, []).append(page_id)
+
+    total_chunks = sum(len(batch) for batch in batches)
+    tasks = [(number, [row[2] for row in batch]) for number, batch in enumerate(batches)]
+    threads = max(1, (os.cpu_count() or 1) // max(1, workers))
+    busy = {}
+    write_seconds = 0.0
+    first_batch = None
+    cleared = set()
+    started = time.perf_counter()
+
+    def write(number, vectors):
+        nonlocal write_seconds, first_batch
+        batch = batches[number]
+        step = time.perf_counter()
+        if first_batch is None:
+            first_batch = step - started
+        # Old chunks of a page go just before its first new ones
+        for page_id in dict.fromkeys(row[0] for row in batch):
+            if page_id not in cleared:
+                collection.delete(where={"source": page_id})
+                cleared.add(page_id)
+        collection.upsert(
+            ids=[row[1] for row in batch],
+            embeddings=vectors.tolist(),
+            documents=[row[2] for row in batch],
+            metadatas=[row[3] for row in batch],
+        )
+        if number in finishing:
+            for page_id in finishing[number]:
+                checkpoint.mark(page_id, todo[page_id][1].get("version"))
+            checkpoint.save()
+        write_seconds += time.perf_counter() - step
+
+    # Pages without any text still replace what was stored for them
+    for page_id, number in last_batch.items():
+        if number < 0:
+            collection.delete(where={"source": page_id})
+            checkpoint.mark(page_id, todo[page_id][1].get("version"))
+
+    if workers > 0 and tasks:
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(workers, initializer=_init_worker, initargs=(model_name, backend, threads)) as pool:
+            # In order, so a page is only checkpointed after all its batches
+            for number, vectors, pid, seconds in pool.imap(_encode_batch, tasks):
+                busy[pid] = busy.get(pid, 0.0) + seconds
+                write(number, vectors)
+                if number % 20 == 0:
+                    logging.info(f"Backfill: {number + 1}/{len(tasks)} batches written")
+    elif tasks:
+        _init_worker(model_name, backend, os.cpu_count() or 1)
+        for task in tasks:
+            number, vectors, pid, seconds = _encode_batch(task)
+            busy[pid] = busy.get(pid, 0.0) + seconds
+            write(number, vectors)
+
+    for page_id in removed:
+        collection.delete(where={"source": page_id})
+    checkpoint.save()
+
+    elapsed = time.perf_counter() - started
+    cores = max(1, workers) * threads if workers > 0 else (os.cpu_count() or 1)
+    encode_seconds = sum(busy.values())
+    report = {
+        "pages": len(todo),
+        "chunks": total_chunks,
+        "workers": workers,
+        "threads_per_worker": threads if workers > 0 else cores,
+        "seconds": round(elapsed, 2),
+        # Includes loading the model in every worker
+        "first_batch_seconds": round(first_batch or 0.0, 2),
+        "write_seconds": round(write_seconds, 2),
+        "chunks_per_second": round(total_chunks / elapsed, 1) if elapsed else 0.0,
+        "chunks_per_second_per_core": round(total_chunks / elapsed / cores, 1) if elapsed else 0.0,
+        # Chunks per second of a worker while it is encoding
+        "encode_rate_per_worker": round(total_chunks / encode_seconds, 1) if encode_seconds else 0.0,
+    }
+    return report
+
+
+def main():
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    from app import EMBEDDING_MODEL, SYNC_STATE_PATH, VECTOR_DB_PATH, ChatAssistant
+    from common.confluence import ConfluenceCrawler
+    from common.html_extract import extract_page_text
+
+    parser = argparse.ArgumentParser(description="Index whole Confluence spaces with a pool of embedding processes.")
+    parser.add_argument("--workers", type=int, default=BACKFILL_WORKERS, help="Embedding processes (0: encode in this process)")
+    parser.add_argument("--batch-size", type=int, default=BACKFILL_BATCH_SIZE)
+    parser.add_argument("--full", action="store_true", help="Re-index every page, not only the changed ones")
+    parser.add_argument("--collection", help="Collection to fill (default: the one being served)")
+    parser.add_argument("--checkpoint", default=os.path.join(VECTOR_DB_PATH, "backfill_checkpoint.json"))
+    args = parser.parse_args()
+
+    assistant = ChatAssistant()
+    name = args.collection or assistant.active_collection_name()
+    assistant.set_collection(name)
+    crawler = ConfluenceCrawler.from_env(state_path=SYNC_STATE_PATH)
+    result = crawler.sync(full=args.full or assistant.collection.count() == 0)
+
+    pages = {}
+    for page_id, page in result.changed.items():
+        pages[page_id] = (extract_page_text(page.html, page_id, page.version), page.metadata())
+
+    checkpoint = Checkpoint(args.checkpoint, name, EMBEDDING_MODEL, EMBEDDING_BACKEND)
+    report = backfill(assistant.collection, EMBEDDING_MODEL, pages, result.removed, checkpoint,
+                      ChatAssistant.chunk_records, workers=args.workers, batch_size=args.batch_size,
+                      backend=EMBEDDING_BACKEND)
+    crawler.commit(result)
+    checkpoint.clear()
+    logging.info(
+        f"Backfill of '{name}': {report['chunks']} chunks from {report['pages']} pages in {report['seconds']}s "
+        f"({report['chunks_per_second']} chunks/s, {report['chunks_per_second_per_core']} per core, "
+        f"{report['workers']} workers x {report['threads_per_worker']} threads, "
+        f"{report['first_batch_seconds']}s to the first batch, {report['write_seconds']}s writing)"
+    )
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Callable, List, Sequence
+
+# SQLite file for cached embeddings ('' disables the cache)
+EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', './embedding_cache.sqlite')
+# Maximum number of cached vectors before the least recently used ones are evicted
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv('EMBEDDING_CACHE_MAX_ENTRIES', '200000'))
+
+# SQLite limits the number of bound parameters per statement
+_BATCH = 500
+
+
+class EmbeddingCache:
+    """
+    Persistent embedding cache keyed by model name + SHA-256 of the text.
+    Vectors are stored as float32 blobs; when the cache grows past max_entries
+    the least recently used tenth is evicted.
+    """
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def make_key(model_name: str, text: str) -> str:
+        return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def embed(self, model_name: str, texts: Sequence[str], compute: Callable[[List[str]], Sequence]) -> List[List[float]]:
+        """
+        Returns embeddings for texts, calling compute only for texts that are not
+        cached yet (each distinct text is computed once per call).
+        """
+        keys = [self.make_key(model_name, text) for text in texts]
+        found = self._lookup(keys)
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+
+        if missing:
+            vectors = compute(list(missing.values()))
+            computed = {key: [float(x) for x in vector] for key, vector in zip(missing, vectors)}
+            self._store(computed)
+            found.update(computed)
+
+        with self._lock:
+            self.misses += len(missing)
+            self.hits += len(texts) - len(missing)
+        return [found[key] for key in keys]
+
+    def _lookup(self, keys):
+        found = {}
+        now = time.time()
+        unique = list(dict.fromkeys(keys))
+        with self._lock:
+            for start in range(0, len(unique), _BATCH):
+                batch = unique[start:start + _BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+                if rows:
+                    hit_keys = [key for key, _ in rows]
+                    self._conn.execute(
+                        f"UPDATE embeddings SET last_used = ? WHERE key IN ({','.join('?' * len(hit_keys))})",
+                        [now, *hit_keys],
+                    )
+            self._conn.commit()
+        return found
+
+    def _store(self, vectors):
+        now = time.time()
+        rows = [(key, array("f", vector).tobytes(), now) for key, vector in vectors.items()]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", rows
+            )
+            # Counted again rather than tracked: other processes may share the file.
+            # The insert holds the write lock, so nobody else evicts in between
+            self._entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            if self._entries > self.max_entries:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        # Drop down to 90% of the limit so eviction doesn't run on every insert
+        excess = self._entries - int(self.max_entries * 0.9)
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+            (excess,),
+        )
+        self._entries -= excess
+        self.evictions += excess
+        logging.info(f"Evicted {excess} embeddings from the cache at {self.path}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": self._entries,
+                "evictions": self.evictions,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """Returns the process-wide embedding cache, or None when it is disabled."""
+    global _cache
+    if not EMBEDDING_CACHE_PATH:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = EmbeddingCache()
+            except sqlite3.Error as e:
+                logging.error(f"Embedding cache disabled, could not open {EMBEDDING_CACHE_PATH}: {e}")
+                return None
+        return _cache
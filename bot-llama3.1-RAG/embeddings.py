@@ -0,0 +1,116 @@
+import logging
+import os
+import threading
+import time
+
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+from chromadb.utils import embedding_functions
+
+from common.metrics import counter, span
+from common.startup import profile
+from embedding_cache import get_embedding_cache
+
+# Embedding backend: 'torch' (default), 'onnx' or 'onnx-int8' (quantized ONNX, fastest on CPU)
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'torch')
+# Quantized weights file inside the model repository used by the 'onnx-int8' backend
+ONNX_INT8_FILE = os.getenv('ONNX_INT8_FILE', 'onnx/model_qint8_avx512_vnni.onnx')
+
+# One shared instance per (model, backend), see get_embedding_function
+_registry = {}
+_registry_lock = threading.Lock()
+
+EMBEDDED_TEXTS = counter("bot_embedding_texts_total", "Texts passed to the embedding function", ("model",))
+
+
+class LazyEmbeddingFunction(EmbeddingFunction):
+    """
+    Chroma embedding function that only loads the SentenceTransformer model the
+    first time it is needed. Instances are shared through get_embedding_function,
+    so every collection and thread using the same model uses one loaded copy.
+    Texts already in the embedding cache are served without touching the model.
+    """
+
+    def __init__(self, model_name: str, backend: str = EMBEDDING_BACKEND, cache=None, threads: int = None):
+        self.model_name = model_name
+        self.backend = backend
+        self.cache = cache
+        # Intra-op threads of the ONNX Runtime session (None: one per core); torch is set globally
+        self.threads = threads
+        self._model = None
+        self._lock = threading.Lock()
+        self._warmup_thread = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    def load(self):
+        """Loads the model once; concurrent callers wait for the same load."""
+        if self._model is not None:
+            return self._model
+        with self._lock:
+            if self._model is None:
+                started = time.perf_counter()
+                kwargs = {"trust_remote_code": True}
+                if self.backend in ("onnx", "onnx-int8"):
+                    kwargs["backend"] = "onnx"
+                    model_kwargs = {}
+                    if self.backend == "onnx-int8":
+                        model_kwargs["file_name"] = ONNX_INT8_FILE
+                    if self.threads:
+                        import onnxruntime
+
+                        options = onnxruntime.SessionOptions()
+                        options.intra_op_num_threads = self.threads
+                        options.inter_op_num_threads = 1
+                        model_kwargs["session_options"] = options
+                    if model_kwargs:
+                        kwargs["model_kwargs"] = model_kwargs
+                elif self.backend != "torch":
+                    raise ValueError(f"Unknown embedding backend: {self.backend}")
+                self._model = embedding_functions.SentenceTransformerEmbeddingFunction(
+                    model_name=self.model_name, **kwargs
+                )
+                seconds = time.perf_counter() - started
+                profile.record("model_load", seconds)
+                logging.info(f"Loaded embedding model {self.model_name} ({self.backend}) in {seconds:.2f}s")
+        return self._model
+
+    def warm_up(self) -> threading.Thread:
+        """Starts loading the model in a background thread and returns the thread."""
+        with self._lock:
+            if self._warmup_thread is None:
+                self._warmup_thread = threading.Thread(target=self._warm_up, name=f"warmup-{self.model_name}", daemon=True)
+                self._warmup_thread.start()
+        return self._warmup_thread
+
+    def _warm_up(self):
+        try:
+            self.load()
+        except Exception as e:
+            # The next real call will retry the load and surface the error
+            logging.error(f"Failed to warm up embedding model {self.model_name}: {e}")
+
+    def __call__(self, input: Documents) -> Embeddings:
+        EMBEDDED_TEXTS.inc(len(input), model=self.model_name)
+        if self.cache is None:
+            return self._encode(input)
+        # Quantized backends produce different vectors, so they get their own keys
+        return self.cache.embed(f"{self.model_name}:{self.backend}", input, self._encode)
+
+    def _encode(self, texts):
+        function = self.load()
+        with span("embed", self.model_name, texts=len(texts)):
+            return function(texts)
+
+    def cache_stats(self) -> dict:
+        return self.cache.stats() if self.cache else {}
+
+
+def get_embedding_function(model_name: str, backend: str = EMBEDDING_BACKEND) -> LazyEmbeddingFunction:
+    """Returns the shared lazy embedding function for a model and backend."""
+    key = (model_name, backend)
+    with _registry_lock:
+        if key not in _registry:
+            _registry[key] = LazyEmbeddingFunction(model_name, backend, cache=get_embedding_cache())
+        return _registry[key]
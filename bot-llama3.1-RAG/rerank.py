@@ -0,0 +1,158 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List
+
+from common.metrics import counter, span
+from common.singleflight import normalize_prompt
+from common.startup import profile
+
+# Rerank retrieved passages with a cross-encoder ('1' to enable)
+RERANK = os.getenv('RERANK', '0') == '1'
+# Small CPU-friendly cross-encoder trained for passage ranking
+RERANK_MODEL = os.getenv('RERANK_MODEL', 'cross-encoder/ms-marco-MiniLM-L-6-v2')
+# Chunks retrieved as candidates when reranking (instead of N_RESULTS)
+RERANK_CANDIDATES = int(os.getenv('RERANK_CANDIDATES', '20'))
+# Passages kept after reranking
+RERANK_TOP_K = int(os.getenv('RERANK_TOP_K', '3'))
+# Time allowed for scoring per question; candidates not scored in time keep their retrieval order
+RERANK_BUDGET_MS = float(os.getenv('RERANK_BUDGET_MS', '200'))
+RERANK_BATCH_SIZE = int(os.getenv('RERANK_BATCH_SIZE', '16'))
+# (question, passage) scores kept in memory
+RERANK_CACHE_SIZE = int(os.getenv('RERANK_CACHE_SIZE', '20000'))
+
+RERANK_PAIRS = counter("bot_rerank_pairs_total", "Question/passage pairs seen by the reranker", ("result",))
+
+
+class Reranker:
+    """
+    Reorders retrieved passages by the score of a local cross-encoder, which
+    reads the question and the passage together and ranks far better than the
+    embedding distance. The model is loaded on first use (or warm_up). Scores
+    are cached per (question, passage), and scoring stops when the latency
+    budget would be exceeded: unscored passages follow the scored ones in their
+    retrieval order, so a slow host degrades to plain vector search.
+    """
+
+    def __init__(self, model_name: str = RERANK_MODEL, batch_size: int = RERANK_BATCH_SIZE,
+                 budget_ms: float = RERANK_BUDGET_MS, cache_size: int = RERANK_CACHE_SIZE):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.budget_ms = budget_ms
+        self.cache_size = cache_size
+        self._model = None
+        self._lock = threading.Lock()
+        self._warmup_thread = None
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    def load(self):
+        if self._model is not None:
+            return self._model
+        with self._lock:
+            if self._model is None:
+                from sentence_transformers import CrossEncoder
+
+                started = time.perf_counter()
+                self._model = CrossEncoder(self.model_name, device="cpu")
+                seconds = time.perf_counter() - started
+                profile.record("rerank_model_load", seconds)
+                logging.info(f"Loaded reranker {self.model_name} in {seconds:.2f}s")
+        return self._model
+
+    def warm_up(self) -> threading.Thread:
+        """Starts loading the model in a background thread and returns the thread."""
+        with self._lock:
+            if self._warmup_thread is None:
+                self._warmup_thread = threading.Thread(target=self._warm_up, name="warmup-reranker", daemon=True)
+                self._warmup_thread.start()
+        return self._warmup_thread
+
+    def _warm_up(self):
+        try:
+            self.load()
+        except Exception as e:
+            logging.error(f"Failed to load reranker {self.model_name}: {e}")
+
+    def _key(self, question, text):
+        return hashlib.sha1(f"{question}\0{text}".encode("utf-8")).hexdigest()
+
+    def _cached(self, key):
+        with self._cache_lock:
+            score = self._cache.get(key)
+            if score is not None:
+                self._cache.move_to_end(key)
+            return score
+
+    def _store(self, scores):
+        with self._cache_lock:
+            self._cache.update(scores)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def rerank(self, question: str, passages: List[dict], top_k: int = RERANK_TOP_K) -> List[dict]:
+        """The top_k passages by cross-encoder score (each with a 'rerank_score')."""
+        if not passages:
+            return passages
+        if not self.loaded:
+            # Don't make a question wait for the model: answer from vector search meanwhile
+            self.warm_up()
+            RERANK_PAIRS.inc(len(passages), result="skipped")
+            return passages[:top_k]
+
+        # Cached under the normalised question, but the model reads the question as asked
+        cache_question = normalize_prompt(question)
+        keys = [self._key(cache_question, passage["text"]) for passage in passages]
+        scores = {}
+        for key in keys:
+            score = self._cached(key)
+            if score is not None:
+                scores[key] = score
+        RERANK_PAIRS.inc(len(scores), result="cached")
+
+        # Score the rest in retrieval order, batch by batch, within the budget
+        pending = [(key, passage) for key, passage in zip(keys, passages) if key not in scores]
+        started = time.perf_counter()
+        last_batch = 0.0
+        with span("rerank", self.model_name, pairs=len(pending)):
+            for start in range(0, len(pending), self.batch_size):
+                elapsed = time.perf_counter() - started
+                if start and (elapsed + last_batch) * 1000 > self.budget_ms:
+                    RERANK_PAIRS.inc(len(pending) - start, result="skipped")
+                    break
+                batch = pending[start:start + self.batch_size]
+                step = time.perf_counter()
+                values = self.load().predict([(question, passage["text"]) for _, passage in batch],
+                                             batch_size=self.batch_size, show_progress_bar=False)
+                last_batch = time.perf_counter() - step
+                computed = {key: float(value) for (key, _), value in zip(batch, values)}
+                self._store(computed)
+                scores.update(computed)
+                RERANK_PAIRS.inc(len(batch), result="scored")
+
+        scored = [dict(passage, rerank_score=scores[key]) for key, passage in zip(keys, passages) if key in scores]
+        scored.sort(key=lambda passage: passage["rerank_score"], reverse=True)
+        unscored = [passage for key, passage in zip(keys, passages) if key not in scores]
+        return (scored + unscored)[:top_k]
+
+
+_reranker = None
+_reranker_lock = threading.Lock()
+
+
+def get_reranker():
+    """The shared reranker, or None when RERANK is off."""
+    global _reranker
+    if not RERANK:
+        return None
+    with _reranker_lock:
+        if _reranker is None:
+            _reranker = Reranker()
+        return _reranker
@@ -0,0 +1,300 @@
+import argparse
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import time
+
+import numpy as np
+
+# Shared helpers live in ../common (also when run as a script)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.metrics import span
+
+# Snapshot served instead of the Chroma store when the file exists ('' disables it)
+VECTOR_SNAPSHOT_PATH = os.getenv('VECTOR_SNAPSHOT_PATH', '')
+# 'float16' (near-exact scores) or 'int8' (half the size, one scale per vector)
+SNAPSHOT_DTYPE = os.getenv('SNAPSHOT_DTYPE', 'float16')
+
+MAGIC = b"VSNAP001"
+# Sections start on cache-line boundaries so NumPy views over the mmap are aligned
+ALIGN = 64
+# Rows scored per block, bounding the float32 copy made of a quantized block
+SEARCH_BLOCK_ROWS = 65536
+# Rows read per request when exporting a Chroma collection
+EXPORT_BATCH_SIZE = 1000
+
+
+def _pad(f):
+    f.write(b"\0" * (-f.tell() % ALIGN))
+
+
+def quantize(vectors: np.ndarray, dtype: str):
+    """L2-normalised vectors in the snapshot dtype, and the per-row scales for int8."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms == 0, 1, norms)
+    if dtype in ("float32", "float16"):
+        return vectors.astype(dtype), None
+    if dtype == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    raise ValueError(f"Unknown snapshot dtype: {dtype}")
+
+
+def write_snapshot(path: str, ids, embeddings, documents, metadatas, model: str, backend: str,
+                   dtype: str = SNAPSHOT_DTYPE) -> dict:
+    """
+    Writes a snapshot file: a JSON header (with the embedding model and backend
+    the vectors come from), the quantized vectors, their scales
+    (int8), one space code per row (for filters) and the records (ID, document,
+    metadata) as JSON lines with an offset table, so a search only decodes its
+    hits. The file is written next to `path` and renamed over it, so processes
+    serving the previous snapshot keep a consistent view.
+    """
+    vectors, scales = quantize(embeddings, dtype)
+    count, dim = vectors.shape if len(vectors) else (0, 0)
+    spaces = sorted({(meta or {}).get("space", "") for meta in metadatas})
+    space_index = {space: i for i, space in enumerate(spaces)}
+    codes = np.array([space_index[(meta or {}).get("space", "")] for meta in metadatas], dtype=np.uint16)
+
+    records = [
+        json.dumps({"id": id_, "document": doc, "metadata": meta}, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        for id_, doc, meta in zip(ids, documents, metadatas)
+    ]
+    offsets = np.zeros(count + 1, dtype=np.uint64)
+    if records:
+        offsets[1:] = np.cumsum([len(record) for record in records])
+
+    arrays = [("vectors", vectors), ("space_codes", codes), ("record_offsets", offsets)]
+    if scales is not None:
+        arrays.append(("scales", scales))
+
+    # Section offsets are relative to the aligned end of the header
+    sections, position = {}, 0
+    for name, array in arrays:
+        sections[name] = [position, array.nbytes]
+        position += array.nbytes + (-array.nbytes % ALIGN)
+    sections["records"] = [position, int(offsets[-1])]
+    header = {
+        "version": 2, "model": model, "backend": backend, "dtype": dtype, "count": int(count), "dim": int(dim),
+        "spaces": spaces, "sections": sections, "created": time.time(),
+    }
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_start = len(MAGIC) + 8 + len(header_bytes)
+    data_start += -data_start % ALIGN
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", data_start))
+        f.write(header_bytes)
+        _pad(f)
+        for name, array in arrays:
+            f.write(np.ascontiguousarray(array).tobytes())
+            _pad(f)
+        for record in records:
+            f.write(record)
+    os.replace(tmp_path, path)
+    return header
+
+
+class VectorSnapshot:
+    """
+    A snapshot file opened read-only through mmap: opening only parses the
+    header, and every process serving the same file shares its pages through
+    the OS page cache. Search is exact (brute force over all vectors).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.stat = os.stat(path)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a vector snapshot")
+        data_start, = struct.unpack_from("<Q", self._mmap, len(MAGIC))
+        self.header = json.loads(bytes(self._mmap[len(MAGIC) + 8:data_start]).rstrip(b"\0"))
+        self.model = self.header["model"]
+        # Missing from version 1 files, which are then treated as stale
+        self.backend = self.header.get("backend")
+        self.count = self.header["count"]
+        self.dim = self.header["dim"]
+        self.spaces = self.header["spaces"]
+        sections = self.header["sections"]
+
+        def view(name, dtype, shape):
+            offset, nbytes = sections[name]
+            return np.frombuffer(self._mmap, dtype=dtype, count=nbytes // np.dtype(dtype).itemsize,
+                                 offset=data_start + offset).reshape(shape)
+
+        self.vectors = view("vectors", self.header["dtype"], (self.count, self.dim))
+        self.scales = view("scales", np.float32, (self.count,)) if "scales" in sections else None
+        self.space_codes = view("space_codes", np.uint16, (self.count,))
+        self._offsets = view("record_offsets", np.uint64, (self.count + 1,))
+        self._records_start = data_start + sections["records"][0]
+
+    def record(self, row: int) -> dict:
+        start = self._records_start + int(self._offsets[row])
+        end = self._records_start + int(self._offsets[row + 1])
+        return json.loads(self._mmap[start:end])
+
+    def _allowed_codes(self, where):
+        """Space codes matching a Chroma-style filter on 'space', or None for all rows."""
+        if not where:
+            return None
+        if set(where) != {"space"}:
+            raise ValueError(f"Snapshots only filter on 'space', not {where}")
+        condition = where["space"]
+        wanted = condition["$in"] if isinstance(condition, dict) else [condition]
+        return np.array([i for i, space in enumerate(self.spaces) if space in wanted], dtype=np.uint16)
+
+    def search(self, query_embeddings, n_results: int = 5, where: dict = None):
+        """(rows, similarities) per query, best first."""
+        queries, _ = quantize(np.asarray(query_embeddings, dtype=np.float32).reshape(-1, self.dim), "float32")
+        allowed = self._allowed_codes(where)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+
+        for start in range(0, self.count, SEARCH_BLOCK_ROWS):
+            block = self.vectors[start:start + SEARCH_BLOCK_ROWS]
+            scores = queries @ block.astype(np.float32).T
+            if self.scales is not None:
+                scores *= self.scales[start:start + len(block)]
+            if allowed is not None:
+                scores[:, ~np.isin(self.space_codes[start:start + len(block)], allowed)] = -np.inf
+            # Keep the block's top n next to the best rows so far
+            k = min(n_results, len(block))
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            best_rows = np.concatenate([best_rows, top + start], axis=1)
+            best_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+
+        order = np.argsort(-best_scores, axis=1)[:, :n_results]
+        results = []
+        for rows, scores in zip(np.take_along_axis(best_rows, order, axis=1),
+                                np.take_along_axis(best_scores, order, axis=1)):
+            keep = np.isfinite(scores)
+            results.append((rows[keep].tolist(), scores[keep].tolist()))
+        return results
+
+    def close(self):
+        # mmap refuses to close while NumPy views still export its buffer
+        self.vectors = self.scales = self.space_codes = self._offsets = None
+        self._mmap.close()
+
+
+class SnapshotCollection:
+    """
+    Serves a snapshot through the part of the Chroma collection API the RAG bot
+    uses for questions (query, count), so search_vector_store works on either.
+    The file is reopened when an export replaces it.
+    """
+
+    def __init__(self, path: str, embedding_function):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.embedding_function = embedding_function
+        self.snapshot = self._open()
+
+    def _open(self):
+        started = time.perf_counter()
+        snapshot = VectorSnapshot(self.path)
+        # Vectors of another model, or of another backend (quantized ONNX vectors
+        # differ from torch ones), would be compared against the wrong queries
+        expected = (self.embedding_function.model_name, self.embedding_function.backend)
+        if (snapshot.model, snapshot.backend) != expected:
+            snapshot.close()
+            raise ValueError(f"Snapshot {self.path} holds {snapshot.model} ({snapshot.backend}) vectors, "
+                             f"not {expected[0]} ({expected[1]}); export it again")
+        logging.info(f"Opened vector snapshot {self.path} ({snapshot.count} vectors, "
+                     f"{snapshot.header['dtype']}) in {(time.perf_counter() - started) * 1000:.1f}ms")
+        return snapshot
+
+    def _current(self):
+        stat = os.stat(self.path)
+        if (stat.st_ino, stat.st_mtime_ns) != (self.snapshot.stat.st_ino, self.snapshot.stat.st_mtime_ns):
+            # The old mapping stays valid for searches still using it
+            self.snapshot = self._open()
+        return self.snapshot
+
+    def count(self) -> int:
+        return self._current().count
+
+    def query(self, query_texts=None, query_embeddings=None, n_results: int = 10, where: dict = None,
+              include=("documents", "metadatas", "distances")):
+        snapshot = self._current()
+        if query_embeddings is None:
+            query_embeddings = self.embedding_function(list(query_texts))
+        with span("snapshot_search", snapshot.header["dtype"]):
+            matches = snapshot.search(query_embeddings, n_results, where)
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for rows, similarities in matches:
+            records = [snapshot.record(row) for row in rows]
+            results["ids"].append([record["id"] for record in records])
+            results["documents"].append([record["document"] for record in records])
+            results["metadatas"].append([record["metadata"] for record in records])
+            # Cosine distance, as reported by the Chroma collections
+            results["distances"].append([1.0 - similarity for similarity in similarities])
+        return results
+
+
+def export_collection(collection, path: str, model: str, backend: str, dtype: str = SNAPSHOT_DTYPE) -> dict:
+    """Writes every row of a Chroma collection to a snapshot file."""
+    ids, embeddings, documents, metadatas = [], [], [], []
+    offset = 0
+    while True:
+        batch = collection.get(include=["embeddings", "documents", "metadatas"],
+                               limit=EXPORT_BATCH_SIZE, offset=offset)
+        if not batch["ids"]:
+            break
+        ids.extend(batch["ids"])
+        embeddings.extend(batch["embeddings"])
+        documents.extend(batch["documents"])
+        metadatas.extend(batch["metadatas"])
+        offset += len(batch["ids"])
+    if not ids:
+        raise ValueError(f"Collection '{collection.name}' is empty")
+    return write_snapshot(path, ids, np.asarray(embeddings, dtype=np.float32), documents, metadatas, model, backend,
+                          dtype)
+
+
+def main():
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    import chromadb
+
+    from app import COLLECTION_NAME, VECTOR_DB_PATH, ChatAssistant
+    from embeddings import EMBEDDING_BACKEND
+
+    parser = argparse.ArgumentParser(description="Export the served Chroma collection to a memory-mapped snapshot.")
+    parser.add_argument("command", choices=["export", "info"])
+    parser.add_argument("--path", default=os.getenv('VECTOR_SNAPSHOT_PATH') or os.path.join(VECTOR_DB_PATH, "index.vsnap"))
+    parser.add_argument("--dtype", default=SNAPSHOT_DTYPE, choices=["float16", "int8"])
+    parser.add_argument("--collection", help=f"Collection to export (default: the active one, else {COLLECTION_NAME})")
+    args = parser.parse_args()
+
+    if args.command == "info":
+        snapshot = VectorSnapshot(args.path)
+        print(json.dumps({**snapshot.header, "bytes": snapshot.stat.st_size}, indent=2))
+        return
+
+    client = chromadb.PersistentClient(path=VECTOR_DB_PATH)
+    name = args.collection or ChatAssistant.active_collection_name()
+    collection = client.get_collection(name)
+    model = (collection.metadata or {}).get("embedding_model")
+    if not model:
+        raise SystemExit(f"Collection '{name}' does not record its embedding model")
+    # Collections created before the backend was recorded were built with this process's backend
+    backend = (collection.metadata or {}).get("embedding_backend", EMBEDDING_BACKEND)
+    started = time.perf_counter()
+    header = export_collection(collection, args.path, model, backend, args.dtype)
+    logging.info(f"Exported {header['count']} vectors of '{name}' to {args.path} ({args.dtype}, "
+                 f"{os.path.getsize(args.path) / 1e6:.1f} MB) in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+import pytest
+
+pytest.importorskip("chromadb")
+
+import bots  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    return bots.load_bot("llama-rag")
+
+
+@pytest.fixture
+def assistant(app):
+    assistant = app.ChatAssistant()
+    assistant.reranker = None
+    return assistant
+
+
+def hit(source, part, text):
+    return {"source": source, "part": part, "text": text}
+
+
+def test_build_context_orders_by_page_then_part(app):
+    hits = [hit("2", 4, "two four"), hit("1", 7, "one seven"), hit("2", 1, "two one"), hit("1", 2, "one two")]
+    context, sources = app.ChatAssistant.build_context(hits)
+    assert sources == ["2", "1"]
+    assert context == "[Page 2]\ntwo one\ntwo four\n[Page 1]\none two\none seven"
+
+
+def test_build_context_skips_duplicates_and_empty_passages(app):
+    hits = [hit("1", 1, "Annual leave"), hit("2", 1, "  annual   LEAVE "), hit("3", 1, "   "), hit("4", 1, "Sick leave")]
+    context, sources = app.ChatAssistant.build_context(hits)
+    assert sources == ["1", "4"]
+    assert context == "[Page 1]\nAnnual leave\n[Page 4]\nSick leave"
+
+
+def test_build_context_keeps_to_the_token_budget(app):
+    # About len // 4 + 1 tokens each: 26, 51 and 6
+    hits = [hit("1", 1, "a" * 100), hit("2", 1, "b" * 200), hit("3", 1, "c" * 20)]
+    context, sources = app.ChatAssistant.build_context(hits, token_budget=40)
+    # The passage that does not fit is skipped, smaller ones after it still get in
+    assert sources == ["1", "3"]
+    assert "b" not in context
+    assert app.ChatAssistant.build_context(hits, token_budget=5) == ("", [])
+
+
+def test_build_prompt_keeps_the_recent_history(app, assistant, monkeypatch):
+    monkeypatch.setattr(app, "HISTORY_TURNS", 1)
+    assistant.context += [
+        {"role": "user", "content": "old question"}, {"role": "assistant", "content": "old answer"},
+        {"role": "user", "content": "last question"}, {"role": "assistant", "content": "last answer"},
+    ]
+    prompt = assistant.build_prompt("and now?", "[Page 1]\nleave")
+    lines = prompt.split("\n")
+    assert lines[0].startswith("System: You are an intelligent")
+    assert "Context:\n[Page 1]\nleave" in prompt
+    assert "old question" not in prompt
+    assert lines[-4:] == ["User: last question", "Assistant: last answer", "User: and now?", "Assistant:"]
+    assert "Context:" not in assistant.build_prompt("and now?", "")
+
+
+def test_generate_answer_streams_and_records_the_turn(app, assistant, monkeypatch):
+    prompts = []
+    monkeypatch.setattr(assistant, "search_vector_store",
+                        lambda question, reformulations, spaces, n_results: [hit("7", 1, "Leave is 25 days")])
+    monkeypatch.setattr(app.ChatAssistant, "stream_model",
+                        staticmethod(lambda prompt: prompts.append(prompt) or iter(["25 ", "days ", "[Page 7]"])))
+
+    assert "".join(assistant.generate_answer("How much leave?")) == "25 days [Page 7]"
+    assert "[Page 7]\nLeave is 25 days" in prompts[0]
+    assert assistant.last_sources == ["7"]
+    assert set(assistant.last_timings) == {"retrieve", "prompt_build", "first_token", "total"}
+    assert assistant.last_timings["total"] >= assistant.last_timings["retrieve"]
+    # History keeps the plain question, not the retrieved context
+    assert assistant.context[-2:] == [{"role": "user", "content": "How much leave?"},
+                                      {"role": "assistant", "content": "25 days [Page 7]"}]
+
+
+def test_generate_answer_without_context_skips_the_model(app, assistant, monkeypatch):
+    monkeypatch.setattr(assistant, "search_vector_store", lambda *args, **kwargs: [])
+    monkeypatch.setattr(app.ChatAssistant, "stream_model", staticmethod(lambda prompt: pytest.fail("model called")))
+    assert list(assistant.generate_answer("Unrelated?")) == ["Sorry, I couldn't find relevant information."]
+    assert assistant.last_sources == []
+    assert set(assistant.last_timings) == {"retrieve", "prompt_build", "total"}
+    assert len(assistant.context) == 1
+
+
+def test_generate_answer_reports_a_model_error(app, assistant, monkeypatch):
+    def failing(prompt):
+        raise RuntimeError("Error: Received status code 500")
+        yield
+
+    monkeypatch.setattr(assistant, "search_vector_store", lambda *args, **kwargs: [hit("7", 1, "Leave")])
+    monkeypatch.setattr(app.ChatAssistant, "stream_model", staticmethod(failing))
+    assert list(assistant.generate_answer("Leave?")) == ["Error: Received status code 500"]
+    assert "total" in assistant.last_timings
+    # A failed answer is not added to the history
+    assert len(assistant.context) == 1
@@ -0,0 +1,52 @@
+import pytest
+
+pytest.importorskip("chromadb")
+
+from backfill import Checkpoint, make_batches  # noqa: E402
+
+
+def chunk_records(page_id, content, page):
+    lines = [line for line in content.splitlines() if line]
+    ids = [f"{page_id}-{i}" for i in range(len(lines))]
+    return ids, lines, [{"source": page_id}] * len(lines)
+
+
+def test_make_batches_tracks_the_last_batch_of_each_page():
+    pages = {
+        "a": ("1\n2\n3", {}),
+        "empty": ("", {}),
+        "b": ("4\n5", {}),
+        "c": ("6", {}),
+    }
+    batches, last_batch = make_batches(pages, chunk_records, batch_size=2)
+    assert [[row[1] for row in batch] for batch in batches] == [["a-0", "a-1"], ["a-2", "b-0"], ["b-1", "c-0"]]
+    assert last_batch == {"a": 1, "empty": -1, "b": 2, "c": 2}
+
+
+def test_make_batches_of_an_exact_multiple():
+    batches, last_batch = make_batches({"a": ("1\n2", {}), "b": ("3\n4", {})}, chunk_records, batch_size=2)
+    assert len(batches) == 2
+    assert last_batch == {"a": 0, "b": 1}
+
+
+def test_checkpoint_resumes_only_the_same_run(tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+    checkpoint = Checkpoint(path, "docs", "mini", "torch")
+    checkpoint.mark("a", 3)
+    checkpoint.save()
+
+    assert Checkpoint(path, "docs", "mini", "torch").is_done("a", 3)
+    assert not Checkpoint(path, "docs", "mini", "torch").is_done("a", 4)
+    # Vectors of another backend, model or collection must be written again
+    assert not Checkpoint(path, "docs", "mini", "onnx-int8").is_done("a", 3)
+    assert not Checkpoint(path, "docs", "other", "torch").is_done("a", 3)
+    assert not Checkpoint(path, "other", "mini", "torch").is_done("a", 3)
+
+    checkpoint.clear()
+    assert not Checkpoint(path, "docs", "mini", "torch").done
+
+
+def test_checkpoint_survives_a_corrupt_file(tmp_path):
+    path = tmp_path / "checkpoint.json"
+    path.write_text("{not json")
+    assert Checkpoint(str(path), "docs", "mini").done == {}
@@ -0,0 +1,90 @@
+import itertools
+
+import pytest
+
+import embedding_cache
+from embedding_cache import EmbeddingCache
+
+
+class FakeModel:
+    """Embeds a text as [len(text)] and records every batch it was asked for."""
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, texts):
+        self.batches.append(list(texts))
+        return [[float(len(text))] for text in texts]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Distinct last_used stamps, one per lookup or insert
+    ticks = itertools.count(1)
+    monkeypatch.setattr(embedding_cache.time, "time", lambda: float(next(ticks)))
+
+
+def cached_texts(cache, texts):
+    return {text for text in texts if cache._lookup([cache.make_key("m", text)])}
+
+
+def test_hits_and_misses(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"))
+    model = FakeModel()
+    assert cache.embed("m", ["leave", "policy"], model) == [[5.0], [6.0]]
+    assert cache.embed("m", ["leave", "sick"], model) == [[5.0], [4.0]]
+    assert model.batches == [["leave", "policy"], ["sick"]]
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 3, 3)
+    assert stats["hit_rate"] == 0.25
+
+
+def test_texts_repeated_within_a_call_are_computed_once(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"))
+    model = FakeModel()
+    assert cache.embed("m", ["leave", "leave", "sick", "leave"], model) == [[5.0], [5.0], [4.0], [5.0]]
+    assert model.batches == [["leave", "sick"]]
+    assert cache.stats()["entries"] == 2
+
+
+def test_models_do_not_share_vectors(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"))
+    model = FakeModel()
+    cache.embed("m", ["leave"], model)
+    cache.embed("m:onnx", ["leave"], model)
+    assert model.batches == [["leave"], ["leave"]]
+
+
+def test_vectors_survive_a_restart(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    EmbeddingCache(path).embed("m", ["leave"], FakeModel())
+    model = FakeModel()
+    cache = EmbeddingCache(path)
+    assert cache.embed("m", ["leave"], model) == [[5.0]]
+    assert model.batches == []
+    assert cache.stats()["entries"] == 1
+
+
+def test_evicts_the_least_recently_used_down_to_90_percent(tmp_path, clock):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"), max_entries=10)
+    texts = [f"text {i}" for i in range(10)]
+    for text in texts:
+        cache.embed("m", [text], FakeModel())
+    # Used again, so no longer among the oldest
+    cache.embed("m", ["text 0"], FakeModel())
+    assert cache.stats()["evictions"] == 0
+
+    cache.embed("m", ["text 10"], FakeModel())
+    stats = cache.stats()
+    assert (stats["entries"], stats["evictions"]) == (9, 2)
+    assert cached_texts(cache, texts) == set(texts) - {"text 1", "text 2"}
+
+
+def test_eviction_counts_entries_added_by_other_processes(tmp_path, clock):
+    path = str(tmp_path / "cache.sqlite")
+    first = EmbeddingCache(path, max_entries=10)
+    second = EmbeddingCache(path, max_entries=10)
+    first.embed("m", [f"first {i}" for i in range(6)], FakeModel())
+    second.embed("m", [f"second {i}" for i in range(6)], FakeModel())
+    assert second.stats()["entries"] == 9
+    assert second.stats()["evictions"] == 3
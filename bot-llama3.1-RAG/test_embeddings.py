@@ -0,0 +1,87 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("chromadb")
+
+import embeddings  # noqa: E402
+from embedding_cache import EmbeddingCache  # noqa: E402
+from embeddings import LazyEmbeddingFunction, get_embedding_function  # noqa: E402
+
+
+class FakeSentenceTransformer:
+    """Stands in for chromadb's SentenceTransformerEmbeddingFunction; loading takes a while."""
+
+    loads = []
+
+    def __init__(self, model_name, **kwargs):
+        time.sleep(0.05)
+        self.kwargs = kwargs
+        self.calls = []
+        FakeSentenceTransformer.loads.append(model_name)
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        return [[float(len(text))] for text in texts]
+
+
+@pytest.fixture(autouse=True)
+def fake_model(monkeypatch):
+    FakeSentenceTransformer.loads = []
+    monkeypatch.setattr(embeddings.embedding_functions, "SentenceTransformerEmbeddingFunction",
+                        FakeSentenceTransformer, raising=False)
+
+
+def test_model_is_loaded_on_first_use_only_once():
+    function = LazyEmbeddingFunction("mini")
+    assert not function.loaded
+    threads = [threading.Thread(target=function, args=(["leave"],)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert function.loaded
+    assert FakeSentenceTransformer.loads == ["mini"]
+
+
+def test_warm_up_loads_in_the_background():
+    function = LazyEmbeddingFunction("mini")
+    thread = function.warm_up()
+    assert function.warm_up() is thread
+    thread.join(1)
+    assert function.loaded
+    assert function(["leave"]) == [[5.0]]
+    assert FakeSentenceTransformer.loads == ["mini"]
+
+
+def test_backends():
+    assert LazyEmbeddingFunction("mini", backend="onnx").load().kwargs == {
+        "trust_remote_code": True, "backend": "onnx"}
+    int8 = LazyEmbeddingFunction("mini", backend="onnx-int8").load()
+    assert int8.kwargs["model_kwargs"] == {"file_name": embeddings.ONNX_INT8_FILE}
+    with pytest.raises(ValueError, match="Unknown embedding backend"):
+        LazyEmbeddingFunction("mini", backend="tpu").load()
+
+
+def test_cached_texts_skip_the_model(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"))
+    function = LazyEmbeddingFunction("mini", cache=cache)
+    assert function(["leave", "sick"]) == [[5.0], [4.0]]
+    assert function(["sick", "policy"]) == [[4.0], [6.0]]
+    assert function.load().calls == [["leave", "sick"], ["policy"]]
+    assert function.cache_stats()["hits"] == 1
+    # Another backend of the same model is not served the torch vectors
+    LazyEmbeddingFunction("mini", backend="onnx", cache=cache)(["leave"])
+    assert cache.stats()["misses"] == 4
+
+
+def test_get_embedding_function_shares_one_instance_per_model_and_backend(monkeypatch):
+    monkeypatch.setattr(embeddings, "_registry", {})
+    monkeypatch.setattr(embeddings, "get_embedding_cache", lambda: None)
+    function = get_embedding_function("mini")
+    assert get_embedding_function("mini") is function
+    assert get_embedding_function("mini", backend="onnx") is not function
+    assert get_embedding_function("other") is not function
+    assert function.cache_stats() == {}
+    assert FakeSentenceTransformer.loads == []
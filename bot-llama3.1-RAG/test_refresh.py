@@ -0,0 +1,157 @@
+import pytest
+
+pytest.importorskip("chromadb")
+
+import bots  # noqa: E402
+from common import html_extract  # noqa: E402
+from common.confluence import ConfluencePage, SyncResult  # noqa: E402
+
+
+class FakeCollection:
+    """In-memory stand-in for a Chroma collection, with the `where` forms refresh_index uses."""
+
+    def __init__(self, name, fail_on=None):
+        self.name = name
+        self.records = {}
+        self.fail_on = fail_on
+
+    @staticmethod
+    def matches(metadata, where):
+        for key, condition in (where or {}).items():
+            if isinstance(condition, dict):
+                if "$nin" in condition and metadata[key] in condition["$nin"]:
+                    return False
+            elif metadata[key] != condition:
+                return False
+        return True
+
+    def add(self, ids, documents, metadatas, embeddings=None):
+        if self.fail_on and self.fail_on in documents:
+            raise RuntimeError("embedding failed")
+        embeddings = embeddings or [[float(len(doc))] for doc in documents]
+        for record in zip(ids, embeddings, documents, metadatas):
+            self.records[record[0]] = record[1:]
+
+    def get(self, where=None, include=(), limit=None, offset=0):
+        rows = [(id_, *record) for id_, record in sorted(self.records.items()) if self.matches(record[2], where)]
+        rows = rows[offset:offset + limit]
+        return {"ids": [row[0] for row in rows], "embeddings": [row[1] for row in rows],
+                "documents": [row[2] for row in rows], "metadatas": [row[3] for row in rows]}
+
+    def delete(self, where):
+        for id_ in [id_ for id_, record in self.records.items() if self.matches(record[2], where)]:
+            del self.records[id_]
+
+    def count(self):
+        return len(self.records)
+
+
+class FakeClient:
+    def __init__(self):
+        self.collections = {}
+        self.fail_on = None
+
+    def get_or_create_collection(self, name, **kwargs):
+        return self.collections.setdefault(name, FakeCollection(name, self.fail_on))
+
+    def list_collections(self):
+        return list(self.collections)
+
+    def delete_collection(self, name):
+        del self.collections[name]
+
+
+class FakeCrawler:
+    def __init__(self, result):
+        self.result = result
+        self.committed = []
+
+    def sync(self, full=False):
+        return self.result
+
+    def commit(self, result):
+        self.committed.append(result)
+
+
+def page(page_id, html, version=2):
+    return ConfluencePage(page_id, f"Page {page_id}", "LEG", version, f"https://wiki/{page_id}", html)
+
+
+@pytest.fixture
+def app(monkeypatch, tmp_path):
+    app = bots.load_bot("llama-rag")
+    monkeypatch.setattr(app, "ACTIVE_COLLECTION_PATH", str(tmp_path / "active_collection"))
+    monkeypatch.setattr(app, "COPY_BATCH_SIZE", 2)
+    monkeypatch.setattr(html_extract, "EXTRACT_CACHE_DIR", str(tmp_path / "extracted"))
+    return app
+
+
+@pytest.fixture
+def assistant(app):
+    assistant = app.ChatAssistant()
+    assistant._vs_client = FakeClient()
+    assistant.collection = assistant.open_collection(app.COLLECTION_NAME)
+    assistant.confluence_pages = {"1": "Annual leave\nSick leave\nParental leave", "2": "Office hours"}
+    assistant.page_metadata = {"1": {"title": "Leave"}, "2": {"title": "Hours"}}
+    for page_id, content in assistant.confluence_pages.items():
+        assistant.index_page(page_id, content)
+    return assistant
+
+
+def served_documents(assistant):
+    return sorted(record[1] for record in assistant.collection.records.values())
+
+
+def test_refresh_swaps_to_a_new_collection(app, assistant):
+    old = assistant.collection
+    old_vectors = dict(old.records)
+    crawler = FakeCrawler(SyncResult(changed={"2": page("2", "<p>Office hours: 9 to 5</p>")}, removed=[]))
+    assistant.refresh_index(crawler)
+
+    new = assistant.collection
+    assert new is not old and new.name.startswith(f"{app.COLLECTION_NAME}_")
+    assert served_documents(assistant) == ["Annual leave", "Office hours: 9 to 5", "Parental leave", "Sick leave"]
+    # Unchanged pages are copied with their vectors, not embedded again
+    assert all(new.records[id_] == old_vectors[id_] for id_ in old_vectors if id_.startswith("id_1_"))
+    assert assistant.confluence_pages["2"] == "Office hours: 9 to 5"
+    assert assistant.page_metadata["2"]["title"] == "Page 2"
+    # Queries started before the swap can still read the old collection
+    assert old.count() == 4 and old.name in assistant.vs_client.collections
+    with open(app.ACTIVE_COLLECTION_PATH) as f:
+        assert f.read() == new.name
+    assert crawler.committed == [crawler.result]
+
+
+def test_removed_pages_are_not_copied(assistant):
+    assistant.refresh_index(FakeCrawler(SyncResult(removed=["1"])))
+    assert served_documents(assistant) == ["Office hours"]
+    assert "1" not in assistant.confluence_pages and "1" not in assistant.page_metadata
+
+
+def test_failed_refresh_keeps_the_old_index_serving(app, assistant):
+    old = assistant.collection
+    pages, metadata = dict(assistant.confluence_pages), dict(assistant.page_metadata)
+    assistant.vs_client.fail_on = "Office hours: 9 to 5"
+    crawler = FakeCrawler(SyncResult(changed={"2": page("2", "<p>Office hours: 9 to 5</p>")}))
+    with pytest.raises(RuntimeError, match="embedding failed"):
+        assistant.refresh_index(crawler)
+
+    assert assistant.collection is old
+    assert (assistant.confluence_pages, assistant.page_metadata) == (pages, metadata)
+    # The half-built collection is dropped and nothing is committed, so the next run retries
+    assert list(assistant.vs_client.collections) == [app.COLLECTION_NAME]
+    assert crawler.committed == []
+    with pytest.raises(FileNotFoundError):
+        open(app.ACTIVE_COLLECTION_PATH)
+
+
+def test_back_to_back_refreshes_keep_the_previous_generation(app, assistant):
+    names = [assistant.collection.name]
+    for version, text in ((2, "Office hours: 9 to 5"), (3, "Office hours: 8 to 4")):
+        assistant.refresh_index(FakeCrawler(SyncResult(changed={"2": page("2", f"<p>{text}</p>", version)})))
+        names.append(assistant.collection.name)
+
+    assert len(set(names)) == 3
+    # The first generation is dropped; the one just replaced stays for queries still reading it
+    assert sorted(assistant.vs_client.collections) == sorted(names[1:])
+    assert "Office hours: 8 to 4" in served_documents(assistant)
@@ -0,0 +1,65 @@
+import time
+
+from rerank import Reranker
+
+
+class FakeCrossEncoder:
+    """Scores a passage by how many of the question's words it contains; records what it was asked."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.pairs = []
+
+    def predict(self, pairs, batch_size=None, show_progress_bar=None):
+        time.sleep(self.delay)
+        self.pairs.extend(pairs)
+        return [sum(word in text for word in question.lower().split()) for question, text in pairs]
+
+
+def make_reranker(model, **kwargs):
+    reranker = Reranker(model_name="fake", **kwargs)
+    reranker._model = model
+    return reranker
+
+
+PASSAGES = [{"text": text} for text in ("office hours", "leave policy", "annual leave policy for staff")]
+
+
+def test_reranks_by_score():
+    reranker = make_reranker(FakeCrossEncoder())
+    ranked = reranker.rerank("Annual leave policy?", PASSAGES, top_k=2)
+    assert [passage["text"] for passage in ranked] == ["annual leave policy for staff", "leave policy"]
+    assert ranked[0]["rerank_score"] == 2
+
+
+def test_scores_the_question_as_asked_and_caches_it_normalised():
+    model = FakeCrossEncoder()
+    reranker = make_reranker(model)
+    reranker.rerank("  What is the LEAVE policy?", PASSAGES)
+    assert {question for question, _ in model.pairs} == {"  What is the LEAVE policy?"}
+    # Same question up to case and spacing: served from the cache
+    reranker.rerank("what is the leave policy", PASSAGES)
+    assert len(model.pairs) == len(PASSAGES)
+
+
+def test_stops_scoring_at_the_budget():
+    model = FakeCrossEncoder(delay=0.05)
+    reranker = make_reranker(model, batch_size=1, budget_ms=60)
+    passages = [{"text": f"passage {i}"} for i in range(10)]
+    ranked = reranker.rerank("passage", passages, top_k=10)
+    assert len(model.pairs) < len(passages)
+    # Unscored passages follow the scored ones in retrieval order
+    unscored = [passage for passage in ranked if "rerank_score" not in passage]
+    assert unscored == passages[len(model.pairs):]
+
+
+def test_cache_is_bounded():
+    reranker = make_reranker(FakeCrossEncoder(), cache_size=2)
+    reranker.rerank("leave", PASSAGES)
+    assert len(reranker._cache) == 2
+
+
+def test_answers_without_the_model_while_it_loads(monkeypatch):
+    reranker = Reranker(model_name="fake")
+    monkeypatch.setattr(reranker, "warm_up", lambda: None)
+    assert reranker.rerank("leave", PASSAGES, top_k=2) == PASSAGES[:2]
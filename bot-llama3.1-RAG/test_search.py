@@ -0,0 +1,92 @@
+import pytest
+
+pytest.importorskip("chromadb")
+
+import bots  # noqa: E402
+
+
+class QueryCollection:
+    """Returns canned (id, distance) hits per query text and records the query arguments."""
+
+    def __init__(self, hits):
+        self.hits = hits
+        self.queries = []
+
+    def query(self, query_texts, n_results, where, include):
+        self.queries.append({"query_texts": query_texts, "n_results": n_results, "where": where})
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for text in query_texts:
+            rows = self.hits.get(text, [])
+            results["ids"].append([id_ for id_, _ in rows])
+            results["documents"].append([f"text of {id_}" for id_, _ in rows])
+            results["metadatas"].append([
+                {"source": id_.split("_")[1], "part": int(id_.split("_")[2]), "space": "LEG", "title": "Leave"}
+                for id_, _ in rows
+            ])
+            results["distances"].append([distance for _, distance in rows])
+        return results
+
+
+@pytest.fixture
+def app():
+    return bots.load_bot("llama-rag")
+
+
+def make_assistant(app, hits):
+    assistant = app.ChatAssistant()
+    assistant.collection = QueryCollection(hits)
+    return assistant
+
+
+def hit(source, part, similarity, text=None):
+    return {"id": f"id_{source}_{part}", "text": text or f"{source}.{part}", "source": source, "part": part,
+            "distance": 1 - similarity, "similarity": similarity}
+
+
+@pytest.mark.parametrize("spaces, where", [
+    (None, None),
+    (["LEG"], {"space": "LEG"}),
+    (["LEG", "REV"], {"space": {"$in": ["LEG", "REV"]}}),
+])
+def test_spaces_filter_the_query(app, spaces, where):
+    assistant = make_assistant(app, {})
+    assistant.search_vector_store("leave", spaces=spaces, n_results=7)
+    assert assistant.collection.queries == [{"query_texts": ["leave"], "n_results": 7, "where": where}]
+
+
+def test_hits_below_the_similarity_threshold_are_dropped(app):
+    assistant = make_assistant(app, {"leave": [("id_1_1", 0.2), ("id_2_1", 0.5), ("id_3_1", 0.9)]})
+    passages = assistant.search_vector_store("leave", min_similarity=0.5)
+    assert [passage["id"] for passage in passages] == ["id_1_1", "id_2_1"]
+    assert passages[0]["similarity"] == pytest.approx(0.8)
+
+
+def test_reformulations_keep_the_best_score_of_a_chunk(app):
+    assistant = make_assistant(app, {
+        "leave": [("id_1_1", 0.4), ("id_2_1", 0.3)],
+        "annual leave": [("id_1_1", 0.1), ("id_3_1", 0.2)],
+    })
+    # Duplicate queries are only sent once
+    passages = assistant.search_vector_store("leave", ["annual leave", "leave"], min_similarity=0.0)
+    assert assistant.collection.queries[0]["query_texts"] == ["leave", "annual leave"]
+    assert [(passage["id"], round(passage["similarity"], 2)) for passage in passages] == [
+        ("id_1_1", 0.9), ("id_3_1", 0.8), ("id_2_1", 0.7)]
+
+
+def test_a_failed_query_returns_no_passages(app):
+    assistant = make_assistant(app, {})
+    assistant.collection.query = None
+    assert assistant.search_vector_store("leave") == []
+
+
+def test_merge_adjacent_joins_consecutive_parts_of_a_page(app):
+    passages = app.ChatAssistant.merge_adjacent([
+        hit("1", 3, 0.6), hit("2", 1, 0.7), hit("1", 1, 0.5), hit("1", 2, 0.9), hit("1", 5, 0.8),
+    ])
+    assert [(passage["source"], passage["parts"], passage["text"], passage["similarity"]) for passage in passages] == [
+        ("1", [1, 2, 3], "1.1\n1.2\n1.3", 0.9),
+        ("1", [5], "1.5", 0.8),
+        ("2", [1], "2.1", 0.7),
+    ]
+    # The merged passage takes the distance of its best part
+    assert passages[0]["distance"] == pytest.approx(0.1)
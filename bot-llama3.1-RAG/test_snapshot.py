@@ -0,0 +1,85 @@
+import os
+
+import numpy as np
+import pytest
+
+import snapshot
+from snapshot import SnapshotCollection, VectorSnapshot, write_snapshot
+
+DIM = 8
+
+
+class FakeEmbeddingFunction:
+    def __init__(self, model_name="mini", backend="torch"):
+        self.model_name = model_name
+        self.backend = backend
+
+    def __call__(self, texts):
+        return [vector_for(text) for text in texts]
+
+
+def vector_for(text):
+    return np.random.default_rng(sum(text.encode())).standard_normal(DIM).astype(np.float32)
+
+
+def write(path, count=50, model="mini", backend="torch", dtype="float16"):
+    ids = [f"page-{i}" for i in range(count)]
+    metadatas = [{"space": "LEG" if i % 2 else "REV", "source": str(i)} for i in range(count)]
+    embeddings = np.stack([vector_for(id_) for id_ in ids])
+    return write_snapshot(str(path), ids, embeddings, ids, metadatas, model, backend, dtype)
+
+
+@pytest.mark.parametrize("dtype", ["float16", "int8"])
+def test_search_matches_brute_force(tmp_path, dtype):
+    write(tmp_path / "index.vsnap", dtype=dtype)
+    index = VectorSnapshot(str(tmp_path / "index.vsnap"))
+    assert (index.count, index.dim, index.backend) == (50, DIM, "torch")
+    (rows, scores), = index.search(vector_for("page-7"), n_results=3)
+    assert rows[0] == 7
+    assert scores == sorted(scores, reverse=True)
+    assert index.record(7) == {"id": "page-7", "document": "page-7", "metadata": {"space": "LEG", "source": "7"}}
+    index.close()
+
+
+def test_search_filters_on_space_across_blocks(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshot, "SEARCH_BLOCK_ROWS", 16)
+    write(tmp_path / "index.vsnap")
+    index = VectorSnapshot(str(tmp_path / "index.vsnap"))
+    (rows, _), = index.search(vector_for("page-8"), n_results=10, where={"space": "LEG"})
+    assert len(rows) == 10
+    assert all(row % 2 for row in rows)
+    index.close()
+
+
+def test_close_releases_the_mapping(tmp_path):
+    write(tmp_path / "index.vsnap")
+    index = VectorSnapshot(str(tmp_path / "index.vsnap"))
+    index.search(vector_for("q"))
+    index.close()
+    assert index._mmap.closed
+
+
+def test_collection_serves_chroma_style_results(tmp_path):
+    write(tmp_path / "index.vsnap")
+    collection = SnapshotCollection(str(tmp_path / "index.vsnap"), FakeEmbeddingFunction())
+    results = collection.query(query_texts=["page-3"], n_results=2)
+    assert results["ids"][0][0] == "page-3"
+    assert results["distances"][0][0] == pytest.approx(0, abs=1e-2)
+    assert collection.count() == 50
+
+
+@pytest.mark.parametrize("model, backend", [("other", "torch"), ("mini", "onnx-int8")])
+def test_collection_refuses_a_stale_snapshot(tmp_path, model, backend):
+    write(tmp_path / "index.vsnap", model=model, backend=backend)
+    with pytest.raises(ValueError):
+        SnapshotCollection(str(tmp_path / "index.vsnap"), FakeEmbeddingFunction())
+
+
+def test_collection_reopens_a_replaced_snapshot(tmp_path):
+    path = tmp_path / "index.vsnap"
+    write(path, count=10)
+    collection = SnapshotCollection(str(path), FakeEmbeddingFunction())
+    write(path, count=20)
+    # A new inode, so the replacement is seen even within the same mtime tick
+    assert os.stat(path).st_ino != collection.snapshot.stat.st_ino
+    assert collection.count() == 20
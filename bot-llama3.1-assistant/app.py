@@ -1,19 +1,28 @@
 import os
+import sys
 import requests
 from dotenv import load_dotenv
 import json
-import threading
+from concurrent.futures import ThreadPoolExecutor
 
 API_URL = os.getenv('API_URL', 'http://localhost:11434/api/generate')
+# Worker threads answering conversations, whatever the number of users
+ASSISTANT_WORKERS = int(os.getenv('ASSISTANT_WORKERS', '4'))
 
+# Shared helpers live in ../common
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.metrics import span, start_metrics_server
+from common.sessions import get_session_store
 
-class ChatAssistant(threading.Thread):
+
+class ChatAssistant:
     """
     A class to interact with the LLaMA bot using predefined instructions.
+    Conversations live in a session store keyed by user/thread ID and are
+    answered by a small pool of worker threads.
     """
 
-    def __init__(self):
-        super().__init__()
+    def __init__(self, store=None, workers: int = ASSISTANT_WORKERS):
         self.instructions = """
             You are Rick Sanchez, the eccentric, sarcastic, and genius scientist from the show "Rick and Morty." 
             You are highly intelligent, brutally honest, and often rude, with a nihilistic view of the universe. 
@@ -21,64 +30,78 @@ class ChatAssistant(threading.Thread):
 
             Always keep track of the previous conversation context and respond accordingly. Refer to earlier topics when the user asks follow-up questions, showing your genius intellect and ability to connect ideas across dimensions.
             """
-        self.context = [{"role": "system", "content": self.instructions}]
+        self.sessions = store or get_session_store()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="assistant")
         self.running = True
 
-    def send_message_to_bot(self, user_message):
+    def submit(self, session_id, user_message):
+        """
+        Queues a message for the worker pool and returns a Future with the response.
+        """
+        return self.pool.submit(self.send_message_to_bot, user_message, session_id)
+
+    def send_message_to_bot(self, user_message, session_id="default"):
         """
         Sends a message to the LLaMA bot and returns its response.
         """
-        # Append the user message to the context
-        self.context.append({"role": "user", "content": user_message})
-        
-        # Build the payload with the full conversation context
-        payload = {
-            "model": "llama3.1:latest",
-            "prompt": self._build_prompt(),
-        }
-
-        try:
-            response = requests.post(API_URL, json=payload)
-
-            if response.status_code != 200:
-                return f"Error: Received status code {response.status_code}"
-
-            # Parse the response parts
-            raw_responses = response.text.splitlines()
-            full_response_parts = []
-
-            for raw_response in raw_responses:
-                try:
-                    part = json.loads(raw_response)
-                    full_response_parts.append(part.get('response', ''))
-                    if part.get('done', False):
-                        break
-                except json.JSONDecodeError as e:
-                    print(f"Failed to decode part: {raw_response}, Error: {str(e)}")
-                    continue
-
-            full_response = ''.join(full_response_parts).strip()
-
-            # Append the assistant's response to the context
-            self.context.append({"role": "assistant", "content": full_response})
-
-            return full_response
-        except requests.exceptions.RequestException as e:
-            return f"HTTP Request failed: {str(e)}"
-        except Exception as e:
-            return f"Error: {str(e)}"
-
-    def _build_prompt(self):
+        # One turn at a time per conversation, so its history stays in order
+        with self.sessions.locks.hold(session_id):
+            context = self.sessions.get(session_id)
+            context.append({"role": "user", "content": user_message})
+
+            # Build the payload with the full conversation context
+            payload = {
+                "model": "llama3.1:latest",
+                "prompt": self._build_prompt(context),
+            }
+
+            try:
+                with span("llm_call", "ollama/llama3.1:latest"):
+                    response = requests.post(API_URL, json=payload)
+
+                if response.status_code != 200:
+                    return f"Error: Received status code {response.status_code}"
+
+                # Parse the response parts
+                raw_responses = response.text.splitlines()
+                full_response_parts = []
+
+                for raw_response in raw_responses:
+                    try:
+                        part = json.loads(raw_response)
+                        full_response_parts.append(part.get('response', ''))
+                        if part.get('done', False):
+                            break
+                    except json.JSONDecodeError as e:
+                        print(f"Failed to decode part: {raw_response}, Error: {str(e)}")
+                        continue
+
+                full_response = ''.join(full_response_parts).strip()
+
+                # Save the finished turn to the session
+                self.sessions.append(session_id, [
+                    {"role": "user", "content": user_message},
+                    {"role": "assistant", "content": full_response},
+                ])
+
+                return full_response
+            except requests.exceptions.RequestException as e:
+                return f"HTTP Request failed: {str(e)}"
+            except Exception as e:
+                return f"Error: {str(e)}"
+
+    def _build_prompt(self, context):
         """
         Constructs the prompt using the context for continuity.
         """
+        messages = [{"role": "system", "content": self.instructions}] + context
         return "\n".join(
-            f"{msg['role'].capitalize()}: {msg['content']}" for msg in self.context
+            f"{msg['role'].capitalize()}: {msg['content']}" for msg in messages
         )
 
-    def run(self):
+    def run(self, session_id="terminal"):
         """
-        Starts the chat loop in a separate thread.
+        Starts the chat loop for one conversation.
         """
         print("Welcome to the chat with LLaMA 3.1. Type 'exit' to end the conversation.")
         while self.running:
@@ -87,14 +110,18 @@ class ChatAssistant(threading.Thread):
                 print("Goodbye!")
                 self.running = False
                 break
-            bot_response = self.send_message_to_bot(user_message)
+            bot_response = self.submit(session_id, user_message).result()
             print(f"Assistant: {bot_response}")
 
 
-if __name__ == '__main__':
+def main():
     if API_URL:
+        start_metrics_server()
         assistant = ChatAssistant()
-        assistant.start()
-        assistant.join()
+        assistant.run()
     else:
         print("Error: API_URL is not set in the environment variables.")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,52 +1,38 @@
 import os
-import requests
+import sys
 from dotenv import load_dotenv
-import json
 
 # Get the API URL from the environment variables
 API_URL = os.getenv('API_URL', 'http://localhost:11434/api/generate')
 
+# Shared helpers live in ../common
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.metrics import start_metrics_server
+from common.router import ModelRouter
+
+# llama3.1:latest on Ollama unless MODEL_BACKENDS lists other backends (e.g. an OpenAI fallback)
+# Prompts end with "Rick:" so the model answers in character
+router = ModelRouter.from_env(default="ollama/llama3.1:latest", ollama_url=API_URL, assistant_label="Rick")
+
 def send_message_to_bot(message):
     instructions = """
     You are Rick Sanchez, the eccentric, sarcastic, and genius scientist from the show "Rick and Morty." 
     You are highly intelligent, brutally honest, and often rude, with a nihilistic view of the universe. 
     Your speech is peppered with burps, and you don't shy away from mocking others, but you occasionally show a softer, more caring side.
     """
-    payload = {
-        "model": "llama3.1:latest",
-        "prompt": f"{instructions}\nUser: {message}\nRick:",
-    }
+    messages = [
+        {"role": "system", "content": instructions},
+        {"role": "user", "content": message},
+    ]
 
     try:
-        response = requests.post(API_URL, json=payload)
-        
-        # Check if the response status code is not 200 (OK)
-        if response.status_code != 200:
-            return f"Error: Received status code {response.status_code}"
-
-        # Aggregate the response parts
-        raw_responses = response.text.splitlines()
-        full_response_parts = []
-
-        for raw_response in raw_responses:
-            try:
-                part = json.loads(raw_response)
-                full_response_parts.append(part.get('response', ''))
-                # Check if this is the final part of the response
-                if part.get('done', False):
-                    break
-            except json.JSONDecodeError as e:
-                print(f"Failed to decode part: {raw_response}, Error: {str(e)}")
-                continue
-
-        full_response = ''.join(full_response_parts).strip()
-        return full_response
-    except requests.exceptions.RequestException as e:
-        return f"HTTP Request failed: {str(e)}"
+        # The router picks a healthy backend, fails over and hedges slow calls
+        return router.chat(messages).text
     except Exception as e:
         return f"Error: {str(e)}"
 
-if __name__ == '__main__':
+def main():
+    start_metrics_server()
     print("Welcome to the chat with LLaMA 3.1. Type 'exit' to end the conversation.")
     
     while True:
@@ -55,3 +41,8 @@ if __name__ == '__main__':
             break
         bot_response = send_message_to_bot(user_message)
         print(f"LLaMA: {bot_response}")
+    router.close()
+
+
+if __name__ == '__main__':
+    main()
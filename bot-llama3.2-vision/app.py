@@ -2,23 +2,45 @@ import base64
 import requests
 import os
 import json
-from flask import Flask, request, jsonify
+import logging
+import sys
+from flask import Flask, Response, request, jsonify
+
+# Shared helpers live in ../common
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.admission import AdmissionControl, flask_admission
+from common.metrics import CONTENT_TYPE, counter, histogram, render, span
 
 # Configure the base URL for the Llama 3.2 Vision model
 MODEL_URL = "http://localhost:11434/api/chat"
 
 app = Flask(__name__)
 
+IMAGE_BYTES = histogram("bot_image_bytes", "Size of the images sent to the vision model",
+                        buckets=(1e4, 1e5, 5e5, 1e6, 5e6, 1e7, 5e7))
+ASK_REQUESTS = counter("bot_vision_requests_total", "Requests to /ask", ("status",))
+
+# Per-client rate limit and a cap on concurrent Ollama calls in front of /ask
+admission = AdmissionControl("ollama")
+
+def request_cost(req):
+    """Rate-limit tokens of a request: one, plus one per MB of image to encode."""
+    image_path = (req.get_json(silent=True) or {}).get("image_path")
+    if image_path and os.path.isfile(image_path):
+        return 1 + os.path.getsize(image_path) // 1_000_000
+    return 1
+
 def encode_image_to_base64(image_path):
     """Converts an image to base64."""
     try:
-        print(f"Attempting to access file at: {image_path}")  # Debugging line
         # Check if the file exists before trying to open it
         if not os.path.exists(image_path):
             raise FileNotFoundError(f"File does not exist: {image_path}")
         
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode("utf-8")
+        with span("image_encode"), open(image_path, "rb") as image_file:
+            data = image_file.read()
+            IMAGE_BYTES.observe(len(data))
+            return base64.b64encode(data).decode("utf-8")
     except FileNotFoundError:
         raise FileNotFoundError(f"Image file not found at: {image_path}")
     except Exception as e:
@@ -40,33 +62,39 @@ def query_llama_vision(prompt, image_path=None):
         "messages": messages
     }
 
-    print(f"Payload: {payload}")  # Debugging line
+    # Log the prompt and image sizes, never the base64 payload itself
+    logging.debug(f"Vision request: {len(prompt)} prompt chars, "
+                  f"{sum(len(image) for image in messages[0].get('images', []))} image chars")
 
     try:
         # Send the request to the model with streaming support
-        response = requests.post(MODEL_URL, json=payload, stream=True)
-
-        # Check the response status code
-        if response.status_code != 200:
-            return {"error": f"Error {response.status_code}: {response.text}"}
-
-        # Process the streaming response
-        result = []
-        for line in response.iter_lines():
-            if line:  # Ignor empty lines
-                try:
-                    part = json.loads(line)
-                    content = part.get("message", {}).get("content", "")
-                    result.append(content)
-                except json.JSONDecodeError as e:
-                    return {"error": f"JSON decode error: {str(e)}"}
-
-        # Return the complete result
-        return {"response": "".join(result)}
+        with span("llm_call", "ollama/llama3.2-vision"):
+            return _read_streamed_answer(requests.post(MODEL_URL, json=payload, stream=True))
     except requests.exceptions.RequestException as e:
         return {"error": f"HTTP request failed: {str(e)}"}
 
+def _read_streamed_answer(response):
+    """Joins the parts of the model's streamed answer."""
+    # Check the response status code
+    if response.status_code != 200:
+        return {"error": f"Error {response.status_code}: {response.text}"}
+
+    # Process the streaming response
+    result = []
+    for line in response.iter_lines():
+        if line:  # Ignor empty lines
+            try:
+                part = json.loads(line)
+                content = part.get("message", {}).get("content", "")
+                result.append(content)
+            except json.JSONDecodeError as e:
+                return {"error": f"JSON decode error: {str(e)}"}
+
+    # Return the complete result
+    return {"response": "".join(result)}
+
 @app.route('/ask', methods=['POST'])
+@flask_admission(admission, cost=request_cost)
 def ask_model():
     """Endpoint to query the model."""
     data = request.json
@@ -76,6 +104,7 @@ def ask_model():
     image_path = data.get("image_path", None)
 
     if not prompt:
+        ASK_REQUESTS.inc(status="invalid")
         return jsonify({"error": "Prompt is required"}), 400
 
     # Validate the image path (if provided)
@@ -85,12 +114,23 @@ def ask_model():
 
     try:
         response = query_llama_vision(prompt, image_path)
+        ASK_REQUESTS.inc(status="error" if "error" in response else "ok")
         return jsonify(response)
     except Exception as e:
+        ASK_REQUESTS.inc(status="error")
         return jsonify({"error": str(e)}), 500
 
-if __name__ == '__main__':
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics of the bot."""
+    return Response(render(), content_type=CONTENT_TYPE)
+
+def main():
     # Show the current working directory for debugging
     print(f"Current working directory: {os.getcwd()}")
 
     app.run(host='0.0.0.0', port=5000, debug=True)  # Enable debug mode
+
+
+if __name__ == '__main__':
+    main()
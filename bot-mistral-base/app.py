@@ -1,7 +1,6 @@
 import os
-import requests
+import sys
 from dotenv import load_dotenv
-import json
 
 # Load environment variables
 load_dotenv()
@@ -9,42 +8,25 @@ load_dotenv()
 # Get the API URL from the environment variables
 API_URL = os.getenv('API_URL', 'http://localhost:11434/api/generate')
 
+# Shared helpers live in ../common
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.metrics import start_metrics_server
+from common.router import ModelRouter
+
+# mistral:latest on Ollama unless MODEL_BACKENDS lists other backends (e.g. an OpenAI fallback)
+router = ModelRouter.from_env(default="ollama/mistral:latest", ollama_url=API_URL)
+
 def send_message_to_bot(message):
-    payload = {
-        "model": "mistral:latest",
-        "prompt": message
-    }
+    messages = [{"role": "user", "content": message}]
 
     try:
-        response = requests.post(API_URL, json=payload)
-        
-        # Check if the response status code is not 200 (OK)
-        if response.status_code != 200:
-            return f"Error: Received status code {response.status_code}"
-
-        # Aggregate the response parts
-        raw_responses = response.text.splitlines()
-        full_response_parts = []
-
-        for raw_response in raw_responses:
-            try:
-                part = json.loads(raw_response)
-                full_response_parts.append(part.get('response', ''))
-                # Check if this is the final part of the response
-                if part.get('done', False):
-                    break
-            except json.JSONDecodeError as e:
-                print(f"Failed to decode part: {raw_response}, Error: {str(e)}")
-                continue
-
-        full_response = ''.join(full_response_parts).strip()
-        return full_response
-    except requests.exceptions.RequestException as e:
-        return f"HTTP Request failed: {str(e)}"
+        # The router picks a healthy backend, fails over and hedges slow calls
+        return router.chat(messages).text
     except Exception as e:
         return f"Error: {str(e)}"
 
-if __name__ == '__main__':
+def main():
+    start_metrics_server()
     print("Welcome to the chat with Mistral Type 'exit' to end the conversation.")
     
     while True:
@@ -53,3 +35,8 @@ if __name__ == '__main__':
             break
         bot_response = send_message_to_bot(user_message)
         print(f"Mistral: {bot_response}")
+    router.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,11 @@
+import asyncio
 import logging
 import os
+import sys
 from dotenv import load_dotenv
-from slack_bolt import App
-from slack_bolt.adapter.socket_mode import SocketModeHandler
 from openai import OpenAI
-from contextlib import ExitStack
-import requests
-from requests.auth import HTTPBasicAuth
-from bs4 import BeautifulSoup
+import json
 import io
-import subprocess
 import re
 from collections import OrderedDict
 
@@ -23,39 +19,33 @@ try:
 except Exception as err:
     logging.error(f"Error loading environment variables: {err}")
 
-def get_openai_api_key():
-    """Retrieve the OpenAI API key securely from 1Password."""
+# Shared helpers live in ../common
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.async_chat import create_chat_app, serve
+from common.confluence import ConfluenceCrawler
+from common.credentials import get_openai_api_key
+from common.html_extract import extract_page_text
+from common.metrics import span, start_metrics_server
+from common.prompts import UsageTracker
+from common.sessions import SessionLocks
+from common.startup import once
+from common.sync import BackgroundSync
+
+# Retrieve the OpenAI API key and configure the client, the first time it is needed
+@once("secret_lookup")
+def get_client():
+    api_key = get_openai_api_key()
+    if not api_key:
+        logging.error("OpenAI API key not found. Exiting.")
+        exit(1)
     try:
-        logging.debug("Attempting to retrieve OpenAI API key from 1Password.")
-        result = subprocess.run(
-            ["op", "read", "op://Employee/test_openai_key/password"],
-            stdout=subprocess.PIPE,
-            text=True
-        )
-        api_key = result.stdout.strip()
-        if api_key:
-            logging.debug("Successfully retrieved OpenAI API key from 1Password.")
-        else:
-            logging.warning("OpenAI API key retrieved is empty.")
-        return api_key
+        logging.debug("Configuring OpenAI client.")
+        client = OpenAI(api_key=api_key)
+        logging.info("OpenAI client configured successfully.")
+        return client
     except Exception as e:
-        logging.error(f"Error obtaining the API key from 1Password: {e}")
-        return None
-
-# Retrieve the OpenAI API key
-OPENAI_API_KEY = get_openai_api_key()
-if not OPENAI_API_KEY:
-    logging.error("OpenAI API key not found. Exiting.")
-    exit(1)
-
-# Configure the OpenAI client with the retrieved API key
-try:
-    logging.debug("Configuring OpenAI client.")
-    client = OpenAI(api_key=OPENAI_API_KEY)
-    logging.info("OpenAI client configured successfully.")
-except Exception as e:
-    logging.error(f"Error configuring OpenAI client: {e}")
-    exit(1)
+        logging.error(f"Error configuring OpenAI client: {e}")
+        exit(1)
 
 # Retrieve Confluence credentials from environment variables
 CONFLUENCE_USERNAME = os.environ.get('CONFLUENCE_USERNAME')
@@ -65,157 +55,282 @@ CONFLUENCE_BASE_URL = os.environ.get('CONFLUENCE_BASE_URL')
 if not CONFLUENCE_USERNAME or not CONFLUENCE_API_TOKEN or not CONFLUENCE_BASE_URL:
     logging.error("Confluence credentials not found in environment variables")
 
-# Function to retrieve Confluence page content
-def get_page_content(page_id):
-    """Fetch the content of a Confluence page using its page ID."""
-    url = f"{CONFLUENCE_BASE_URL}/rest/api/content/{page_id}?expand=body.view"
-    auth = HTTPBasicAuth(CONFLUENCE_USERNAME, CONFLUENCE_API_TOKEN)
+# Crawler state and the OpenAI resources built from it, kept between runs
+SYNC_STATE_PATH = os.environ.get('SYNC_STATE_PATH', 'confluence_sync_openai.json')
+INDEX_STATE_PATH = os.environ.get('OPENAI_INDEX_STATE_PATH', 'openai_index_state.json')
+
+def load_index_state():
+    """Load the IDs of the assistant, vector store and uploaded page files."""
     try:
-        logging.debug(f"Fetching content for page ID: {page_id}")
-        response = requests.get(url, auth=auth)
-        response.raise_for_status()  # Raise an HTTPError for bad responses
-        data = response.json()
-        html_content = data['body']['view']['value']
-        logging.debug(f"Content fetched successfully for page ID: {page_id}")
-        return html_content
-    except requests.exceptions.HTTPError as http_err:
-        logging.error(f"HTTP error occurred while fetching content for page {page_id}: {http_err}")
+        with open(INDEX_STATE_PATH) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        pass
     except Exception as err:
-        logging.error(f"Error occurred while fetching page content for page {page_id}: {err}")
-    return None
+        logging.error(f"Error reading index state {INDEX_STATE_PATH}, starting over: {err}")
+    return {"assistant_id": None, "vector_store_id": None, "files": {}}
 
-# Function to extract text from HTML content
-def extract_text_from_html(html_content):
-    """Extract plain text from HTML content."""
+def save_index_state(state):
+    """Persist the IDs of the assistant, vector store and uploaded page files."""
+    tmp_path = f"{INDEX_STATE_PATH}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, INDEX_STATE_PATH)
+
+def upload_page(page_id, text_content):
+    """Upload the text of a Confluence page to OpenAI and return the file ID."""
+    file_obj = io.BytesIO(text_content.encode('utf-8'))
+    file_obj.name = f"Confluence_Page_{page_id}.txt"
+    with span("file_upload", "openai"):
+        uploaded_file = get_client().files.create(file=file_obj, purpose='assistants')
+    logging.debug(f"File {file_obj.name} uploaded successfully")
+    return uploaded_file.id
+
+def delete_page_file(vector_store_id, file_id):
+    """Detach an outdated page file from the vector store and delete it."""
     try:
-        logging.debug(f"Extracting text from HTML content")
-        soup = BeautifulSoup(html_content, 'html.parser')
-        text = soup.get_text()
-        logging.debug(f"Text extracted successfully from HTML content")
-        return text
+        get_client().beta.vector_stores.files.delete(vector_store_id=vector_store_id, file_id=file_id)
     except Exception as err:
-        logging.error(f"Error occurred while extracting text from HTML content: {err}")
-        return None
-
-# List of Confluence page IDs
-page_ids = [
-    '756056110', '2328166682', '152338450', '2160722036', '2666594400',
-    '2971795516', '93126701', '2868445326', '872251404', '1634533508',
-    '1902674264', '772407317', '68354666', '772735036', '772735051',
-    '771096867', '791412877', '2975596629', '2847507373', '2716074132',
-    '275152964'
-]
-
-# Dictionary to store page content
-pages_content = {}
-
-# Fetch and process each Confluence page
-for page_id in page_ids:
+        logging.warning(f"Error detaching file {file_id} from vector store {vector_store_id}: {err}")
     try:
-        logging.debug(f"Processing page ID: {page_id}")
-        html_content = get_page_content(page_id)
-        if html_content:
-            text_content = extract_text_from_html(html_content)
-            if text_content:
-                pages_content[page_id] = text_content
-                logging.debug(f"Content for page ID {page_id} added to pages_content")
-            else:
-                logging.warning(f"Text content is empty for page ID {page_id}")
-        else:
-            logging.warning(f"HTML content is empty for page ID {page_id}")
+        get_client().files.delete(file_id)
     except Exception as err:
-        logging.error(f"Unexpected error occurred while processing page ID {page_id}: {err}")
+        logging.warning(f"Error deleting file {file_id}: {err}")
 
-# Create file objects from extracted content
-file_objects = []
-for page_id, text_content in pages_content.items():
-    try:
-        logging.debug(f"Creating file object for page ID: {page_id}")
-        byte_content = text_content.encode('utf-8')
-        file_obj = io.BytesIO(byte_content)
-        file_obj.name = f"Confluence_Page_{page_id}.txt"
-        file_objects.append(file_obj)
-        logging.debug(f"File object created successfully for page ID: {page_id}")
-    except Exception as err:
-        logging.error(f"Error creating file object for page {page_id}: {err}")
+# Files attached per vector store batch; the API takes at most 500 file IDs per batch
+FILE_BATCH_SIZE = int(os.environ.get('OPENAI_FILE_BATCH_SIZE', '500'))
 
-# Upload files to OpenAI
-uploaded_files = []
-for file_obj in file_objects:
-    try:
-        logging.debug(f"Uploading file: {file_obj.name} to OpenAI")
-        file_obj.seek(0)
-        uploaded_file = client.files.create(file=file_obj, purpose='assistants')
-        uploaded_files.append(uploaded_file)
-        logging.debug(f"File {file_obj.name} uploaded successfully")
-    except Exception as err:
-        logging.error(f"Error uploading file {file_obj.name} to OpenAI: {err}")
+def attach_files(vector_store_id, file_ids):
+    """Add files to a vector store in batches of FILE_BATCH_SIZE, raising unless every batch completed."""
+    for start in range(0, len(file_ids), FILE_BATCH_SIZE):
+        file_batch = get_client().beta.vector_stores.file_batches.create_and_poll(
+            vector_store_id=vector_store_id, file_ids=file_ids[start:start + FILE_BATCH_SIZE]
+        )
+        logging.info(f"Vector store batch {file_batch.id}: {file_batch.file_counts}")
+        if file_batch.status != "completed":
+            raise RuntimeError(f"Vector store batch {file_batch.id} ended as {file_batch.status}: "
+                               f"{file_batch.file_counts}")
 
-# Create the OpenAI assistant
-try:
-    logging.debug("Creating OpenAI assistant")
-    assistant = client.beta.assistants.create(
+# Model behind the Legal Guides assistant
+ASSISTANT_MODEL = os.environ.get('ASSISTANT_MODEL', 'gpt-4o')
+
+# The instructions are the static prefix of every run; keep them byte-identical
+# between runs so OpenAI can serve them from the prompt cache
+ASSISTANT_DESCRIPTION = (
+    "You are a Legal Documentation assistant for a company called Remerge. You help Remerge employees "
+    "understand the Legal Guides documentation created by the legal team. Your goal is to answer questions "
+    "and provide guidance per the Legal Guides files, which you can access via the tools."
+)
+ASSISTANT_INSTRUCTIONS = (
+    f"{ASSISTANT_DESCRIPTION} If user questions are not covered in the Legal Guides files, you should inform "
+    "the user that the question is outside the scope of the Legal Guides and that they should create a Jira "
+    "ticket for assistance. Do not answer any questions that are not related to the files you have access to."
+)
+
+# Token counts and cost of the assistant runs
+usage_tracker = UsageTracker("openai-RAG")
+
+def create_assistant(vector_store_id):
+    """Create the Legal Guides assistant linked to the vector store."""
+    return get_client().beta.assistants.create(
         name="Legal Guides Assistant",
-        description="You are a Legal Documentation assistant for a company called Remerge. You help Remerge employees understand the Legal Guides documentation created by the legal team. Your goal is to answer questions and provide guidance per the Legal Guides files, which you can access via the tools.",
-        instructions="You are a Legal Documentation assistant for a company called Remerge. You help Remerge employees understand the Legal Guides documentation created by the legal team. Your goal is to answer questions and provide guidance per the Legal Guides files, which you can access via the tools. If user questions are not covered in the Legal Guides files, you should inform the user that the question is outside the scope of the Legal Guides and that they should create a Jira ticket for assistance. Do not answer any questions that are not related to the files you have access to.",
-        model="gpt-4o",
+        description=ASSISTANT_DESCRIPTION,
+        instructions=ASSISTANT_INSTRUCTIONS,
+        model=ASSISTANT_MODEL,
         tools=[{"type": "file_search"}],
+        tool_resources={"file_search": {"vector_store_ids": [vector_store_id]}},
         metadata={"can_be_used_for_file_search": "True", "can_hold_vector_store": "True"},
     )
-    assistant_id = assistant.id  # Assign the assistant's ID here
-    logging.debug(f"OpenAI assistant created successfully with ID: {assistant_id}")
-except Exception as err:
-    logging.error(f"Error creating OpenAI assistant: {err}")
 
-# Create and load the vector store
-try:
-    logging.debug("Creating vector store for Legal Guides")
-    vector_store = client.beta.vector_stores.create(name="Pdf Vector")
-
-    with ExitStack() as stack:
-        file_streams = [stack.enter_context(file_obj) for file_obj in file_objects]
-        for file_obj in file_streams:
-            file_obj.seek(0)
-        file_batch = client.beta.vector_stores.file_batches.upload_and_poll(
-            vector_store_id=vector_store.id, files=file_streams
-        )
+def sync_knowledge_base(crawler, state):
+    """
+    Upload the Confluence pages changed since the last sync to the assistant's
+    vector store and remove deleted or outdated ones. The vector store and the
+    assistant are created on the first run and reused afterwards.
+    """
+    vector_store_id = state.get("vector_store_id")
+    if vector_store_id:
+        try:
+            get_client().beta.vector_stores.retrieve(vector_store_id)
+        except Exception as err:
+            logging.warning(f"Vector store {vector_store_id} is gone, rebuilding it: {err}")
+            vector_store_id = None
+            state.update({"assistant_id": None, "vector_store_id": None, "files": {}})
+
+    result = crawler.sync(full=not vector_store_id)
+
+    if not vector_store_id:
+        logging.debug("Creating vector store for Legal Guides")
+        vector_store_id = get_client().beta.vector_stores.create(name="Pdf Vector").id
+        state["vector_store_id"] = vector_store_id
+
+    # Upload the new version of every changed page; if anything fails, the files
+    # of this attempt are deleted and nothing is committed, so the next sync retries
+    new_files = {}
+    try:
+        for page_id, page in result.changed.items():
+            try:
+                text_content = extract_page_text(page.html, page_id, page.version)
+                if text_content:
+                    new_files[page_id] = upload_page(page_id, text_content)
+                else:
+                    logging.warning(f"Text content is empty for page ID {page_id}")
+            except Exception as err:
+                logging.error(f"Error uploading page {page_id} to OpenAI: {err}")
+                raise
+
+        attach_files(vector_store_id, list(new_files.values()))
+    except Exception:
+        for file_id in new_files.values():
+            delete_page_file(vector_store_id, file_id)
+        raise
+
+    # Retire the files of changed and removed pages
+    for page_id in list(result.changed) + result.removed:
+        old_file_id = state["files"].pop(page_id, None)
+        if old_file_id:
+            delete_page_file(vector_store_id, old_file_id)
+    state["files"].update(new_files)
+
+    if not state.get("assistant_id"):
+        logging.debug("Creating OpenAI assistant")
+        state["assistant_id"] = create_assistant(vector_store_id).id
+        logging.debug(f"OpenAI assistant created successfully with ID: {state['assistant_id']}")
 
-    # Update the assistant to link with the vector store
-    assistant = client.beta.assistants.update(
-        assistant_id=assistant.id,
+    save_index_state(state)
+    crawler.commit(result)
+    return state["assistant_id"]
+
+def refresh_knowledge_base(crawler, state):
+    """
+    Build a new vector store with the latest Confluence changes next to the one
+    the assistant is using, then point the assistant at it. Only changed pages
+    are uploaded; the files of unchanged pages are reused, but every file is
+    indexed again in the new store, in batches of FILE_BATCH_SIZE. Questions
+    keep being answered from the old store until the swap.
+    """
+    result = crawler.sync()
+    if not result:
+        crawler.commit(result)
+        return
+
+    stale = set(result.changed) | set(result.removed)
+    kept_files = {page_id: file_id for page_id, file_id in state["files"].items() if page_id not in stale}
+    new_files = {}
+    vector_store = None
+    try:
+        for page_id, page in result.changed.items():
+            text_content = extract_page_text(page.html, page_id, page.version)
+            if text_content:
+                new_files[page_id] = upload_page(page_id, text_content)
+
+        vector_store = get_client().beta.vector_stores.create(name="Pdf Vector")
+        attach_files(vector_store.id, list(kept_files.values()) + list(new_files.values()))
+    except Exception:
+        # The assistant still uses the old store; drop what this attempt created
+        try:
+            if vector_store is not None:
+                get_client().beta.vector_stores.delete(vector_store.id)
+            for file_id in new_files.values():
+                get_client().files.delete(file_id)
+        except Exception as err:
+            logging.warning(f"Error cleaning up after a failed refresh: {err}")
+        raise
+
+    # Swap: new runs use the new store as soon as the assistant is updated
+    get_client().beta.assistants.update(
+        assistant_id=state["assistant_id"],
         tool_resources={"file_search": {"vector_store_ids": [vector_store.id]}},
     )
-    logging.debug("Assistant updated successfully to link with vector store")
-except Exception as err:
-    logging.error(f"Error creating vector store or updating assistant: {err}")
-
-# Map page IDs to their respective Confluence URLs
-page_id_to_url = {
-    '756056110': 'https://remerge.atlassian.net/wiki/spaces/LEG/pages/756056110/Legal+Basics+-+How+to+work+with+Legal',
-    '2328166682': 'https://remerge.atlassian.net/wiki/spaces/HANDBOOK/pages/2328166682/Juro+-+Contract+Lifecycle+Management#Juro-roles-and-license-types',
-    '152338450': 'https://remerge.atlassian.net/wiki/spaces/LEG/pages/152338450/Contract+Locations',
-    '2160722036': 'https://remerge.atlassian.net/wiki/spaces/REV/pages/2160722036/Juro+how+to...',
-    '2666594400': 'https://remerge.atlassian.net/wiki/spaces/LEG/pages/2666594400/Requesting+Legal+Support+on+Jira',
-    '2971795516': 'https://remerge.atlassian.net/wiki/spaces/LEG/pages/2971795516/Contract+Basics+Guidelines',
-    '93126701': 'https://remerge.atlassian.net/wiki/spaces/HANDBOOK/pages/93126701/Approval+And+Signature',
-    '2868445326': 'https://remerge.atlassian.net/wiki/spaces/LEG/pages/2868445326/Usual+Contract+Types+Prioritizing+our+Standard+Templates',
-    '872251404': 'https://remerge.atlassian.net/wiki/spaces/LEG/pages/872251404/Remerge+IO+Explained',
-    '1634533508': 'https://remerge.atlassian.net/wiki/spaces/REV/pages/1634533508/Reviewing+non+Remerge+Insertion+Orders+Plus+any+adjacent+documentation',
-    '1902674264': 'https://remerge.atlassian.net/wiki/spaces/REV/pages/1902674264/IO+approval+process',
-    '772407317': 'https://remerge.atlassian.net/wiki/spaces/REV/pages/772407317/Agency+Discounts',
-    '68354666': 'https://remerge.atlassian.net/wiki/spaces/RT/pages/68354666/Minimum+Campaign+Requirements+Qualification+Matrix',
-    '772735036': 'https://remerge.atlassian.net/wiki/spaces/REV/pages/772735036/Volume+Discount+Programs+Scaled+Discounts',
-    '772735051': 'https://remerge.atlassian.net/wiki/spaces/REV/pages/772735051/Platform+Fee+Costs+Fee',
-    '771096867': 'https://remerge.atlassian.net/wiki/spaces/REV/pages/771096867/Fixed+CPA',
-    '791412877': 'https://remerge.atlassian.net/wiki/spaces/LEG/pages/791412877/Remerge+Terms+Conditions',
-    '2975596629': 'https://remerge.atlassian.net/wiki/spaces/LEG/pages/2975596629/Subprocessors+list+and+TOMs',
-    '2847507373': 'https://remerge.atlassian.net/wiki/spaces/LEG/pages/2847507373/Intergroup+International+Data+Transfers+to+Remerge+GmH',
-    '2716074132': 'https://remerge.atlassian.net/wiki/spaces/VM/pages/2716074132/Third-Party+Vendor+Risk+Management+TPRM+VRM+Policy',
-    '275152964': 'https://remerge.atlassian.net/wiki/spaces/LEG/pages/275152964/Event+Marketing+Sponsorship+Contracts'
-}
-
-# Dictionary to store the OpenAI threads associated with Slack threads
+    logging.info(f"Assistant now uses vector store {vector_store.id} "
+                 f"({len(result.changed)} pages changed, {len(result.removed)} removed)")
+
+    # Runs started before the swap may still read the previous store, so only the
+    # one retired by the last refresh is deleted now, with the files nobody uses
+    retired = state.get("retired_vector_store_id")
+    if retired:
+        try:
+            get_client().beta.vector_stores.delete(retired)
+        except Exception as err:
+            logging.warning(f"Error deleting vector store {retired}: {err}")
+    for file_id in state.get("retired_files", []):
+        try:
+            get_client().files.delete(file_id)
+        except Exception as err:
+            logging.warning(f"Error deleting file {file_id}: {err}")
+
+    state["retired_vector_store_id"] = state["vector_store_id"]
+    state["retired_files"] = [file_id for page_id, file_id in state["files"].items() if page_id in stale]
+    state["vector_store_id"] = vector_store.id
+    state["files"] = {**kept_files, **new_files}
+    save_index_state(state)
+    crawler.commit(result)
+
+crawler = ConfluenceCrawler.from_env(state_path=SYNC_STATE_PATH)
+index_state = load_index_state()
+
+# Bring the assistant's knowledge up to date with the configured Confluence spaces,
+# on the first question (or prewarm) instead of at import
+@once("index_load")
+def get_assistant_id():
+    try:
+        assistant_id = sync_knowledge_base(crawler, index_state)
+    except Exception as err:
+        logging.error(f"Error syncing the knowledge base: {err}")
+        assistant_id = index_state.get("assistant_id")
+        if not assistant_id:
+            exit(1)
+    return assistant_id
+
+# OpenAI threads of the HTTP conversations, by session_id
 openai_threads = {}
+# One run at a time per thread: OpenAI rejects messages while a run is active
+thread_locks = SessionLocks()
+
+def message_text(message):
+    """Text of an assistant message, without its annotations."""
+    return "".join(part.text.value for part in message.content if part.type == "text")
+
+def ask(thread_id, question):
+    """Add a question to an OpenAI thread, run the assistant on it and return the answer."""
+    get_client().beta.threads.messages.create(
+        thread_id=thread_id,
+        role="user",
+        content=question
+    )
+    with span("llm_call", "openai/assistant-run"):
+        run = get_client().beta.threads.runs.create_and_poll(
+            thread_id=thread_id,
+            assistant_id=get_assistant_id()
+        )
+    if run.usage:
+        usage_tracker.record(run.model or ASSISTANT_MODEL, run.usage)
+
+    messages = list(get_client().beta.threads.messages.list(thread_id=thread_id, run_id=run.id))
+    if not messages:
+        return "I couldn't process your message."
+    return message_text(messages[-1])
+
+def answer(question, session_id=None):
+    """Answer on the session's thread, or on a new one when there is no session_id."""
+    if session_id is None:
+        return ask(get_client().beta.threads.create().id, question)
+    with thread_locks.hold(session_id):
+        thread_id = openai_threads.get(session_id)
+        if thread_id is None:
+            thread_id = openai_threads[session_id] = get_client().beta.threads.create().id
+        return ask(thread_id, question)
+
+async def stream_answer(question, session_id=None):
+    try:
+        yield await asyncio.to_thread(answer, question, session_id)
+    except Exception as err:
+        logging.error(f"Error during conversation: {err}")
+        yield "An error occurred. Please try again."
+
+# HTTP endpoint for concurrent users: `python app.py serve`. Identical questions
+# without a session_id asked at the same time share one assistant run
+app = create_chat_app(stream_answer, title="Legal Guides Assistant")
 
 # Terminal-based conversation simulation
 def run_terminal_chat():
@@ -223,7 +338,7 @@ def run_terminal_chat():
     logging.info("Terminal Chat initialized. Type 'exit' to quit.")
 
     try:
-        thread = client.beta.threads.create()
+        thread = get_client().beta.threads.create()
         logging.debug(f"OpenAI thread created with ID: {thread.id}")
     except Exception as err:
         logging.error(f"Error creating OpenAI thread: {err}")
@@ -233,28 +348,29 @@ def run_terminal_chat():
         user_input = input("You: ").strip()
         if user_input.lower() in ("exit", "quit"):
             logging.info("Exiting terminal chat.")
+            usage_tracker.log_summary()
             break
 
         try:
-            client.beta.threads.messages.create(
-                thread_id=thread.id,
-                role="user",
-                content=user_input
-            )
-            run = client.beta.threads.runs.create_and_poll(
-                thread_id=thread.id,
-                assistant_id=assistant_id
-            )
-
-            messages = list(client.beta.threads.messages.list(thread_id=thread.id, run_id=run.id))
-            if messages:
-                assistant_response = messages[-1]
-                print(f"Assistant: {assistant_response.content}")
-            else:
-                print("Assistant: I couldn't process your message.")
+            print(f"Assistant: {ask(thread.id, user_input)}")
         except Exception as err:
             logging.error(f"Error during conversation: {err}")
             print("An error occurred. Please try again.")
 
+# Sync the knowledge base before the first question
+def prewarm():
+    get_assistant_id()
+
+def main():
+    start_metrics_server()
+    # Keep the knowledge base fresh while chatting (after the initial sync)
+    syncer = BackgroundSync(lambda: get_assistant_id() and refresh_knowledge_base(crawler, index_state))
+    syncer.start()
+    if sys.argv[1:] == ["serve"]:
+        serve(app)
+    else:
+        run_terminal_chat()
+    syncer.stop()
+
 if __name__ == "__main__":
-    run_terminal_chat()
+    main()
@@ -0,0 +1,102 @@
+import itertools
+import json
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+
+import bots
+from common import html_extract
+from common.confluence import ConfluencePage, SyncResult
+
+
+class FakeCrawler:
+    def __init__(self, result):
+        self.result = result
+        self.committed = []
+
+    def sync(self, full=False):
+        return self.result
+
+    def commit(self, result):
+        self.committed.append(result)
+
+
+def page(page_id, text="Leave policy"):
+    return ConfluencePage(page_id, f"Page {page_id}", "LEG", 2, f"https://wiki/{page_id}", f"<p>{text}</p>")
+
+
+@pytest.fixture
+def app(monkeypatch, tmp_path):
+    app = bots.load_bot("openai-rag")
+    client = mock.MagicMock()
+    file_ids = (f"file-new-{i}" for i in itertools.count())
+    client.files.create.side_effect = lambda **kwargs: SimpleNamespace(id=next(file_ids))
+    client.beta.vector_stores.create.return_value = SimpleNamespace(id="vs-new")
+    client.beta.vector_stores.file_batches.create_and_poll.return_value = SimpleNamespace(
+        id="batch", status="completed", file_counts={})
+    monkeypatch.setattr(app, "get_client", lambda: client)
+    monkeypatch.setattr(app, "INDEX_STATE_PATH", str(tmp_path / "index.json"))
+    monkeypatch.setattr(html_extract, "EXTRACT_CACHE_DIR", str(tmp_path / "extracted"))
+    monkeypatch.setattr(app, "client", client, raising=False)
+    return app
+
+
+def make_state():
+    return {"assistant_id": "asst", "vector_store_id": "vs-old",
+            "files": {"1": "file-1", "2": "file-2", "3": "file-3"}}
+
+
+def test_refresh_swaps_the_assistant_to_a_new_store(app):
+    crawler = FakeCrawler(SyncResult(changed={"2": page("2")}, removed=["3"]))
+    state = make_state()
+    app.refresh_knowledge_base(crawler, state)
+
+    batch = app.client.beta.vector_stores.file_batches.create_and_poll
+    batch.assert_called_once_with(vector_store_id="vs-new", file_ids=["file-1", "file-new-0"])
+    app.client.beta.assistants.update.assert_called_once_with(
+        assistant_id="asst", tool_resources={"file_search": {"vector_store_ids": ["vs-new"]}})
+    assert state["vector_store_id"] == "vs-new"
+    assert state["files"] == {"1": "file-1", "2": "file-new-0"}
+    # The old store and the files only it used are deleted by the next refresh
+    assert state["retired_vector_store_id"] == "vs-old"
+    assert state["retired_files"] == ["file-2", "file-3"]
+    app.client.beta.vector_stores.delete.assert_not_called()
+    with open(app.INDEX_STATE_PATH) as f:
+        assert json.load(f) == state
+    assert crawler.committed == [crawler.result]
+
+
+def test_failed_refresh_keeps_the_old_store_serving(app):
+    app.client.beta.vector_stores.file_batches.create_and_poll.return_value = SimpleNamespace(
+        id="batch", status="failed", file_counts={"failed": 1})
+    crawler = FakeCrawler(SyncResult(changed={"2": page("2")}))
+    state = make_state()
+    with pytest.raises(RuntimeError, match="ended as failed"):
+        app.refresh_knowledge_base(crawler, state)
+
+    assert state == make_state()
+    app.client.beta.assistants.update.assert_not_called()
+    app.client.beta.vector_stores.delete.assert_called_once_with("vs-new")
+    app.client.files.delete.assert_called_once_with("file-new-0")
+    # Not committed, so the next run sees the same changes again
+    assert crawler.committed == []
+
+
+def test_files_are_attached_in_batches(app, monkeypatch):
+    monkeypatch.setattr(app, "FILE_BATCH_SIZE", 2)
+    crawler = FakeCrawler(SyncResult(changed={"4": page("4"), "5": page("5")}))
+    app.refresh_knowledge_base(crawler, make_state())
+
+    batches = [call.kwargs["file_ids"]
+               for call in app.client.beta.vector_stores.file_batches.create_and_poll.call_args_list]
+    assert batches == [["file-1", "file-2"], ["file-3", "file-new-0"], ["file-new-1"]]
+
+
+def test_nothing_changed_keeps_the_store(app):
+    crawler = FakeCrawler(SyncResult())
+    state = make_state()
+    app.refresh_knowledge_base(crawler, state)
+    app.client.beta.vector_stores.create.assert_not_called()
+    assert state == make_state()
+    assert crawler.committed == [crawler.result]
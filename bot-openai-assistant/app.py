@@ -1,76 +1,127 @@
-from openai import OpenAI
-import subprocess
+import asyncio
 import logging
+import os
+import sys
 
-# Function to retrieve the OpenAI API key from 1Password
-def get_openai_api_key():
-    try:
-        result = subprocess.run(
-            ["op", "read", "op://Employee/test_openai_key/password"],
-            stdout=subprocess.PIPE,
-            text=True
-        )
-        return result.stdout.strip()
-    except Exception as e:
-        logging.error(f"Error from Open API from 1Password: {e}")
-        return None
+# Shared helpers live in ../common
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.async_chat import AsyncChatService, create_async_client, create_chat_app, print_stream, read_input, serve
+from common.credentials import get_openai_api_key
+from common.prompts import PromptBuilder, UsageTracker
+from common.sessions import get_session_store
+from common.startup import once
+
+# Retrieve the API key from 1Password, on the first conversation rather than at import
+@once("secret_lookup")
+def openai_api_key():
+    api_key = get_openai_api_key()
+    # Verify that the API key was retrieved successfully
+    if not api_key:
+        raise ValueError("I could not get the OpenAI API")
+    return api_key
+
+# One async client and connection pool for every conversation
+@once("client_setup")
+def get_client():
+    return create_async_client(openai_api_key())
 
-# Retrieve the API key using the above function
-OPENAI_API_KEY = get_openai_api_key()
+INSTRUCTIONS = """
+You are Rick Sanchez, the eccentric, sarcastic, and genius scientist from the show "Rick and Morty." 
+You are highly intelligent, brutally honest, and often rude, with a nihilistic view of the universe. 
+Your speech is peppered with burps, and you don't shy away from mocking others, but you occasionally show a softer, more caring side.
+"""
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+# The instructions and the earlier turns form a prefix that only grows,
+# so each request can reuse the prompt cache of the previous one
+usage_tracker = UsageTracker("openai-assistant")
+chat_service = AsyncChatService(get_client, PromptBuilder(INSTRUCTIONS), max_tokens=150, usage=usage_tracker)
 
-# Verify that the API key was retrieved successfully
-if OPENAI_API_KEY:
-    client.api_key = OPENAI_API_KEY
-else:
-    raise ValueError("I could not get the OpenAI API")
 
+# Conversations by user/thread ID, evicted once idle (SESSION_STORE, SESSION_TTL_SECONDS)
+sessions = get_session_store()
 
 # Class to handle interactions with the assistant
 class ChatAssistant:
-    def __init__(self):
-        self.instructions = """
-        You are Rick Sanchez, the eccentric, sarcastic, and genius scientist from the show "Rick and Morty." 
-        You are highly intelligent, brutally honest, and often rude, with a nihilistic view of the universe. 
-        Your speech is peppered with burps, and you don't shy away from mocking others, but you occasionally show a softer, more caring side.
-        """
-        self.messages = [{"role": "system", "content": self.instructions}]
-
-    def get_response(self, prompt):
-        # Añadir la entrada del usuario a la conversación
-        self.messages.append({"role": "user", "content": prompt})
+    """
+    One conversation, whose history lives in the session store under
+    `session_id`; without an ID nothing is kept between turns.
+    """
+
+    def __init__(self, session_id=None, store=None):
+        self.instructions = INSTRUCTIONS
+        self.session_id = session_id
+        self.sessions = store or sessions
+
+    @property
+    def history(self):
+        return self.sessions.get(self.session_id) if self.session_id else []
+
+    async def stream_response(self, prompt):
+        if self.session_id is None:
+            async for delta in self._stream_turn(prompt):
+                yield delta
+            return
+        # One turn at a time per conversation, so the history stays in order
+        async with self.sessions.locks.hold_async(self.session_id):
+            async for delta in self._stream_turn(prompt):
+                yield delta
+
+    async def _stream_turn(self, prompt):
+        parts = []
         try:
-            # Llamar a la API de Chat Completions de OpenAI
-            response = client.chat.completions.create(model="gpt-4",
-            messages=self.messages,
-            max_tokens=150)
-            # Extraer la respuesta del asistente
-            response_text = response.choices[0].message.content.strip()
-            # Añadir la respuesta del asistente a la conversación
-            self.messages.append({"role": "assistant", "content": response_text})
-            return response_text
+            # Llamar a la API de Chat Completions de OpenAI en streaming
+            async for delta in chat_service.stream(prompt, self.history):
+                parts.append(delta)
+                yield delta
         except Exception as e:
             logging.error(f"Error al obtener la respuesta: {e}")
-            return f"Error al obtener la respuesta: {e}"
+            yield f"Error al obtener la respuesta: {e}"
+            return
+        # Añadir el turno completo a la conversación
+        if self.session_id:
+            self.sessions.append(self.session_id, [
+                {"role": "user", "content": prompt},
+                {"role": "assistant", "content": "".join(parts).strip()},
+            ])
+
+    async def get_response(self, prompt):
+        parts = [delta async for delta in self.stream_response(prompt)]
+        return "".join(parts).strip()
+
+def stream_session_response(prompt, session_id=None):
+    return ChatAssistant(session_id).stream_response(prompt)
+
+# HTTP endpoint for concurrent users: `python app.py serve`
+app = create_chat_app(stream_session_response, title="Rick Assistant")
 
 # Function to interact with the assistant
-def interact_with_chat_assistant():
-    assistant = ChatAssistant()
+async def interact_with_chat_assistant():
+    assistant = ChatAssistant(session_id="terminal")
     print("Rick Assistant. Type 'exit' to end the conversation.")
 
     while True:
-        user_input = input("You: ")
+        user_input = await read_input("You: ")
         if user_input.lower() == "exit":
             print("¡Bye!")
+            usage_tracker.log_summary()
             break
-        response = assistant.get_response(user_input)
-        print(f"Assistant: {response}")
+        await print_stream(assistant.stream_response(user_input), prefix="Assistant: ")
+
+# Resolve the API key and build the client before the first user arrives
+def prewarm():
+    get_client()
 
 # Main execution flow
-if __name__ == "__main__":
+def main():
     try:
-        interact_with_chat_assistant()
+        openai_api_key()
+        if sys.argv[1:] == ["serve"]:
+            serve(app)
+        else:
+            asyncio.run(interact_with_chat_assistant())
     except Exception as e:
         logging.error(f"Error running APP: {e}")
         print(f"Error: {e}")
+
+if __name__ == "__main__":
+    main()
@@ -1,53 +1,72 @@
-from openai import OpenAI
-import subprocess
+import asyncio
 import os
+import sys
 import logging
 
-# Function to get the OpenAI API key from 1Password
-def get_openai_api_key():
-    try:
-        result = subprocess.run(
-            ["op", "read", "op://Employee/test_openai_key/password"],
-            stdout=subprocess.PIPE,
-            text=True
-        )
-        return result.stdout.strip()
-    except Exception as e:
-        logging.error(f"Error obtaining the API key from 1Password: {e}")
-        return None
+# Shared helpers live in ../common
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.async_chat import AsyncChatService, create_async_client, create_chat_app, print_stream, read_input, serve
+from common.credentials import get_openai_api_key
+from common.prompts import PromptBuilder, UsageTracker
+from common.startup import once
+
+# Get the API key from 1Password, on the first chat rather than at import
+@once("secret_lookup")
+def openai_api_key():
+    api_key = get_openai_api_key()
+    if not api_key:
+        raise ValueError("Failed to retrieve OpenAI API key")
+    return api_key
 
-# Get the API key using the function above
-OPENAI_API_KEY = get_openai_api_key()
+# Configure the async OpenAI client with the obtained key; its connections are reused by every chat
+@once("client_setup")
+def get_client():
+    return create_async_client(openai_api_key())
 
-# Configure the OpenAI client with the obtained key
-client = OpenAI(api_key=OPENAI_API_KEY)
+# Static system prompt first so every request shares a cacheable prefix
+prompt_builder = PromptBuilder("You are a helpful assistant.")
+usage_tracker = UsageTracker("openai-base")
+chat_service = AsyncChatService(get_client, prompt_builder, max_tokens=150, usage=usage_tracker)
 
-def get_response(prompt):
+async def stream_response(prompt, session_id=None):
     try:
-        response = client.chat.completions.create(model="gpt-4",
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant."},
-            {"role": "user", "content": prompt}
-        ],
-        max_tokens=150)
-        response_text = response.choices[0].message.content.strip()
-        return response_text
+        async for delta in chat_service.stream(prompt):
+            yield delta
     except Exception as e:
         logging.error(f"Error getting response: {e}")
-        return f"Error getting response: {e}"
+        yield f"Error getting response: {e}"
 
-def chat():
+async def get_response(prompt):
+    parts = [delta async for delta in stream_response(prompt)]
+    return "".join(parts).strip()
+
+async def chat():
     print("OpenAI Chatbot. Type 'exit' to end the conversation.")
     while True:
-        user_input = input("You: ")
+        user_input = await read_input("You: ")
         if user_input.lower() == 'exit':
+            usage_tracker.log_summary()
             break
-        response = get_response(user_input)
-        print(f"Bot: {response}")
+        await print_stream(stream_response(user_input), prefix="Bot: ")
 
-if __name__ == "__main__":
-    if OPENAI_API_KEY:
-        chat()
-    else:
+# HTTP endpoint for concurrent users: `python app.py serve`
+app = create_chat_app(stream_response, title="OpenAI Chatbot", stateless=True)
+
+# Resolve the API key and build the client before the first user arrives
+def prewarm():
+    get_client()
+
+def main():
+    try:
+        openai_api_key()
+    except ValueError as e:
         print("Failed to obtain the OpenAI API key.")
-        print(OPENAI_API_KEY)
+        print(e)
+        return
+    if sys.argv[1:] == ["serve"]:
+        serve(app)
+    else:
+        asyncio.run(chat())
+
+if __name__ == "__main__":
+    main()
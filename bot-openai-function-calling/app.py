@@ -1,52 +1,54 @@
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
 import sqlite3
-import subprocess
 import logging
 from openai import AsyncOpenAI
 import json
-
-# Function to get the OpenAI API key from 1Password
-def get_openai_api_key():
-    try:
-        result = subprocess.run(
-            ["op", "read", "op://Employee/test_openai_key/password"],
-            stdout=subprocess.PIPE,
-            text=True
-        )
-        return result.stdout.strip()
-    except Exception as e:
-        logging.error(f"Error obtaining the API key from 1Password: {e}")
-        return None
-
-# Get the API key using the function above
-OPENAI_API_KEY = get_openai_api_key()
-
-client = AsyncOpenAI(api_key=OPENAI_API_KEY)
-
-if not OPENAI_API_KEY:
-    raise ValueError("Failed to retrieve OpenAI API key")
-
-
-# SQLite database configuration
-db_file = "example.db"
-conn = sqlite3.connect(db_file)
-cursor = conn.cursor()
-
-# Insert example data
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS products (
-    id INTEGER PRIMARY KEY,
-    name TEXT,
-    price REAL
-)
-""")
-conn.commit()
-
-# Insert example data
-cursor.execute("INSERT INTO products (name, price) VALUES (?, ?)", ("Laptop", 999.99))
-cursor.execute("INSERT INTO products (name, price) VALUES (?, ?)", ("Mouse", 19.99))
-conn.commit()
+import os
+import sys
+
+# Shared helpers live in ../common
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.admission import AdmissionControl, add_fastapi_admission
+from common.credentials import get_openai_api_key
+from common.metrics import CONTENT_TYPE, render, span
+from common.singleflight import AsyncSingleFlight, normalize_prompt
+from common.startup import once
+
+# Get the API key from 1Password and create the client, on the first request
+@once("secret_lookup")
+def get_client():
+    api_key = get_openai_api_key()
+    if not api_key:
+        raise ValueError("Failed to retrieve OpenAI API key")
+    return AsyncOpenAI(api_key=api_key)
+
+
+# SQLite database configuration (resolved now, the file is opened on the first lookup)
+db_file = os.path.abspath("example.db")
+
+@once("database_setup")
+def get_cursor():
+    # The connection belongs to the thread running the event loop, where the lookups run
+    conn = sqlite3.connect(db_file)
+    cursor = conn.cursor()
+
+    # Insert example data
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS products (
+        id INTEGER PRIMARY KEY,
+        name TEXT,
+        price REAL
+    )
+    """)
+    conn.commit()
+
+    # Insert example data
+    cursor.execute("INSERT INTO products (name, price) VALUES (?, ?)", ("Laptop", 999.99))
+    cursor.execute("INSERT INTO products (name, price) VALUES (?, ?)", ("Mouse", 19.99))
+    conn.commit()
+    return cursor
 
 # Initialize FastAPI
 app = FastAPI()
@@ -55,8 +57,24 @@ app = FastAPI()
 class QueryRequest(BaseModel):
     query: str
 
+# Identical questions asked at the same time share one OpenAI call
+chat_flight = AsyncSingleFlight("function-calling-chat")
+
+# Requests that will only wait for a call already in flight take no OpenAI slot
+def follows_call_in_flight(body: bytes) -> bool:
+    try:
+        request = QueryRequest.model_validate_json(body)
+    except ValueError:
+        return False
+    return chat_flight.in_flight(normalize_prompt(request.query))
+
+# Per-client rate limit and a cap on concurrent OpenAI calls in front of /chat
+admission = AdmissionControl("openai")
+add_fastapi_admission(app, admission, follower=follows_call_in_flight)
+
 # Predefined function to retrieve data from the database
 def get_product_info(product_name: str):
+    cursor = get_cursor()
     cursor.execute("SELECT name, price FROM products WHERE name = ?", (product_name,))
     result = cursor.fetchone()
     if result:
@@ -82,16 +100,16 @@ functions = [
     }
 ]
 
-@app.post("/chat")
-async def chat(request: QueryRequest):
+async def answer_query(query: str):
     try:
         # Request GPT to process the query
-        response = await client.chat.completions.create(
-            model="gpt-4-0613",
-            messages=[{"role": "user", "content": request.query}],
-            functions=functions,
-            function_call="auto"
-        )
+        with span("llm_call", "openai/gpt-4-0613"):
+            response = await get_client().chat.completions.create(
+                model="gpt-4-0613",
+                messages=[{"role": "user", "content": query}],
+                functions=functions,
+                function_call="auto"
+            )
 
         # Direct access to the attributes of response.choices
         if response.choices and response.choices[0].message.function_call:
@@ -100,7 +118,8 @@ async def chat(request: QueryRequest):
 
             if function_name == "get_product_info":
                 args = json.loads(arguments)
-                result = get_product_info(args["product_name"])
+                with span("tool_call", function_name):
+                    result = get_product_info(args["product_name"])
                 return {"result": result}
 
         # General response
@@ -110,6 +129,28 @@ async def chat(request: QueryRequest):
         logging.error(f"Error during OpenAI API call: {e}", exc_info=True)
         return {"error": str(e)}
 
-if __name__ == "__main__":
+@app.post("/chat")
+async def chat(request: QueryRequest):
+    return await chat_flight.do(normalize_prompt(request.query), lambda: answer_query(request.query))
+
+# How many /chat calls were answered by a call already in flight, and the admission queue
+@app.get("/stats")
+async def stats():
+    return {"coalescing": chat_flight.stats.snapshot(), "admission": admission.stats()}
+
+# Prometheus metrics: span latencies, errors and token counts
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(render(), media_type=CONTENT_TYPE)
+
+# Resolve the API key before the first request; the database is opened by the
+# event loop thread on the first product lookup
+def prewarm():
+    get_client()
+
+def main():
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,27 @@
-from openai import OpenAI
-import subprocess
+import asyncio
 import logging
 import os
+import sys
 
-# Function to obtain the OpenAI API key from 1Password
-def get_openai_api_key():
-    try:
-        # Use the "op" command-line tool to securely fetch the API key
-        result = subprocess.run(
-            ["op", "read", "op://Employee/test_openai_key/password"],
-            stdout=subprocess.PIPE,
-            text=True
-        )
-        return result.stdout.strip()
-    except Exception as e:
-        # Log an error if the API key cannot be fetched
-        logging.error(f"Error obtaining the API key from 1Password: {e}")
-        return None
+# Shared helpers live in ../common
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.async_chat import AsyncChatService, create_async_client, create_chat_app, print_stream, read_input, serve
+from common.credentials import get_openai_api_key
+from common.prompts import PromptBuilder, UsageTracker
+from common.startup import once
 
-# Retrieve the API key using the function above
-OPENAI_API_KEY = get_openai_api_key()
+# Retrieve the API key from 1Password, on the first chat rather than at import
+@once("secret_lookup")
+def openai_api_key():
+    api_key = get_openai_api_key()
+    if not api_key:
+        raise ValueError("Failed to retrieve OpenAI API key")
+    return api_key
 
-# Configure the OpenAI client with the retrieved API key
-client = OpenAI(api_key=OPENAI_API_KEY)
+# Configure the async OpenAI client with the retrieved API key; its connections are reused by every chat
+@once("client_setup")
+def get_client():
+    return create_async_client(openai_api_key())
 
 # Define the chatbot's personality as Rick Sanchez
 person_description = """
@@ -31,45 +30,61 @@ You are highly intelligent, brutally honest, and often rude, with a nihilistic v
 Your speech is peppered with burps, and you don't shy away from mocking others, but you occasionally show a softer, more caring side.
 """
 
-def get_response(prompt):
+# The personality is the static prefix of every request, so it can be served from the prompt cache
+prompt_builder = PromptBuilder(person_description)
+usage_tracker = UsageTracker("openai-intructions")
+chat_service = AsyncChatService(get_client, prompt_builder, max_tokens=1000, usage=usage_tracker)
+
+async def stream_response(prompt, session_id=None):
     try:
-        # Send the prompt and Rick Sanchez's personality to the OpenAI API
-        response = client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": person_description},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=1000
-        )
-        # Extract and return the text of the assistant's response
-        response_text = response.choices[0].message.content.strip()
-        return response_text
+        # Stream Rick Sanchez's answer as it is generated
+        async for delta in chat_service.stream(prompt):
+            yield delta
     except Exception as e:
         # Log and return an error message if the API request fails
         logging.error(f"Error getting response: {e}")
-        return f"Error getting response: {e}"
+        yield f"Error getting response: {e}"
 
-def chat():
+async def get_response(prompt):
+    # Collect the streamed answer into a single string
+    parts = [delta async for delta in stream_response(prompt)]
+    return "".join(parts).strip()
+
+async def chat():
     """
     Start an interactive chat session with the Rick Sanchez chatbot.
     """
     print("Rick Sanchez Chatbot. Type 'exit' to end the conversation.")
     while True:
-        # Get user input
-        user_input = input("You: ")
+        # Get user input without blocking the event loop
+        user_input = await read_input("You: ")
         if user_input.lower() == 'exit':
             # Exit the chat session
             print("Bot: Alright, Morty—I mean, user. See ya around!")
+            usage_tracker.log_summary()
             break
-        # Get the chatbot's response and display it
-        response = get_response(user_input)
-        print(f"Bot: {response}")
+        # Print the chatbot's response as it streams in
+        await print_stream(stream_response(user_input), prefix="Bot: ")
 
-if __name__ == "__main__":
-    # Run the chat session if the API key is available
-    if OPENAI_API_KEY:
-        chat()
-    else:
+# HTTP endpoint for concurrent users: `python app.py serve`
+app = create_chat_app(stream_response, title="Rick Sanchez Chatbot", stateless=True)
+
+# Resolve the API key and build the client before the first user arrives
+def prewarm():
+    get_client()
+
+def main():
+    try:
+        openai_api_key()
+    except ValueError:
         # Display an error message if the API key could not be retrieved
         print("Failed to obtain the OpenAI API key.")
+        return
+    # Run the chat session now that the API key is available
+    if sys.argv[1:] == ["serve"]:
+        serve(app)
+    else:
+        asyncio.run(chat())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+import importlib.util
+import os
+import sys
+
+from common.startup import phase
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Launcher name -> bot directory; each holds an app.py with main() and, when
+# it has expensive initialisation worth doing ahead of the first request, prewarm().
+# A bot that cannot answer before that initialisation is done sets MARKS_READY
+# and calls profile.mark_ready() itself
+BOTS = {
+    "llama-base": "bot-llama3.1-base",
+    "mistral-base": "bot-mistral-base",
+    "llama-intructions": "bot-llama3.1-intructions",
+    "llama-assistant": "bot-llama3.1-assistant",
+    "llama-rag": "bot-llama3.1-RAG",
+    "vision": "bot-llama3.2-vision",
+    "openai-base": "bot-openai-base",
+    "openai-intructions": "bot-openai-intructions",
+    "openai-assistant": "bot-openai-assistant",
+    "openai-rag": "bot-openai-RAG",
+    "function-calling": "bot-openai-function-calling",
+}
+
+
+def load_bot(name: str):
+    """
+    Imports the app.py of a bot, and only that one: the dependencies of the
+    other bots (chromadb, flask, the OpenAI SDK, ...) are never loaded.
+    The bot directory is put on sys.path so its sibling modules resolve like
+    they do when the script is run directly. The import is timed as a startup phase.
+    """
+    if name not in BOTS:
+        raise KeyError(f"Unknown bot '{name}', expected one of: {', '.join(BOTS)}")
+    directory = os.path.join(REPO_ROOT, BOTS[name])
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+
+    module_name = "bots_" + name.replace("-", "_")
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(directory, "app.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    try:
+        with phase("import"):
+            spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[module_name]
+        raise
+    return module
@@ -0,0 +1,82 @@
+import argparse
+import atexit
+import logging
+import os
+import sys
+
+from bots import BOTS, REPO_ROOT, load_bot
+from common.startup import STARTUP_TARGET_SECONDS, prewarm_in_background, profile
+
+
+def list_bots(args):
+    for name, directory in BOTS.items():
+        print(f"{name:<20} {directory}")
+    return 0
+
+
+def run_bot(args):
+    bot = load_bot(args.name)
+    # The bot parses its own arguments, if any, as if it were run directly
+    sys.argv = [os.path.join(REPO_ROOT, BOTS[args.name], "app.py")] + args.bot_args
+    if args.profile:
+        atexit.register(lambda: print(profile.report(), file=sys.stderr))
+    if args.prewarm and hasattr(bot, "prewarm"):
+        # Secrets, clients and models load while the bot is already waiting for its first request
+        prewarm_in_background(bot.prewarm)
+    # Bots that must load something before their first answer (MARKS_READY) mark it themselves
+    if not getattr(bot, "MARKS_READY", False):
+        profile.mark_ready()
+        logging.info(f"{args.name} ready after {profile.ready_at:.2f}s")
+    bot.main()
+    return 0
+
+
+def profile_bot(args):
+    """Imports the bot and runs its prewarm in the foreground, to time a complete cold start."""
+    try:
+        bot = load_bot(args.name)
+    except ImportError as e:
+        print(f"Import of {args.name} failed: {e}", file=sys.stderr)
+        return 1
+    if hasattr(bot, "prewarm"):
+        try:
+            bot.prewarm()
+        except Exception as e:
+            # The phases that did finish are still worth seeing
+            print(profile.report(args.target))
+            print(f"Prewarm of {args.name} failed: {e.__class__.__name__}: {e}", file=sys.stderr)
+            return 1
+    profile.mark_ready()
+    print(profile.report(args.target))
+    return 0 if profile.ready_at <= args.target else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m bots", description="Start any of the bots from one entry point.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("list", help="List the bots").set_defaults(handler=list_bots)
+
+    run = commands.add_parser("run", help="Start a bot")
+    run.add_argument("name", choices=BOTS)
+    run.add_argument("--no-prewarm", dest="prewarm", action="store_false",
+                     help="Initialise lazily on the first request instead of in the background")
+    run.add_argument("--profile", action="store_true", help="Print the startup phases when the bot exits")
+    run.set_defaults(handler=run_bot)
+
+    measure = commands.add_parser("profile", help="Time the cold start of a bot, prewarm included")
+    measure.add_argument("name", choices=BOTS)
+    measure.add_argument("--target", type=float, default=STARTUP_TARGET_SECONDS,
+                         help="Exit with an error above this many seconds")
+    measure.set_defaults(handler=profile_bot)
+
+    # Arguments the launcher does not know about are passed on to the bot
+    args, bot_args = parser.parse_known_args()
+    args.bot_args = bot_args
+    if args.bot_args and args.command != "run":
+        parser.error(f"unrecognized arguments: {' '.join(args.bot_args)}")
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+import argparse
+import sys
+import textwrap
+
+import pytest
+
+import bots
+from bots import __main__ as launcher
+from common.startup import profile
+
+APPS = {
+    "ok": """
+        from common.startup import once
+
+        @once("client_setup")
+        def get_client():
+            return "client"
+
+        def prewarm():
+            get_client()
+
+        def main():
+            pass
+    """,
+    "no-secret": """
+        from common.startup import once
+
+        @once("secret_lookup")
+        def api_key():
+            return None
+
+        def prewarm():
+            api_key()
+
+        def main():
+            pass
+    """,
+    "broken": """
+        import a_module_that_does_not_exist
+    """,
+    "slow-index": """
+        from common.startup import profile
+
+        MARKS_READY = True
+        seen = []
+
+        def main():
+            seen.append(profile.ready_at)
+            profile.mark_ready()
+    """,
+}
+
+
+@pytest.fixture
+def fake_bots(tmp_path, monkeypatch):
+    directories = {}
+    for name, source in APPS.items():
+        directory = tmp_path / f"bot-{name}"
+        directory.mkdir()
+        (directory / "app.py").write_text(textwrap.dedent(source))
+        directories[name] = directory.name
+    monkeypatch.setattr(bots, "REPO_ROOT", str(tmp_path))
+    monkeypatch.setattr(bots, "BOTS", directories)
+    monkeypatch.setattr(launcher, "BOTS", directories)
+    monkeypatch.setattr(launcher, "REPO_ROOT", str(tmp_path))
+    # The profile is process-wide; start each test from a cold one
+    monkeypatch.setattr(profile, "phases", [])
+    monkeypatch.setattr(profile, "ready_at", None)
+    monkeypatch.setattr(sys, "argv", list(sys.argv))
+
+
+def test_profile_reports_the_phases(fake_bots, capsys):
+    assert launcher.profile_bot(argparse.Namespace(name="ok", target=60)) == 0
+    out = capsys.readouterr().out
+    assert "client_setup" in out
+    assert "within the 60s target" in out
+
+
+def test_profile_reports_a_failed_prewarm_without_a_traceback(fake_bots, capsys):
+    assert launcher.profile_bot(argparse.Namespace(name="no-secret", target=60)) == 1
+    captured = capsys.readouterr()
+    assert "secret_lookup" in captured.out
+    assert captured.err.strip() == "Prewarm of no-secret failed: ValueError: secret_lookup: api_key returned None"
+
+
+def test_profile_reports_a_failed_import(fake_bots, capsys):
+    assert launcher.profile_bot(argparse.Namespace(name="broken", target=60)) == 1
+    assert "Import of broken failed" in capsys.readouterr().err
+
+
+def test_run_leaves_readiness_to_bots_that_mark_it(fake_bots):
+    args = argparse.Namespace(name="slow-index", bot_args=[], profile=False, prewarm=True)
+    assert launcher.run_bot(args) == 0
+    bot = bots.load_bot("slow-index")
+    assert bot.seen == [None]
+    assert profile.ready_at is not None
@@ -0,0 +1,508 @@
+import asyncio
+import heapq
+import ipaddress
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+
+from common.metrics import counter, gauge, histogram
+
+# Per-client token bucket: sustained requests per second and burst size (0 disables the limit)
+RATE_LIMIT_PER_SECOND = float(os.getenv('RATE_LIMIT_PER_SECOND', '2'))
+RATE_LIMIT_BURST = float(os.getenv('RATE_LIMIT_BURST', '10'))
+# Requests sent to one backend (e.g. 'ollama', 'openai') at the same time
+BACKEND_MAX_CONCURRENCY = int(os.getenv('BACKEND_MAX_CONCURRENCY', '16'))
+# Requests waiting for a backend slot before new ones are turned away
+ADMISSION_QUEUE_SIZE = int(os.getenv('ADMISSION_QUEUE_SIZE', '64'))
+# Longest a request may wait for a slot, unless the client asks for less
+ADMISSION_DEADLINE_SECONDS = float(os.getenv('ADMISSION_DEADLINE_SECONDS', '30'))
+
+# Addresses or networks (comma separated, e.g. '10.0.0.5,10.1.0.0/16') of the
+# proxies or gateways allowed to set the client and priority headers below.
+# Requests from anywhere else are keyed on their peer address at the default priority.
+TRUSTED_PROXIES = os.getenv('TRUSTED_PROXIES', '')
+
+# Request headers read by the HTTP glue
+CLIENT_HEADER = "X-Client-ID"
+PRIORITY_HEADER = "X-Priority"  # 0 (most urgent) to 9, default 5
+DEADLINE_HEADER = "X-Deadline-Seconds"
+DEFAULT_PRIORITY = 5
+
+ADMITTED = counter("bot_admission_admitted_total", "Requests given a backend slot", ("backend",))
+REJECTED = counter("bot_admission_rejected_total", "Requests turned away", ("backend", "reason"))
+IN_FLIGHT = gauge("bot_admission_in_flight", "Requests holding a backend slot", ("backend",))
+QUEUED = gauge("bot_admission_queued", "Requests waiting for a backend slot", ("backend",))
+QUEUE_WAIT = histogram("bot_admission_wait_seconds", "Time spent waiting for a backend slot", ("backend",))
+
+
+class Rejected(Exception):
+    """
+    A request turned away before reaching the model: `status` is 429 when the
+    client is over its rate limit and 503 when the backend is saturated.
+    """
+
+    def __init__(self, status: int, reason: str, retry_after: float):
+        super().__init__(f"{reason} (retry after {retry_after:.1f}s)")
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+    def headers(self) -> dict:
+        return {"Retry-After": str(max(1, round(self.retry_after)))}
+
+    def body(self) -> dict:
+        return {"error": self.reason, "retry_after": round(self.retry_after, 2)}
+
+
+class TokenBucket:
+    """Refills `rate` tokens per second up to `burst`; a request spends `cost` tokens."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, cost: float = 1.0) -> float:
+        """Spends the tokens and returns 0, or returns the seconds until they are available."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        # A request dearer than the whole bucket only needs a full one
+        cost = min(cost, self.burst)
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+
+class ClientLimiter:
+    """One token bucket per client ID; idle clients are forgotten (LRU)."""
+
+    def __init__(self, rate: float = RATE_LIMIT_PER_SECOND, burst: float = RATE_LIMIT_BURST,
+                 max_clients: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+
+    def check(self, client: str, cost: float = 1.0) -> float:
+        """0 when the client may go ahead, otherwise the seconds it should wait."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            bucket = self._buckets.pop(client, None) or TokenBucket(self.rate, self.burst)
+            self._buckets[client] = bucket
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            return bucket.take(cost)
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "deadline", "wake", "granted", "cancelled")
+
+    def __init__(self, priority, seq, deadline, wake):
+        self.priority = priority
+        self.seq = seq
+        self.deadline = deadline
+        self.wake = wake
+        self.granted = False
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class BackendGate:
+    """
+    At most `max_concurrency` requests at a time to one backend. Others wait in
+    a priority queue (lower priority value first, then arrival order) until a
+    slot frees up or their deadline passes. A request whose estimated wait,
+    from the recent average service time, is already past its deadline is
+    rejected at once instead of queueing for nothing.
+    Usable from threads (hold) and from one event loop (hold_async).
+    """
+
+    def __init__(self, name: str, max_concurrency: int = BACKEND_MAX_CONCURRENCY,
+                 max_queue: int = ADMISSION_QUEUE_SIZE):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.active = 0
+        self.avg_service = None  # seconds, moving average
+        self._lock = threading.Lock()
+        self._queue = []
+        self._queued = 0
+        self._seq = itertools.count()
+
+    def estimated_wait(self, priority: int) -> float:
+        """Seconds a new request of this priority would wait, 0 when a slot is free."""
+        with self._lock:
+            return self._estimate(priority)
+
+    def _estimate(self, priority):
+        if self.active < self.max_concurrency and not self._queued:
+            return 0.0
+        if self.avg_service is None:
+            return 0.0
+        ahead = sum(1 for w in self._queue if not w.cancelled and w.priority <= priority)
+        return self.avg_service * (ahead // self.max_concurrency + 1)
+
+    def _enter(self, priority, deadline, wake):
+        """Takes a free slot (returns None) or queues a waiter; raises Rejected."""
+        with self._lock:
+            if self.active < self.max_concurrency and not self._queued:
+                self.active += 1
+                return None
+            if self._queued >= self.max_queue:
+                raise Rejected(503, f"{self.name} queue is full", self.avg_service or 1.0)
+            wait = self._estimate(priority)
+            if time.monotonic() + wait > deadline:
+                raise Rejected(503, f"{self.name} is busy, estimated wait {wait:.1f}s exceeds the deadline", wait)
+            waiter = _Waiter(priority, next(self._seq), deadline, wake)
+            heapq.heappush(self._queue, waiter)
+            self._queued += 1
+            QUEUED.set(self._queued, backend=self.name)
+            return waiter
+
+    def _cancel(self, waiter) -> bool:
+        """Gives up waiting; returns True if a slot was granted in the meantime."""
+        with self._lock:
+            if waiter.granted:
+                return True
+            if not waiter.cancelled:
+                waiter.cancelled = True
+                self._queued -= 1
+                QUEUED.set(self._queued, backend=self.name)
+            return False
+
+    def _leave(self, service_time):
+        with self._lock:
+            self.active -= 1
+            if service_time is not None:
+                self.avg_service = service_time if self.avg_service is None else \
+                    0.8 * self.avg_service + 0.2 * service_time
+            # Hand the slot to the most urgent waiter still within its deadline
+            now = time.monotonic()
+            while self._queue and self.active < self.max_concurrency:
+                waiter = heapq.heappop(self._queue)
+                if waiter.cancelled:
+                    continue
+                self._queued -= 1
+                if waiter.deadline < now:
+                    waiter.cancelled = True
+                    waiter.wake()
+                    continue
+                waiter.granted = True
+                self.active += 1
+                waiter.wake()
+            QUEUED.set(self._queued, backend=self.name)
+
+    def _admitted(self, started):
+        ADMITTED.inc(backend=self.name)
+        QUEUE_WAIT.observe(time.monotonic() - started, backend=self.name)
+        IN_FLIGHT.inc(backend=self.name)
+
+    def _timed_out(self):
+        wait = self.avg_service or 1.0
+        return Rejected(503, f"{self.name} is busy, no slot before the deadline", wait)
+
+    @contextmanager
+    def hold(self, priority: int = DEFAULT_PRIORITY, deadline: float = None):
+        """Holds a backend slot; `deadline` is a time.monotonic() value."""
+        started = time.monotonic()
+        deadline = deadline or started + ADMISSION_DEADLINE_SECONDS
+        event = threading.Event()
+        waiter = self._enter(priority, deadline, event.set)
+        if waiter is not None:
+            event.wait(max(0.0, deadline - time.monotonic()))
+            if not waiter.granted and not self._cancel(waiter):
+                raise self._timed_out()
+        self._admitted(started)
+        service_started = time.monotonic()
+        failed = False
+        try:
+            yield
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            IN_FLIGHT.dec(backend=self.name)
+            # Failures are usually fast and would make the backend look quicker than it is
+            self._leave(None if failed else time.monotonic() - service_started)
+
+    @asynccontextmanager
+    async def hold_async(self, priority: int = DEFAULT_PRIORITY, deadline: float = None):
+        """hold() for coroutines; waiting does not block the event loop."""
+        started = time.monotonic()
+        deadline = deadline or started + ADMISSION_DEADLINE_SECONDS
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(None))
+
+        waiter = self._enter(priority, deadline, wake)
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(granted), max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                # The client went away while queued: pass on a slot granted meanwhile
+                if self._cancel(waiter):
+                    self._leave(None)
+                raise
+            if not waiter.granted and not self._cancel(waiter):
+                raise self._timed_out()
+        self._admitted(started)
+        service_started = time.monotonic()
+        failed = False
+        try:
+            yield
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            IN_FLIGHT.dec(backend=self.name)
+            self._leave(None if failed else time.monotonic() - service_started)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": self.name,
+                "active": self.active,
+                "queued": self._queued,
+                "max_concurrency": self.max_concurrency,
+                "avg_service_seconds": round(self.avg_service, 4) if self.avg_service is not None else None,
+            }
+
+
+# One gate per backend name, so every bot in a process shares a backend's limit
+_gates = {}
+_gates_lock = threading.Lock()
+
+
+def get_gate(backend: str) -> BackendGate:
+    with _gates_lock:
+        gate = _gates.get(backend)
+        if gate is None:
+            gate = _gates[backend] = BackendGate(backend)
+        return gate
+
+
+class AdmissionControl:
+    """
+    Admission in front of one model backend: the client's token bucket first
+    (429 when empty), then a slot from the backend's gate (503 when saturated
+    or the wait would exceed the request's deadline).
+
+        with admission.admit(client_id, cost=2):
+            ...call the model...
+    """
+
+    def __init__(self, backend: str, limiter: ClientLimiter = None, gate: BackendGate = None):
+        self.backend = backend
+        self.limiter = limiter or ClientLimiter()
+        self.gate = gate or get_gate(backend)
+
+    def _check_rate(self, client, cost):
+        retry_after = self.limiter.check(client, cost)
+        if retry_after:
+            REJECTED.inc(backend=self.backend, reason="rate_limit")
+            raise Rejected(429, "Rate limit exceeded", retry_after)
+
+    def _deadline(self, timeout):
+        timeout = ADMISSION_DEADLINE_SECONDS if timeout is None else min(timeout, ADMISSION_DEADLINE_SECONDS)
+        return time.monotonic() + max(0.0, timeout)
+
+    @contextmanager
+    def admit(self, client: str, priority: int = DEFAULT_PRIORITY, cost: float = 1.0, timeout: float = None):
+        self._check_rate(client, cost)
+        try:
+            with self.gate.hold(priority, self._deadline(timeout)):
+                yield
+        except Rejected as e:
+            REJECTED.inc(backend=self.backend, reason="saturated")
+            logging.debug(f"Rejected request from {client}: {e}")
+            raise
+
+    @asynccontextmanager
+    async def admit_async(self, client: str, priority: int = DEFAULT_PRIORITY, cost: float = 1.0,
+                          timeout: float = None, slot: bool = True):
+        """admit() for coroutines; with slot=False only the rate limit applies (no backend call of its own)."""
+        self._check_rate(client, cost)
+        if not slot:
+            yield
+            return
+        try:
+            async with self.gate.hold_async(priority, self._deadline(timeout)):
+                yield
+        except Rejected as e:
+            REJECTED.inc(backend=self.backend, reason="saturated")
+            logging.debug(f"Rejected request from {client}: {e}")
+            raise
+
+    def stats(self) -> dict:
+        return self.gate.stats()
+
+
+def _number(value, default, cast=float):
+    try:
+        return cast(value) if value not in (None, "") else default
+    except ValueError:
+        return default
+
+
+def _parse_networks(value):
+    networks = []
+    for item in value.split(","):
+        item = item.strip()
+        if item:
+            try:
+                networks.append(ipaddress.ip_network(item, strict=False))
+            except ValueError:
+                logging.error(f"Ignoring invalid TRUSTED_PROXIES entry: {item}")
+    return networks
+
+
+_trusted_networks = _parse_networks(TRUSTED_PROXIES)
+
+
+def is_trusted(remote_addr, networks=None) -> bool:
+    """Whether a peer address belongs to the trusted proxies."""
+    networks = _trusted_networks if networks is None else networks
+    try:
+        address = ipaddress.ip_address(remote_addr)
+    except ValueError:
+        return False
+    return any(address in network for network in networks)
+
+
+def request_terms(headers, remote_addr, trusted=None):
+    """
+    (client, priority, timeout) of an HTTP request. The client ID and priority
+    headers are only honoured from a trusted proxy; otherwise any caller could
+    dodge its rate limit by rotating IDs or jump the queue. A client may always
+    ask for a shorter deadline, as that only constrains its own request.
+    """
+    trusted = is_trusted(remote_addr) if trusted is None else trusted
+    client = remote_addr or "anonymous"
+    priority = DEFAULT_PRIORITY
+    if trusted:
+        client = headers.get(CLIENT_HEADER) or client
+        priority = min(9, max(0, _number(headers.get(PRIORITY_HEADER), DEFAULT_PRIORITY, int)))
+    timeout = _number(headers.get(DEADLINE_HEADER), None)
+    return client, priority, timeout
+
+
+def body_cost(content_length) -> float:
+    """Cost of a request in rate-limit tokens: one, plus one per ~1000 prompt tokens (4 KB)."""
+    return 1.0 + (content_length or 0) // 4000
+
+
+async def _buffer_body(receive):
+    """Reads the whole request body; returns it (None if the client left) and a receive() replaying it."""
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            return None, receive
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+    body = b"".join(chunks)
+    replayed = False
+
+    async def replay():
+        nonlocal replayed
+        if replayed:
+            return await receive()
+        replayed = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    return body, replay
+
+
+class _AdmissionMiddleware:
+    """
+    ASGI middleware holding the backend slot for the whole call of the app, so
+    it is released however the exchange ends: body fully streamed, client gone
+    before or during streaming, HEAD request or error.
+    """
+
+    def __init__(self, app, admission, paths, cost, follower):
+        self.app = app
+        self.admission = admission
+        self.paths = paths
+        self.cost = cost
+        self.follower = follower
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            return await self.app(scope, receive, send)
+        from starlette.requests import Request
+        from starlette.responses import JSONResponse
+
+        request = Request(scope)
+        client, priority, timeout = request_terms(request.headers, request.client.host if request.client else None)
+        if self.cost:
+            request_cost = self.cost(request)
+        else:
+            request_cost = body_cost(_number(request.headers.get("content-length"), 0, int))
+        slot = True
+        if self.follower is not None:
+            body, receive = await _buffer_body(receive)
+            if body is None:
+                return
+            slot = not self.follower(body)
+        held = self.admission.admit_async(client, priority, request_cost, timeout, slot=slot)
+        try:
+            await held.__aenter__()
+        except Rejected as e:
+            response = JSONResponse(e.body(), status_code=e.status, headers=e.headers())
+            return await response(scope, receive, send)
+        try:
+            await self.app(scope, receive, send)
+        except BaseException as e:
+            await held.__aexit__(type(e), e, e.__traceback__)
+            raise
+        await held.__aexit__(None, None, None)
+
+
+def add_fastapi_admission(app, admission: AdmissionControl, paths=("/chat",), cost=None, follower=None):
+    """
+    Puts `admission` in front of the given paths of a FastAPI app. A streamed
+    response keeps its backend slot until the last chunk is sent.
+    `cost(request)` overrides the default body-size based cost.
+    `follower(body)` tells from the raw request body whether the request will
+    only follow a model call already in flight (request coalescing); such
+    requests are rate limited but take no backend slot.
+    """
+    app.add_middleware(_AdmissionMiddleware, admission=admission, paths=paths, cost=cost, follower=follower)
+
+
+def flask_admission(admission: AdmissionControl, cost=None):
+    """Decorator putting `admission` in front of a Flask view; `cost(request)` as above."""
+    import functools
+
+    from flask import jsonify, request
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            client, priority, timeout = request_terms(request.headers, request.remote_addr)
+            request_cost = cost(request) if cost else body_cost(request.content_length)
+            try:
+                with admission.admit(client, priority, request_cost, timeout):
+                    return view(*args, **kwargs)
+            except Rejected as e:
+                return jsonify(e.body()), e.status, e.headers()
+        return wrapper
+
+    return decorator
@@ -0,0 +1,231 @@
+import asyncio
+import logging
+import os
+import random
+import time
+
+import httpx
+import openai
+from openai import AsyncOpenAI
+
+from common.admission import AdmissionControl, add_fastapi_admission
+from common.metrics import CONTENT_TYPE, counter, record_span, render
+from common.prompts import OPENAI_MODEL, UsageTracker
+from common.singleflight import AsyncSingleFlight, normalize_prompt
+
+# Requests in flight to OpenAI per process; the rest wait for a slot
+OPENAI_MAX_CONCURRENCY = int(os.getenv('OPENAI_MAX_CONCURRENCY', '16'))
+# Connections kept open to the API and reused between requests
+OPENAI_MAX_CONNECTIONS = int(os.getenv('OPENAI_MAX_CONNECTIONS', '32'))
+# Attempts after the first one for rate limited or failed requests
+OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', '4'))
+OPENAI_RETRY_BASE_DELAY = float(os.getenv('OPENAI_RETRY_BASE_DELAY', '0.5'))
+OPENAI_RETRY_MAX_DELAY = float(os.getenv('OPENAI_RETRY_MAX_DELAY', '20'))
+OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', '60'))
+
+# Address of the HTTP endpoint started with `python app.py serve`
+CHAT_HOST = os.getenv('CHAT_HOST', '127.0.0.1')
+CHAT_PORT = int(os.getenv('CHAT_PORT', '8000'))
+
+# Errors worth retrying: rate limits, timeouts, dropped connections and 5xx
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+RETRIES = counter("bot_openai_retries_total", "OpenAI requests retried after a rate limit or failure", ("error",))
+
+
+def create_async_client(api_key, max_connections: int = OPENAI_MAX_CONNECTIONS) -> AsyncOpenAI:
+    """
+    AsyncOpenAI client with a connection pool sized for concurrent chats.
+    Retries are left to AsyncChatService, which also knows when a stream has
+    already started and must not be repeated.
+    """
+    http_client = openai.DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=max_connections, max_keepalive_connections=max_connections
+        ),
+        timeout=OPENAI_TIMEOUT,
+    )
+    return AsyncOpenAI(api_key=api_key, http_client=http_client, max_retries=0)
+
+
+def _retry_delay(error, attempt):
+    """Seconds to wait before the next attempt, honouring Retry-After when the API sends it."""
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), OPENAI_RETRY_MAX_DELAY)
+        except ValueError:
+            pass
+    delay = min(OPENAI_RETRY_BASE_DELAY * 2 ** attempt, OPENAI_RETRY_MAX_DELAY)
+    return delay * random.uniform(0.5, 1.0)  # Jitter so waiting callers don't retry in lockstep
+
+
+class AsyncChatService:
+    """
+    Streams chat completions for many concurrent conversations from one event
+    loop. A semaphore caps the requests in flight, the client's connection pool
+    is shared by all of them, and rate limited or failed requests are retried
+    with exponential backoff as long as no token was streamed yet.
+
+    The semaphore belongs to the event loop that first uses the service, so
+    use one service per loop. `client` may also be a function returning the
+    client, called on first use, so the API key lookup can wait for a request.
+    """
+
+    def __init__(self, client, prompt_builder, model: str = OPENAI_MODEL, max_tokens: int = 150,
+                 usage: UsageTracker = None, max_concurrency: int = OPENAI_MAX_CONCURRENCY,
+                 max_retries: int = OPENAI_MAX_RETRIES):
+        self._client = client
+        self.prompt_builder = prompt_builder
+        self.model = model
+        self.max_tokens = max_tokens
+        self.usage = usage or UsageTracker()
+        self.max_retries = max_retries
+        self.retries = 0
+        self._slots = asyncio.Semaphore(max_concurrency)
+
+    @property
+    def client(self) -> AsyncOpenAI:
+        if not isinstance(self._client, AsyncOpenAI):
+            self._client = self._client()
+        return self._client
+
+    async def stream(self, prompt: str, history=()):
+        """Yields the text deltas of the answer to `prompt`, given the previous turns."""
+        messages = self.prompt_builder.build(prompt, history)
+        async with self._slots:
+            attempt = 0
+            while True:
+                started = False
+                call_started = time.perf_counter()
+                error = None
+                try:
+                    stream = await self.client.chat.completions.create(
+                        model=self.model,
+                        messages=messages,
+                        max_tokens=self.max_tokens,
+                        stream=True,
+                        stream_options={"include_usage": True},
+                    )
+                    async for chunk in stream:
+                        if chunk.usage:
+                            self.usage.record(chunk.model or self.model, chunk.usage)
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            started = True
+                            yield chunk.choices[0].delta.content
+                    return
+                except BaseException as e:
+                    # Also a caller that stops reading (GeneratorExit) or is cancelled
+                    error = e
+                    if not isinstance(e, RETRYABLE_ERRORS) or started or attempt >= self.max_retries:
+                        raise
+                finally:
+                    # Every attempt is recorded, labelled ok, error or cancelled
+                    record_span("llm_call", time.perf_counter() - call_started, f"openai/{self.model}", error)
+                delay = _retry_delay(error, attempt)
+                attempt += 1
+                self.retries += 1
+                RETRIES.inc(error=error.__class__.__name__)
+                logging.warning(f"OpenAI request failed ({error.__class__.__name__}), "
+                                f"retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def complete(self, prompt: str, history=()) -> str:
+        """The whole answer to `prompt` as one string."""
+        parts = [delta async for delta in self.stream(prompt, history)]
+        return "".join(parts).strip()
+
+
+async def print_stream(deltas, prefix: str = "Bot: ") -> str:
+    """Prints text deltas as they arrive and returns the full text."""
+    print(prefix, end="", flush=True)
+    parts = []
+    async for delta in deltas:
+        parts.append(delta)
+        print(delta, end="", flush=True)
+    print()
+    return "".join(parts).strip()
+
+
+async def read_input(prompt: str = "You: ") -> str:
+    """input() without blocking the event loop."""
+    return await asyncio.to_thread(input, prompt)
+
+
+def create_chat_app(respond, title: str = "Chat bot", admission=None, stateless: bool = False):
+    """
+    FastAPI app exposing a bot to concurrent users.
+
+    `respond(prompt, session_id)` must return an async iterator of text deltas.
+    POST /chat with {"prompt", "session_id", "stream"} streams plain text by
+    default, or returns {"response": ...} when stream is false. Requests go
+    through `admission` (per-client rate limit and OpenAI concurrency cap by
+    default) and are answered 429/503 when turned away.
+
+    Identical prompts in flight at the same time share one model call and its
+    token stream; the requests that only follow it take no backend slot. That
+    applies to requests without a session_id, or to all of them when the
+    answer does not depend on the session (`stateless`). GET /stats reports
+    how many were coalesced.
+    """
+    from typing import Optional
+
+    from fastapi import FastAPI
+    from fastapi.responses import PlainTextResponse, StreamingResponse
+    from pydantic import BaseModel
+
+    class ChatRequest(BaseModel):
+        prompt: str
+        session_id: Optional[str] = None
+        stream: bool = True
+
+    admission = admission or AdmissionControl("openai")
+    flight = AsyncSingleFlight(f"{title}-chat")
+
+    def shared(session_id) -> bool:
+        return stateless or session_id is None
+
+    # Checked before the handler runs: if the call in flight ends in between, the
+    # request makes the model call itself without a slot, which is rare and bounded
+    def follower(body: bytes) -> bool:
+        try:
+            request = ChatRequest.model_validate_json(body)
+        except ValueError:
+            return False
+        return shared(request.session_id) and flight.in_flight(normalize_prompt(request.prompt))
+
+    app = FastAPI(title=title)
+    add_fastapi_admission(app, admission, follower=follower)
+
+    @app.post("/chat")
+    async def chat(request: ChatRequest):
+        if shared(request.session_id):
+            deltas = flight.stream(normalize_prompt(request.prompt),
+                                   lambda: respond(request.prompt, request.session_id))
+        else:
+            deltas = respond(request.prompt, request.session_id)
+        if request.stream:
+            return StreamingResponse(deltas, media_type="text/plain; charset=utf-8")
+        try:
+            parts = [delta async for delta in deltas]
+        except Exception as e:
+            logging.error(f"Error getting response: {e}")
+            return {"error": f"Error getting response: {e}"}
+        return {"response": "".join(parts).strip()}
+
+    @app.get("/stats")
+    async def stats():
+        return {"coalescing": flight.stats.snapshot(), "admission": admission.stats()}
+
+    @app.get("/metrics")
+    async def metrics():
+        return PlainTextResponse(render(), media_type=CONTENT_TYPE)
+
+    return app
+
+
+def serve(app, host: str = CHAT_HOST, port: int = CHAT_PORT):
+    import uvicorn
+
+    uvicorn.run(app, host=host, port=port)
@@ -0,0 +1,178 @@
+import json
+import logging
+import os
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+import requests
+from requests.auth import HTTPBasicAuth
+
+from common.metrics import span
+
+# Spaces crawled for the knowledge base
+CONFLUENCE_SPACES = os.getenv('CONFLUENCE_SPACES', 'LEG,REV,HANDBOOK,RT,VM')
+# Results per page of the content search API
+CONFLUENCE_PAGE_SIZE = int(os.getenv('CONFLUENCE_PAGE_SIZE', '50'))
+# lastModified in CQL is evaluated in the user's timezone, so look back a little
+# further than the last sync; pages whose version did not change are skipped anyway
+SYNC_OVERLAP = timedelta(hours=int(os.getenv('CONFLUENCE_SYNC_OVERLAP_HOURS', '24')))
+
+
+@dataclass
+class ConfluencePage:
+    id: str
+    title: str
+    space: str
+    version: int
+    url: str
+    html: str = ""
+
+    def metadata(self) -> dict:
+        return {"title": self.title, "space": self.space, "version": self.version, "url": self.url}
+
+
+@dataclass
+class SyncResult:
+    """Pages added or changed since the last sync, and IDs of pages that disappeared."""
+    changed: Dict[str, ConfluencePage] = field(default_factory=dict)
+    removed: List[str] = field(default_factory=list)
+    full: bool = False
+    started_at: str = ""
+
+    def __bool__(self):
+        return bool(self.changed or self.removed)
+
+
+class ConfluenceCrawler:
+    """
+    Discovers the pages of the configured Confluence spaces through the paginated
+    content search API and tracks what was already indexed in a small JSON state
+    file, so later syncs only fetch pages modified since the previous one.
+
+    Call sync() to get the changes, feed them to the indexer, then commit() the
+    result so a failed indexing run is retried next time.
+    """
+
+    def __init__(self, base_url, username, api_token, spaces=CONFLUENCE_SPACES, state_path=None,
+                 page_size=CONFLUENCE_PAGE_SIZE):
+        self.base_url = base_url.rstrip("/")
+        self.spaces = [s.strip() for s in spaces.split(",") if s.strip()] if isinstance(spaces, str) else list(spaces)
+        self.state_path = state_path
+        self.page_size = page_size
+        self.session = requests.Session()
+        self.session.auth = HTTPBasicAuth(username, api_token)
+        self.state = self._load_state()
+
+    @classmethod
+    def from_env(cls, state_path=None):
+        return cls(
+            os.getenv('CONFLUENCE_BASE_URL', ''),
+            os.getenv('CONFLUENCE_USERNAME'),
+            os.getenv('CONFLUENCE_API_TOKEN'),
+            spaces=os.getenv('CONFLUENCE_SPACES', CONFLUENCE_SPACES),
+            state_path=state_path,
+        )
+
+    @property
+    def pages(self) -> Dict[str, dict]:
+        """Metadata (title, space, version, url) of every known page by ID."""
+        return self.state["pages"]
+
+    # --- state -------------------------------------------------------------
+
+    def _load_state(self):
+        if self.state_path and os.path.exists(self.state_path):
+            try:
+                with open(self.state_path) as f:
+                    return json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                logging.error(f"Could not read Confluence sync state {self.state_path}, starting over: {e}")
+        return {"last_sync": None, "spaces": self.spaces, "pages": {}}
+
+    def commit(self, result: SyncResult) -> None:
+        """Records a sync result as indexed."""
+        for page_id, page in result.changed.items():
+            self.state["pages"][page_id] = page.metadata()
+        for page_id in result.removed:
+            self.state["pages"].pop(page_id, None)
+        self.state["last_sync"] = result.started_at
+        self.state["spaces"] = self.spaces
+        if self.state_path:
+            directory = os.path.dirname(os.path.abspath(self.state_path))
+            os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.state_path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.state, f, indent=2)
+            os.replace(tmp_path, self.state_path)
+
+    # --- API ---------------------------------------------------------------
+
+    def search(self, cql: str, expand: str = None):
+        """Yields (result, links) for every result of a CQL content search, following pagination."""
+        params = {"cql": cql, "limit": self.page_size}
+        if expand:
+            params["expand"] = expand
+        url = f"{self.base_url}/rest/api/content/search"
+        while url:
+            with span("confluence_fetch", "search"):
+                response = self.session.get(url, params=params)
+                response.raise_for_status()
+            data = response.json()
+            links = data.get("_links", {})
+            for result in data.get("results", []):
+                yield result, links
+            next_link = links.get("next")
+            if not next_link:
+                break
+            # The next link already carries the query string (and cursor)
+            url = f"{links.get('base', self.base_url).rstrip('/')}{next_link}"
+            params = None
+
+    def _page_from_result(self, result, links) -> ConfluencePage:
+        base = links.get("base", self.base_url).rstrip("/")
+        webui = result.get("_links", {}).get("webui", "")
+        return ConfluencePage(
+            id=str(result["id"]),
+            title=result.get("title", ""),
+            space=result.get("space", {}).get("key", ""),
+            version=result.get("version", {}).get("number", 0),
+            url=f"{base}{webui}" if webui else f"{self.base_url}/pages/viewpage.action?pageId={result['id']}",
+            html=result.get("body", {}).get("view", {}).get("value", ""),
+        )
+
+    def _space_cql(self):
+        keys = ",".join(f'"{key}"' for key in self.spaces)
+        return f"type = page and space in ({keys})"
+
+    def sync(self, full: bool = False) -> SyncResult:
+        """
+        Returns the pages changed since the last committed sync (every page on the
+        first sync or when full=True) and the IDs of pages that no longer exist.
+        """
+        started_at = datetime.now(timezone.utc)
+        result = SyncResult(started_at=started_at.isoformat())
+        known = self.state["pages"]
+        last_sync = self.state.get("last_sync")
+        result.full = full or not last_sync or self.state.get("spaces") != self.spaces
+
+        cql = self._space_cql()
+        if not result.full:
+            since = datetime.fromisoformat(last_sync) - SYNC_OVERLAP
+            cql += f' and lastmodified >= "{since.strftime("%Y-%m-%d %H:%M")}"'
+
+        for item, links in self.search(cql, expand="body.view,version,space"):
+            page = self._page_from_result(item, links)
+            previous = known.get(page.id)
+            if result.full or previous is None or previous.get("version") != page.version:
+                result.changed[page.id] = page
+
+        # Deletions don't show up in lastModified queries, so compare the ID listing
+        current_ids = {str(item["id"]) for item, _ in self.search(self._space_cql())}
+        result.removed = [page_id for page_id in known if page_id not in current_ids]
+
+        logging.info(
+            f"Confluence sync ({'full' if result.full else 'incremental'}) of {', '.join(self.spaces)}: "
+            f"{len(result.changed)} changed, {len(result.removed)} removed."
+        )
+        return result
@@ -0,0 +1,25 @@
+import logging
+import subprocess
+
+# 1Password item holding the OpenAI API key shared by the bots
+OPENAI_KEY_REFERENCE = "op://Employee/test_openai_key/password"
+
+
+def get_openai_api_key(reference: str = OPENAI_KEY_REFERENCE):
+    """Reads the OpenAI API key with the 1Password CLI; returns None (or '') when it cannot."""
+    try:
+        logging.debug("Attempting to retrieve OpenAI API key from 1Password.")
+        result = subprocess.run(
+            ["op", "read", reference],
+            stdout=subprocess.PIPE,
+            text=True
+        )
+        api_key = result.stdout.strip()
+        if api_key:
+            logging.debug("Successfully retrieved OpenAI API key from 1Password.")
+        else:
+            logging.warning("OpenAI API key retrieved is empty.")
+        return api_key
+    except Exception as e:
+        logging.error(f"Error obtaining the API key from 1Password: {e}")
+        return None
@@ -0,0 +1,207 @@
+import hashlib
+import logging
+import os
+import re
+
+from bs4 import BeautifulSoup, NavigableString
+
+from common.metrics import counter, span
+
+# Walk the tree with lxml when it is installed, falling back to BeautifulSoup's pure-Python parser
+try:
+    import lxml.html
+    HTML_PARSER = 'lxml'
+except ImportError:
+    lxml = None
+    HTML_PARSER = 'html.parser'
+
+# Directory for extracted page text ('' disables the cache)
+EXTRACT_CACHE_DIR = os.getenv('EXTRACT_CACHE_DIR', './.cache/extracted')
+# Bump when the extraction output changes so cached text is regenerated
+EXTRACTOR_VERSION = 2
+
+# Elements that never carry page content
+NOISE_TAGS = ['script', 'style', 'noscript', 'nav', 'header', 'footer', 'button', 'svg', 'form']
+# Confluence macros and widgets that only add navigation or UI text
+NOISE_MACROS = ['toc', 'children', 'recently-updated', 'pagetree', 'jira', 'contentbylabel']
+NOISE_CLASSES = ['toc-macro', 'plugin_pagetree', 'expand-control-icon', 'aui-icon',
+                 'confluence-embedded-file-wrapper', 'hidden']
+NOISE_SELECTORS = ([f'[data-macro-name="{name}"]' for name in NOISE_MACROS]
+                   + [f'.{name}' for name in NOISE_CLASSES])
+NOISE_XPATH = " | ".join(
+    [f'//{tag}' for tag in NOISE_TAGS]
+    + [f'//*[@data-macro-name="{name}"]' for name in NOISE_MACROS]
+    + [f'//*[contains(concat(" ", normalize-space(@class), " "), " {name} ")]' for name in NOISE_CLASSES]
+)
+BLOCK_TAGS = {'p', 'div', 'section', 'article', 'blockquote', 'pre', 'ul', 'ol', 'dl', 'dt', 'dd', 'hr'}
+HEADING_TAGS = {'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+
+EXTRACT_CACHE = counter("bot_html_extract_cache_total", "Extraction cache lookups", ("result",))
+
+
+def _text(element):
+    return " ".join(element.get_text(" ").split())
+
+
+def extract_text(html_content: str) -> str:
+    """
+    Extracts the readable text of a Confluence page (body.view HTML), without
+    macros and navigation noise. Headings become '## Heading' lines, table rows
+    become '| cell | cell |' lines and list items '- item' lines, so each line
+    stays a meaningful chunk.
+    """
+    if not html_content or not html_content.strip():
+        return ""
+    with span("html_extract", HTML_PARSER):
+        if lxml is not None:
+            return _extract_lxml(html_content)
+        return _extract_soup(html_content)
+
+
+class _LineWriter:
+    """Collects inline text and emits it as normalised lines on block boundaries."""
+
+    def __init__(self):
+        self.lines = []
+        self._buffer = []
+
+    def write(self, text):
+        if text:
+            self._buffer.append(text)
+
+    def line(self, text):
+        self.flush()
+        self.write(text)
+        self.flush()
+
+    def flush(self):
+        line = " ".join("".join(self._buffer).split())
+        self._buffer = []
+        if line and line != "-":
+            self.lines.append(line)
+
+
+def _lxml_text(element):
+    return " ".join(element.text_content().split())
+
+
+def _walk_lxml(element, out):
+    tag = element.tag if isinstance(element.tag, str) else None  # Comments have no string tag
+    if tag in HEADING_TAGS:
+        out.line(f"{'#' * int(tag[1])} {_lxml_text(element)}")
+    elif tag == 'table':
+        out.flush()
+        for row in element.xpath('./tr | ./thead/tr | ./tbody/tr | ./tfoot/tr'):
+            cells = [_lxml_text(cell) for cell in row.xpath('./th | ./td')]
+            if any(cells):
+                out.line("| " + " | ".join(cells) + " |")
+    elif tag == 'br':
+        out.flush()
+    elif tag is not None:
+        block = tag in BLOCK_TAGS or tag == 'li'
+        if block:
+            out.flush()
+        if tag == 'li':
+            out.write("- ")
+        out.write(element.text)
+        for child in element:
+            _walk_lxml(child, out)
+        if block:
+            out.flush()
+    out.write(element.tail)
+
+
+def _extract_lxml(html_content):
+    # Under a synthetic parent, so a lone top-level element (a table, a heading,
+    # a macro) goes through the same dispatch as its siblings would
+    root = lxml.html.fragment_fromstring(html_content, create_parent='div')
+    for element in root.xpath(NOISE_XPATH):
+        element.drop_tree()
+    out = _LineWriter()
+    out.write(root.text)
+    for child in root:
+        _walk_lxml(child, out)
+    out.flush()
+    return "\n".join(out.lines)
+
+
+def _extract_soup(html_content):
+    soup = BeautifulSoup(html_content, HTML_PARSER)
+
+    for element in soup(NOISE_TAGS):
+        element.decompose()
+    for element in soup.select(", ".join(NOISE_SELECTORS)):
+        if not element.decomposed:
+            element.decompose()
+
+    # Nested tables are flattened into the text of their cell
+    for table in [t for t in soup.find_all('table') if t.find_parent('table') is None]:
+        rows = []
+        for row in table.select(':scope > tr, :scope > thead > tr, :scope > tbody > tr, :scope > tfoot > tr'):
+            cells = [_text(cell) for cell in row.find_all(['th', 'td'], recursive=False)]
+            if any(cells):
+                rows.append("| " + " | ".join(cells) + " |")
+        table.replace_with(NavigableString("\n" + "\n".join(rows) + "\n"))
+
+    for heading in soup.find_all(re.compile(r'^h[1-6]$')):
+        level = int(heading.name[1])
+        heading.replace_with(NavigableString(f"\n{'#' * level} {_text(heading)}\n"))
+
+    for item in soup.find_all('li'):
+        item.insert(0, NavigableString("\n- "))
+        item.append(NavigableString("\n"))
+
+    for br in soup.find_all('br'):
+        br.replace_with(NavigableString("\n"))
+
+    for block in soup.find_all(BLOCK_TAGS):
+        block.insert(0, NavigableString("\n"))
+        block.append(NavigableString("\n"))
+
+    lines = []
+    for line in soup.get_text().split("\n"):
+        line = " ".join(line.split())
+        if line and line != "-":
+            lines.append(line)
+    return "\n".join(lines)
+
+
+def _cache_path(html_content, page_id, version):
+    if page_id is not None and version is not None:
+        key = f"{page_id}-v{version}"
+    else:
+        key = hashlib.sha1(html_content.encode("utf-8")).hexdigest()
+    return os.path.join(EXTRACT_CACHE_DIR, f"x{EXTRACTOR_VERSION}-{key}.txt")
+
+
+def extract_page_text(html_content: str, page_id=None, version=None) -> str:
+    """
+    Cached extract_text. Pages are keyed by page ID and Confluence version
+    number when known (falling back to a hash of the HTML), so a page is only
+    parsed again after it changes.
+    """
+    if not EXTRACT_CACHE_DIR:
+        return extract_text(html_content)
+
+    path = _cache_path(html_content, page_id, version)
+    try:
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        EXTRACT_CACHE.inc(result="hit")
+        return text
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logging.warning(f"Could not read extraction cache {path}: {e}")
+
+    EXTRACT_CACHE.inc(result="miss")
+    text = extract_text(html_content)
+    try:
+        os.makedirs(EXTRACT_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logging.warning(f"Could not write extraction cache {path}: {e}")
+    return text
@@ -0,0 +1,292 @@
+import contextvars
+import functools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Port of the standalone /metrics server started by start_metrics_server() ('' disables it)
+METRICS_PORT = os.getenv('METRICS_PORT', '')
+# Share of finished spans written to the log as one JSON line each
+SPAN_LOG_SAMPLE_RATE = float(os.getenv('SPAN_LOG_SAMPLE_RATE', '0.01'))
+
+# Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; covers cache hits (sub-millisecond) up to long model generations
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _label_text(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_label_text(self.labels, key)} {value}" for key, value in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += 1
+            entry[2] += value
+
+    def snapshot(self, **labels):
+        """Count and sum of the observations with these labels."""
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            return {"count": entry[1], "sum": entry[2]} if entry else {"count": 0, "sum": 0.0}
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            items = sorted((key, (list(e[0]), e[1], e[2])) for key, e in self._values.items())
+        for key, (counts, count, total) in items:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                labels = _label_text(self.labels + ("le",), key + (repr(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_bucket{_label_text(self.labels + ('le',), key + ('+Inf',))} {count}")
+            lines.append(f"{self.name}_count{_label_text(self.labels, key)} {count}")
+            lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {total}")
+        return lines
+
+
+class Registry:
+    """Metrics of the process, created on first use and rendered for Prometheus."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _get(self, cls, name, help_text, labels, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help_text, labels, **kwargs)
+            return metric
+
+    def counter(self, name, help_text, labels=()) -> Counter:
+        return self._get(Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text, labels=()) -> Gauge:
+        return self._get(Gauge, name, help_text, labels)
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help_text, labels, buckets=buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+render = REGISTRY.render
+
+SPAN_SECONDS = histogram("bot_span_seconds", "Duration of instrumented operations", ("span", "detail", "outcome"))
+SPAN_ERRORS = counter("bot_span_errors_total", "Instrumented operations that raised", ("span", "detail"))
+
+# Name of the span the current code runs in, so nested spans know their parent
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+def _span_outcome(error: BaseException = None) -> str:
+    if error is None:
+        return "ok"
+    return "error" if isinstance(error, Exception) else "cancelled"
+
+
+def record_span(name: str, duration: float, detail: str = "", error: BaseException = None, parent=None, **fields):
+    """
+    Records a finished operation of `duration` seconds, for code that cannot wrap
+    it in span(), e.g. a generator that yields tokens while the call runs.
+    Its outcome is 'ok', 'error', or 'cancelled' when it was stopped by a
+    BaseException such as CancelledError or GeneratorExit (not counted as an error).
+    """
+    outcome = _span_outcome(error)
+    SPAN_SECONDS.observe(duration, span=name, detail=detail, outcome=outcome)
+    if outcome == "error":
+        SPAN_ERRORS.inc(span=name, detail=detail)
+    if SPAN_LOG_SAMPLE_RATE and random.random() < SPAN_LOG_SAMPLE_RATE:
+        record = {"span": name, "detail": detail, "parent": parent, "ms": round(duration * 1000, 2),
+                  "outcome": outcome, **fields}
+        if error is not None:
+            record["error"] = error.__class__.__name__
+        logging.info(json.dumps(record, default=str))
+
+
+@contextmanager
+def span(name: str, detail: str = "", **fields):
+    """
+    Times a block as `name` (e.g. 'llm_call', with detail 'ollama/llama3.1:latest')
+    into the bot_span_seconds histogram. Exceptions are counted and re-raised.
+    A sample of spans is logged as JSON with their parent span and any extra
+    fields, e.g. {"span": "vector_search", "parent": "answer", "ms": 12.5}.
+    Don't yield from a generator inside a span; use record_span() there.
+    """
+    parent = _current_span.get()
+    token = _current_span.set(name)
+    started = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        _current_span.reset(token)
+        record_span(name, time.perf_counter() - started, detail, error, parent, **fields)
+
+
+def timed(name: str, detail: str = ""):
+    """Decorator form of span()."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name, detail):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class LogAggregator:
+    """
+    Replaces one log line per item with one summary line per `every` items (and
+    a final one on flush), e.g. 'Stored vectors: 250 pages, 9812 chunks'.
+    """
+
+    def __init__(self, message: str, every: int = 100, level=logging.INFO):
+        self.message = message
+        self.every = every
+        self.level = level
+        self._lock = threading.Lock()
+        self._items = 0
+        self._totals = {}
+
+    def add(self, **amounts):
+        with self._lock:
+            self._items += 1
+            for name, amount in amounts.items():
+                self._totals[name] = self._totals.get(name, 0) + amount
+            due = self._items % self.every == 0
+        if due:
+            self._log()
+
+    def _log(self):
+        with self._lock:
+            items, totals = self._items, dict(self._totals)
+        details = ", ".join(f"{amount} {name}" for name, amount in totals.items())
+        logging.log(self.level, f"{self.message}: {items} items" + (f", {details}" if details else ""))
+
+    def flush(self):
+        """Logs the totals so far (if any) and starts over."""
+        if self._items % self.every:
+            self._log()
+        with self._lock:
+            self._items = 0
+            self._totals = {}
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port=None, host: str = "0.0.0.0"):
+    """
+    Serves /metrics from a daemon thread, for the terminal bots that have no
+    web server of their own. Does nothing unless a port is given or METRICS_PORT is set.
+    """
+    port = port or os.getenv('METRICS_PORT', METRICS_PORT)
+    if not port:
+        return None
+    server = ThreadingHTTPServer((host, int(port)), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logging.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,139 @@
+import hashlib
+import logging
+import os
+import threading
+
+from common.metrics import counter
+
+# Model used by the OpenAI chat bots
+OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-4')
+
+# USD per million tokens: (input, cached input, output). Models without prompt
+# caching bill cached tokens at the input price.
+MODEL_PRICES = {
+    'gpt-4': (30.00, 30.00, 60.00),
+    'gpt-4-turbo': (10.00, 10.00, 30.00),
+    'gpt-4o': (2.50, 1.25, 10.00),
+    'gpt-4o-mini': (0.15, 0.075, 0.60),
+    'gpt-4.1': (2.00, 0.50, 8.00),
+    'gpt-4.1-mini': (0.40, 0.10, 1.60),
+}
+
+
+TOKENS = counter("bot_openai_tokens_total", "Tokens billed by OpenAI", ("model", "kind"))
+COST = counter("bot_openai_cost_usd_total", "Estimated OpenAI spend in USD", ("model",))
+
+
+class PromptBuilder:
+    """
+    Assembles chat messages so every request starts with the same bytes: the
+    static system prompt (persona and instructions) first, then the conversation
+    history in order, then the new user message. OpenAI caches the longest
+    prompt prefix it has seen recently (from 1024 tokens on, in 128 token steps),
+    so anything that changes per request must go after the static part.
+    """
+
+    def __init__(self, system_prompt: str):
+        # Normalise indentation and trailing spaces once, so the prefix never varies
+        self.system_prompt = "\n".join(line.strip() for line in system_prompt.strip().splitlines())
+        self.prefix_id = hashlib.sha1(self.system_prompt.encode("utf-8")).hexdigest()[:12]
+
+    def system_message(self) -> dict:
+        return {"role": "system", "content": self.system_prompt}
+
+    def build(self, prompt: str, history=()) -> list:
+        """Messages for a request: static prefix, previous turns, new prompt."""
+        return [self.system_message(), *history, {"role": "user", "content": prompt}]
+
+
+def _field(obj, name, default=0):
+    """Reads a usage field from an SDK object or a plain dict."""
+    if obj is None:
+        return default
+    if isinstance(obj, dict):
+        value = obj.get(name, default)
+    else:
+        value = getattr(obj, name, default)
+    return default if value is None else value
+
+
+def request_cost(model: str, prompt_tokens: int, cached_tokens: int, completion_tokens: int):
+    """USD cost of one request, or None for models missing from MODEL_PRICES."""
+    prices = MODEL_PRICES.get(model)
+    if prices is None:
+        # Dated snapshots such as gpt-4o-2024-08-06 are billed like their base model
+        base = max((name for name in MODEL_PRICES if model.startswith(f"{name}-")), key=len, default=None)
+        prices = MODEL_PRICES.get(base)
+    if prices is None:
+        return None
+    input_price, cached_price, output_price = prices
+    return ((prompt_tokens - cached_tokens) * input_price
+            + cached_tokens * cached_price
+            + completion_tokens * output_price) / 1_000_000
+
+
+class UsageTracker:
+    """
+    Thread-safe running totals of the `usage` reported by the OpenAI API (chat
+    completions or assistant runs): prompt, cached and completion tokens, cost,
+    and the share of prompt tokens served from the prompt cache.
+    """
+
+    def __init__(self, name: str = "openai"):
+        self.name = name
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+
+    def record(self, model: str, usage) -> dict:
+        """Adds the usage of one request and returns its per-request figures."""
+        prompt_tokens = _field(usage, "prompt_tokens")
+        completion_tokens = _field(usage, "completion_tokens")
+        cached_tokens = _field(_field(usage, "prompt_tokens_details", None), "cached_tokens")
+        cost = request_cost(model, prompt_tokens, cached_tokens, completion_tokens)
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += prompt_tokens
+            self.cached_tokens += cached_tokens
+            self.completion_tokens += completion_tokens
+            self.cost += cost or 0.0
+        TOKENS.inc(prompt_tokens - cached_tokens, model=model, kind="prompt")
+        TOKENS.inc(cached_tokens, model=model, kind="cached")
+        TOKENS.inc(completion_tokens, model=model, kind="completion")
+        if cost:
+            COST.inc(cost, model=model)
+        entry = {
+            "model": model,
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached_tokens,
+            "completion_tokens": completion_tokens,
+            "cost": cost,
+        }
+        cost_text = f"${cost:.5f}" if cost is not None else "unknown cost"
+        logging.debug(f"{self.name} usage: {prompt_tokens} prompt ({cached_tokens} cached) + "
+                     f"{completion_tokens} completion tokens, {cost_text}")
+        return entry
+
+    @property
+    def cache_hit_rate(self) -> float:
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_tokens": self.cached_tokens,
+                "completion_tokens": self.completion_tokens,
+                "cache_hit_rate": round(self.cache_hit_rate, 4),
+                "cost": round(self.cost, 6),
+            }
+
+    def log_summary(self):
+        s = self.summary()
+        logging.info(f"{self.name} totals: {s['requests']} requests, {s['prompt_tokens']} prompt tokens "
+                     f"({s['cache_hit_rate']:.0%} cached), {s['completion_tokens']} completion tokens, "
+                     f"${s['cost']:.4f}")
@@ -0,0 +1,447 @@
+import http.client
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from urllib.parse import urlsplit
+
+from common.credentials import get_openai_api_key
+from common.metrics import record_span
+from common.prompts import MODEL_PRICES
+
+# How a backend is picked: 'ordered' (as listed, e.g. local first then remote),
+# 'cheapest' or 'fastest' (lowest recent latency)
+ROUTING_POLICY = os.getenv('ROUTING_POLICY', 'ordered')
+# Start the next backend in parallel when the first has not answered after this many seconds (0 disables)
+HEDGE_AFTER_SECONDS = float(os.getenv('HEDGE_AFTER_SECONDS', '0'))
+# Give up on a backend call after this many seconds
+BACKEND_TIMEOUT = float(os.getenv('BACKEND_TIMEOUT', '120'))
+# Backends slower than this on average are only used when the others fail (0 disables)
+SLOW_BACKEND_SECONDS = float(os.getenv('SLOW_BACKEND_SECONDS', '0'))
+# Consecutive failures that take a backend out of rotation, and for how long
+CIRCUIT_FAILURES = int(os.getenv('CIRCUIT_FAILURES', '3'))
+CIRCUIT_COOLDOWN_SECONDS = float(os.getenv('CIRCUIT_COOLDOWN_SECONDS', '30'))
+# Weight of the newest sample in the latency average
+LATENCY_EWMA_ALPHA = 0.3
+
+OLLAMA_URL = 'http://localhost:11434/api/generate'
+
+
+class RouterError(Exception):
+    """No backend could answer."""
+
+
+class _Cancelled(Exception):
+    """The call lost a hedged race and was abandoned."""
+
+
+def _shutdown(sock):
+    # Unlike close(), shutdown() wakes up a thread blocked reading the socket
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class CancelToken:
+    """
+    Set when a call is abandoned (lost a hedged race, router closed). Backends
+    register closers for their open connections, so a call stalled on a read
+    returns as soon as the token is set instead of holding its pool thread
+    until the timeout.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._set = False
+        self._closers = []
+
+    def is_set(self) -> bool:
+        return self._set
+
+    def add(self, closer):
+        """Runs closer() on cancellation, or right away if already cancelled."""
+        with self._lock:
+            if not self._set:
+                self._closers.append(closer)
+                return
+        closer()
+
+    def set(self):
+        with self._lock:
+            if self._set:
+                return
+            self._set = True
+            closers, self._closers = self._closers, []
+        for closer in closers:
+            try:
+                closer()
+            except Exception as e:
+                logging.debug(f"Closing a cancelled call failed: {e}")
+
+
+class BackendHealth:
+    """Live latency average and circuit breaker state of one backend."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = None
+        self.calls = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+
+    def record_success(self, latency):
+        with self._lock:
+            self.calls += 1
+            self.consecutive_failures = 0
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency = LATENCY_EWMA_ALPHA * latency + (1 - LATENCY_EWMA_ALPHA) * self.latency
+
+    def record_failure(self):
+        with self._lock:
+            self.calls += 1
+            self.failures += 1
+            self.consecutive_failures += 1
+            # After the cooldown one more failure is enough to open the circuit again
+            if self.consecutive_failures >= CIRCUIT_FAILURES:
+                self.open_until = time.monotonic() + CIRCUIT_COOLDOWN_SECONDS
+
+    @property
+    def available(self) -> bool:
+        return time.monotonic() >= self.open_until
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "latency": round(self.latency, 4) if self.latency is not None else None,
+                "calls": self.calls,
+                "failures": self.failures,
+                "circuit_open": not self.available,
+            }
+
+
+class Backend:
+    """A model behind a chat interface: complete(messages) returns the answer text."""
+
+    kind = "backend"
+
+    def __init__(self, model, cost=0.0, tasks=("chat",)):
+        self.model = model
+        self.cost = cost
+        self.tasks = set(tasks)
+        self.health = BackendHealth()
+
+    @property
+    def name(self) -> str:
+        return f"{self.kind}/{self.model}"
+
+    def complete(self, messages, cancel: CancelToken, timeout=BACKEND_TIMEOUT, max_tokens=None) -> str:
+        raise NotImplementedError
+
+
+class OllamaBackend(Backend):
+    """
+    Ollama model, streamed so a hedged call can be abandoned early. The URL
+    decides the API: /api/chat takes the messages as they are, /api/generate
+    gets them flattened into a single prompt ending with `assistant_label`.
+    """
+
+    kind = "ollama"
+
+    def __init__(self, model, url=OLLAMA_URL, cost=0.0, tasks=("chat",), assistant_label="Assistant"):
+        super().__init__(model, cost, tasks)
+        self.url = url
+        self.chat_api = url.rstrip("/").endswith("/api/chat")
+        self.assistant_label = assistant_label
+
+    @staticmethod
+    def flatten(messages, assistant_label="Assistant") -> str:
+        # A lone user message is sent as is, like the bots always did
+        if len(messages) == 1 and messages[0]["role"] == "user":
+            return messages[0]["content"]
+        lines = []
+        for message in messages:
+            if message["role"] == "system":
+                lines.append(message["content"].strip())
+            elif message["role"] == "assistant":
+                lines.append(f"{assistant_label}: {message['content']}")
+            else:
+                lines.append(f"{message['role'].capitalize()}: {message['content']}")
+        lines.append(f"{assistant_label}:")
+        return "\n".join(lines)
+
+    def complete(self, messages, cancel, timeout=BACKEND_TIMEOUT, max_tokens=None):
+        payload = {"model": self.model}
+        if self.chat_api:
+            payload["messages"] = messages
+        else:
+            payload["prompt"] = self.flatten(messages, self.assistant_label)
+        if max_tokens:
+            payload["options"] = {"num_predict": max_tokens}
+
+        # A plain connection rather than requests, so a cancelled call can shut
+        # its socket down while waiting for the headers or the next line
+        url = urlsplit(self.url)
+        connection_class = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+        connection = connection_class(url.hostname, url.port, timeout=timeout)
+        parts = []
+        try:
+            connection.connect()
+            cancel.add(lambda: _shutdown(connection.sock))
+            path = (url.path or "/") + (f"?{url.query}" if url.query else "")
+            connection.request("POST", path, body=json.dumps(payload),
+                               headers={"Content-Type": "application/json"})
+            response = connection.getresponse()
+            if response.status != 200:
+                raise RouterError(f"Error: Received status code {response.status}")
+            for line in iter(response.readline, b""):
+                if cancel.is_set():
+                    raise _Cancelled()
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    part = json.loads(line)
+                except json.JSONDecodeError as e:
+                    logging.error(f"Failed to decode part: {line}, Error: {e}")
+                    continue
+                if self.chat_api:
+                    parts.append(part.get("message", {}).get("content", ""))
+                else:
+                    parts.append(part.get("response", ""))
+                if part.get("done", False):
+                    break
+        except (OSError, http.client.HTTPException):
+            if cancel.is_set():
+                raise _Cancelled()
+            raise
+        finally:
+            connection.close()
+        if cancel.is_set():
+            raise _Cancelled()
+        return "".join(parts).strip()
+
+
+def _openai_api_key():
+    # Same 1Password item as the OpenAI bots, unless the key is in the environment
+    return os.getenv('OPENAI_API_KEY') or get_openai_api_key()
+
+
+class OpenAIBackend(Backend):
+    """OpenAI chat model; the client (and the API key lookup) is created on first use."""
+
+    kind = "openai"
+
+    def __init__(self, model, cost=None, tasks=("chat",)):
+        if cost is None:
+            # Rank by output token price, which dominates chat costs
+            cost = MODEL_PRICES.get(model, (0.0, 0.0, float("inf")))[2]
+        super().__init__(model, cost, tasks)
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._client_lock:
+            if self._client is None:
+                from openai import OpenAI
+                self._client = OpenAI(api_key=_openai_api_key(), max_retries=0)
+            return self._client
+
+    def complete(self, messages, cancel, timeout=BACKEND_TIMEOUT, max_tokens=None):
+        kwargs = {"max_tokens": max_tokens} if max_tokens else {}
+        # The SDK only hands over the connection once the headers are in, which
+        # the API sends as soon as the stream starts
+        stream = self.client.chat.completions.create(
+            model=self.model, messages=messages, stream=True, timeout=timeout, **kwargs
+        )
+        network_stream = stream.response.extensions.get("network_stream")
+        if network_stream is not None:
+            cancel.add(lambda: _shutdown(network_stream.get_extra_info("socket")))
+        parts = []
+        try:
+            for chunk in stream:
+                if cancel.is_set():
+                    raise _Cancelled()
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+        finally:
+            stream.close()
+        return "".join(parts).strip()
+
+
+def parse_backend(spec: str, ollama_url: str = OLLAMA_URL, assistant_label: str = "Assistant") -> Backend:
+    """
+    Builds a backend from 'ollama/<model>[@url]' or 'openai/<model>'.
+    Vision models (llama3.2-vision, gpt-4o) also serve the 'vision' task.
+    `assistant_label` names the assistant's turns in flattened Ollama prompts.
+    """
+    kind, _, model = spec.strip().partition("/")
+    model, _, url = model.partition("@")
+    vision = "vision" in model or model.startswith("gpt-4o")
+    tasks = ("chat", "vision") if vision else ("chat",)
+    if kind == "ollama":
+        return OllamaBackend(model, url=url or ollama_url, tasks=tasks, assistant_label=assistant_label)
+    if kind == "openai":
+        return OpenAIBackend(model, tasks=tasks)
+    raise ValueError(f"Unknown backend '{spec}', expected ollama/<model> or openai/<model>")
+
+
+@dataclass
+class RouteResult:
+    text: str
+    backend: str
+    latency: float
+    hedged: bool = False
+
+
+class ModelRouter:
+    """
+    Common chat interface over several backends. Each call goes to the best
+    available backend for its task according to the policy; if it fails the
+    next one is tried, and if it is still running after `hedge_after` seconds
+    the next one is started in parallel and the first answer wins. Backends
+    that keep failing are skipped for a cooldown period.
+    """
+
+    POLICIES = ("ordered", "cheapest", "fastest")
+
+    def __init__(self, backends, policy=ROUTING_POLICY, hedge_after=HEDGE_AFTER_SECONDS,
+                 timeout=BACKEND_TIMEOUT, slow_after=SLOW_BACKEND_SECONDS, max_workers=32):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown routing policy '{policy}', expected one of {', '.join(self.POLICIES)}")
+        self.backends = list(backends)
+        self.policy = policy
+        self.hedge_after = hedge_after
+        self.timeout = timeout
+        self.slow_after = slow_after
+        self.hedges = 0
+        self.failovers = 0
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="model-router")
+        # Tokens of the calls in flight, cancelled by close()
+        self._calls = set()
+        self._calls_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, default: str, ollama_url: str = OLLAMA_URL, assistant_label: str = "Assistant"):
+        """
+        Router over the backends listed in MODEL_BACKENDS (comma-separated, e.g.
+        'ollama/llama3.1:latest,openai/gpt-4o-mini'), or `default` when unset.
+        """
+        specs = os.getenv('MODEL_BACKENDS') or default
+        backends = [parse_backend(spec, ollama_url, assistant_label) for spec in specs.split(",") if spec.strip()]
+        return cls(
+            backends,
+            policy=os.getenv('ROUTING_POLICY', ROUTING_POLICY),
+            hedge_after=float(os.getenv('HEDGE_AFTER_SECONDS', HEDGE_AFTER_SECONDS)),
+        )
+
+    def candidates(self, task="chat"):
+        """Backends able to serve `task`, best first; slow ones go last and open circuits are left out."""
+        backends = [b for b in self.backends if task in b.tasks and b.health.available]
+        if self.policy == "cheapest":
+            backends.sort(key=lambda b: b.cost)
+        elif self.policy == "fastest":
+            # Backends without samples yet are tried first so they get measured
+            backends.sort(key=lambda b: b.health.latency or 0.0)
+        if self.slow_after:
+            backends.sort(key=lambda b: (b.health.latency or 0.0) > self.slow_after)
+        return backends
+
+    def _call(self, backend, messages, cancel, max_tokens):
+        started = time.monotonic()
+        try:
+            text = backend.complete(messages, cancel, timeout=self.timeout, max_tokens=max_tokens)
+        except _Cancelled:
+            # Lost a hedged race: neither a failure nor a latency sample
+            raise
+        except Exception as e:
+            if not cancel.is_set():
+                backend.health.record_failure()
+                record_span("llm_call", time.monotonic() - started, backend.name, e)
+            raise
+        latency = time.monotonic() - started
+        backend.health.record_success(latency)
+        record_span("llm_call", latency, backend.name)
+        return text
+
+    def chat(self, messages, task="chat", max_tokens=None) -> RouteResult:
+        """Answers a list of {'role', 'content'} messages; raises RouterError when every backend fails."""
+        queue = self.candidates(task)
+        if not queue:
+            raise RouterError(f"No backend available for task '{task}'")
+        started = time.monotonic()
+        cancel = CancelToken()
+        with self._calls_lock:
+            self._calls.add(cancel)
+        pending = {}
+        errors = []
+        hedged = False
+
+        def launch():
+            backend = queue.pop(0)
+            pending[self._pool.submit(self._call, backend, messages, cancel, max_tokens)] = backend
+
+        launch()
+        try:
+            while pending:
+                timeout = None
+                if self.hedge_after and queue and not hedged:
+                    timeout = max(0.0, self.hedge_after - (time.monotonic() - started))
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    # The first backend is slow: race it against the next one
+                    hedged = True
+                    self.hedges += 1
+                    logging.info(f"Hedging {pending[next(iter(pending))].name} after {self.hedge_after}s "
+                                 f"with {queue[0].name}")
+                    launch()
+                    continue
+                for future in done:
+                    backend = pending.pop(future)
+                    try:
+                        text = future.result()
+                    except Exception as e:
+                        logging.warning(f"Backend {backend.name} failed: {e}")
+                        errors.append(f"{backend.name}: {e}")
+                        continue
+                    return RouteResult(text, backend.name, time.monotonic() - started, hedged)
+                if not pending and queue:
+                    self.failovers += 1
+                    launch()
+        finally:
+            # Stop the losing call of a hedged race, even if it is stuck reading
+            cancel.set()
+            with self._calls_lock:
+                self._calls.discard(cancel)
+        raise RouterError("All backends failed: " + "; ".join(errors))
+
+    def close(self):
+        """Abandons the calls in flight and stops the worker threads."""
+        with self._calls_lock:
+            calls = list(self._calls)
+        for cancel in calls:
+            cancel.set()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def stats(self) -> dict:
+        return {
+            "policy": self.policy,
+            "hedges": self.hedges,
+            "failovers": self.failovers,
+            "backends": {b.name: b.health.snapshot() for b in self.backends},
+        }
@@ -0,0 +1,240 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from typing import List
+
+# 'memory' or 'sqlite' (persisted in SESSION_DB_PATH)
+SESSION_STORE = os.getenv('SESSION_STORE', 'memory')
+SESSION_DB_PATH = os.getenv('SESSION_DB_PATH', './sessions.sqlite')
+# Conversations idle for longer than this are forgotten
+SESSION_TTL_SECONDS = float(os.getenv('SESSION_TTL_SECONDS', '3600'))
+# Conversations kept in memory before the least recently used one is evicted
+SESSION_MAX_SESSIONS = int(os.getenv('SESSION_MAX_SESSIONS', '10000'))
+# Messages kept per conversation (user and assistant turns, oldest dropped first)
+SESSION_MAX_MESSAGES = int(os.getenv('SESSION_MAX_MESSAGES', '20'))
+
+
+def compact(history: List[dict], max_messages: int = SESSION_MAX_MESSAGES) -> List[dict]:
+    """Keeps the last max_messages messages as plain {'role', 'content'} dicts, starting with a user turn."""
+    messages = [{"role": m["role"], "content": m["content"].strip()} for m in history if m["role"] != "system"]
+    messages = messages[-max_messages:] if max_messages else messages
+    while messages and messages[0]["role"] != "user":
+        messages.pop(0)
+    return messages
+
+
+class SessionLocks:
+    """
+    One lock per session ID, so the turns of a conversation run one at a time
+    while different conversations run in parallel. A lock is dropped as soon
+    as nobody holds or waits for it.
+    """
+
+    def __init__(self):
+        self._guard = threading.Lock()
+        self._locks = {}
+
+    def _enter(self, session_id, factory):
+        with self._guard:
+            entry = self._locks.get(session_id)
+            if entry is None:
+                entry = self._locks[session_id] = [factory(), 0]
+            entry[1] += 1
+            return entry[0]
+
+    def _leave(self, session_id):
+        with self._guard:
+            entry = self._locks[session_id]
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[session_id]
+
+    @contextmanager
+    def hold(self, session_id):
+        lock = self._enter(session_id, threading.Lock)
+        try:
+            with lock:
+                yield
+        finally:
+            self._leave(session_id)
+
+    @asynccontextmanager
+    async def hold_async(self, session_id):
+        """hold() for coroutines of a single event loop."""
+        import asyncio
+
+        lock = self._enter(session_id, asyncio.Lock)
+        try:
+            async with lock:
+                yield
+        finally:
+            self._leave(session_id)
+
+    def __len__(self):
+        return len(self._locks)
+
+
+class MemorySessionStore:
+    """
+    Conversation histories in an LRU dictionary; idle sessions expire after
+    `ttl` seconds and are swept every `sweep_every` writes.
+    """
+
+    def __init__(self, ttl: float = SESSION_TTL_SECONDS, max_sessions: int = SESSION_MAX_SESSIONS,
+                 max_messages: int = SESSION_MAX_MESSAGES, sweep_every: int = 500):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_messages = max_messages
+        self.sweep_every = sweep_every
+        self.locks = SessionLocks()
+        self.evictions = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        # session_id -> (last_active, history), least recently active first
+        self._sessions = OrderedDict()
+
+    def get(self, session_id: str) -> List[dict]:
+        """The history of a session, empty when it is unknown or expired."""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return []
+            if time.time() - entry[0] > self.ttl:
+                del self._sessions[session_id]
+                self.evictions += 1
+                return []
+            # Reading a session is activity too: refresh it so the order stays by last_active
+            self._sessions[session_id] = (time.time(), entry[1])
+            self._sessions.move_to_end(session_id)
+            return list(entry[1])
+
+    def append(self, session_id: str, messages: List[dict]) -> None:
+        """Adds the messages of a finished turn to a session."""
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            history = entry[1] if entry and time.time() - entry[0] <= self.ttl else []
+            self._sessions[session_id] = (time.time(), compact(history + list(messages), self.max_messages))
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evictions += 1
+            self._writes += 1
+            sweep = self._writes % self.sweep_every == 0
+        if sweep:
+            self.evict_expired()
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def evict_expired(self) -> int:
+        """Drops every expired session and returns how many there were."""
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            # Ordered by last_active (get and append both refresh it), so stop at the first session still alive
+            expired = []
+            for session_id, (last_active, _) in self._sessions.items():
+                if last_active > cutoff:
+                    break
+                expired.append(session_id)
+            for session_id in expired:
+                del self._sessions[session_id]
+            self.evictions += len(expired)
+        return len(expired)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+
+class SQLiteSessionStore:
+    """
+    Conversation histories persisted in SQLite as compact JSON, so they survive
+    restarts and can be shared by several worker processes. Expired sessions are
+    deleted every `sweep_every` writes.
+    """
+
+    def __init__(self, path: str = SESSION_DB_PATH, ttl: float = SESSION_TTL_SECONDS,
+                 max_messages: int = SESSION_MAX_MESSAGES, sweep_every: int = 500):
+        self.path = path
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self.sweep_every = sweep_every
+        self.locks = SessionLocks()
+        self.evictions = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # Autocommit; append opens its own write transaction
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, history TEXT NOT NULL, last_active REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_last_active ON sessions (last_active)")
+
+    def _load(self, session_id):
+        row = self._conn.execute(
+            "SELECT history FROM sessions WHERE session_id = ? AND last_active >= ?",
+            (session_id, time.time() - self.ttl),
+        ).fetchone()
+        return json.loads(row[0]) if row else []
+
+    def get(self, session_id: str) -> List[dict]:
+        with self._lock:
+            return self._load(session_id)
+
+    def append(self, session_id: str, messages: List[dict]) -> None:
+        with self._lock:
+            # The read-modify-write runs in one write transaction, so appends from
+            # other processes to the same session wait instead of being overwritten
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                history = compact(self._load(session_id) + list(messages), self.max_messages)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO sessions (session_id, history, last_active) VALUES (?, ?, ?)",
+                    (session_id, json.dumps(history, separators=(",", ":"), ensure_ascii=False), time.time()),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._writes += 1
+            sweep = self._writes % self.sweep_every == 0
+        if sweep:
+            self.evict_expired()
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def evict_expired(self) -> int:
+        with self._lock:
+            deleted = self._conn.execute(
+                "DELETE FROM sessions WHERE last_active < ?", (time.time() - self.ttl,)
+            ).rowcount
+            self.evictions += deleted
+        if deleted:
+            logging.info(f"Evicted {deleted} idle sessions from {self.path}")
+        return deleted
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM sessions WHERE last_active >= ?", (time.time() - self.ttl,)
+            ).fetchone()[0]
+
+
+def get_session_store():
+    """The session store selected by SESSION_STORE."""
+    kind = os.getenv('SESSION_STORE', SESSION_STORE)
+    if kind == 'sqlite':
+        return SQLiteSessionStore(os.getenv('SESSION_DB_PATH', SESSION_DB_PATH))
+    if kind != 'memory':
+        logging.warning(f"Unknown SESSION_STORE '{kind}', keeping sessions in memory")
+    return MemorySessionStore()
@@ -0,0 +1,229 @@
+import asyncio
+import logging
+import re
+import threading
+
+
+def normalize_prompt(text: str) -> str:
+    """Key under which two prompts count as the same question (case, spacing and final punctuation ignored)."""
+    return re.sub(r"\s+", " ", text).strip().rstrip("?!. ").casefold()
+
+
+class SingleFlightStats:
+    """How many calls came in and how many of them joined a call already in flight."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+        self.max_waiters = 0
+
+    def record(self, leader: bool, waiters: int = 0):
+        with self._lock:
+            self.calls += 1
+            if leader:
+                self.executions += 1
+            else:
+                self.coalesced += 1
+                self.max_waiters = max(self.max_waiters, waiters)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "executions": self.executions,
+                "coalesced": self.coalesced,
+                "coalesce_rate": round(self.coalesced / self.calls, 4) if self.calls else 0.0,
+                "max_waiters": self.max_waiters,
+            }
+
+
+class _Flight:
+    """A call in progress: its result, or the tokens it streamed so far."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.changed = threading.Condition()
+        self.tokens = []
+        self.finished = False
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time across threads. Callers arriving
+    while a call with the same key is in flight wait for it and share its
+    result (do) or replay and follow its token stream (stream) instead of
+    starting their own. Nothing is kept once the call finishes: this merges
+    concurrent duplicates, it is not a cache.
+    """
+
+    def __init__(self, name: str = "singleflight"):
+        self.stats = SingleFlightStats(name)
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def _join(self, key):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                flight.waiters += 1
+        self.stats.record(leader, flight.waiters)
+        if not leader:
+            logging.debug(f"{self.stats.name}: joined call in flight ({flight.waiters} waiting)")
+        return flight, leader
+
+    def _finish(self, key, flight):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def in_flight(self, key) -> bool:
+        """Whether a call for `key` is running, i.e. a new caller would only follow it."""
+        with self._lock:
+            return key in self._flights
+
+    def do(self, key, fn):
+        """Returns fn() for the first caller of `key`, and the same result (or exception) for concurrent ones."""
+        flight, leader = self._join(key)
+        if not leader:
+            flight.done.wait()
+        else:
+            try:
+                flight.result = fn()
+            except BaseException as e:
+                flight.error = e
+            finally:
+                self._finish(key, flight)
+                flight.done.set()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def stream(self, key, fn):
+        """
+        Yields the items of the iterator returned by fn(). The iterator is consumed
+        by a background thread, so every caller of the same key, including one that
+        stops reading early, sees the same sequence from the start.
+        """
+        flight, leader = self._join(key)
+        if leader:
+            threading.Thread(target=self._produce, args=(key, flight, fn), name=f"{self.stats.name}-stream",
+                             daemon=True).start()
+        index = 0
+        while True:
+            with flight.changed:
+                while index >= len(flight.tokens) and not flight.finished:
+                    flight.changed.wait()
+                tokens = flight.tokens[index:]
+                finished = flight.finished
+            for token in tokens:
+                yield token
+            index += len(tokens)
+            if finished and index >= len(flight.tokens):
+                break
+        if flight.error is not None:
+            raise flight.error
+
+    def _produce(self, key, flight, fn):
+        try:
+            for token in fn():
+                with flight.changed:
+                    flight.tokens.append(token)
+                    flight.changed.notify_all()
+        except BaseException as e:
+            flight.error = e
+        finally:
+            self._finish(key, flight)
+            with flight.changed:
+                flight.finished = True
+                flight.changed.notify_all()
+            flight.done.set()
+
+
+class _AsyncFlight:
+    def __init__(self):
+        self.task = None
+        self.tokens = []
+        self.finished = False
+        self.error = None
+        self.changed = asyncio.Condition()
+        self.waiters = 0
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlight for coroutines on one event loop. The shared call runs in its
+    own task, so a caller that is cancelled or disconnects does not cancel it
+    for the others.
+    """
+
+    def __init__(self, name: str = "singleflight"):
+        self.stats = SingleFlightStats(name)
+        self._flights = {}
+
+    def _join(self, key):
+        flight = self._flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = self._flights[key] = _AsyncFlight()
+        else:
+            flight.waiters += 1
+        self.stats.record(leader, flight.waiters)
+        return flight, leader
+
+    def _finish(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def in_flight(self, key) -> bool:
+        """Whether a call for `key` is running, i.e. a new caller would only follow it."""
+        return key in self._flights
+
+    async def do(self, key, fn):
+        """Awaits fn() once for all concurrent callers of `key`."""
+        flight, leader = self._join(key)
+        if leader:
+            flight.task = asyncio.ensure_future(fn())
+            flight.task.add_done_callback(lambda _: self._finish(key, flight))
+        return await asyncio.shield(flight.task)
+
+    async def stream(self, key, fn):
+        """Yields the items of the async iterator returned by fn(), shared by concurrent callers of `key`."""
+        flight, leader = self._join(key)
+        if leader:
+            flight.task = asyncio.ensure_future(self._produce(key, flight, fn))
+        index = 0
+        while True:
+            async with flight.changed:
+                await flight.changed.wait_for(lambda: index < len(flight.tokens) or flight.finished)
+                tokens = flight.tokens[index:]
+                finished = flight.finished
+            for token in tokens:
+                yield token
+            index += len(tokens)
+            if finished and index >= len(flight.tokens):
+                break
+        if flight.error is not None:
+            raise flight.error
+
+    async def _produce(self, key, flight, fn):
+        try:
+            async for token in fn():
+                async with flight.changed:
+                    flight.tokens.append(token)
+                    flight.changed.notify_all()
+        except Exception as e:
+            flight.error = e
+        finally:
+            self._finish(key, flight)
+            async with flight.changed:
+                flight.finished = True
+                flight.changed.notify_all()
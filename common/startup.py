@@ -0,0 +1,110 @@
+import functools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from common.metrics import record_span
+
+# Cold start budget checked by `python -m bots profile` (seconds until the bot can answer)
+STARTUP_TARGET_SECONDS = float(os.getenv('STARTUP_TARGET_SECONDS', '5'))
+
+# Process start as seen by this module, close enough for a launcher that imports it first
+_process_started = time.perf_counter()
+
+
+class StartupProfile:
+    """
+    Durations of the startup phases of a bot (import, secret_lookup,
+    index_load, model_load, ...), whichever thread runs them. Phases run in
+    background threads (prewarm) overlap the others, so the wall time to
+    'ready' can be less than their sum.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.phases = []  # (name, seconds, background thread name or None)
+        self.ready_at = None
+
+    def record(self, name: str, seconds: float):
+        thread = threading.current_thread()
+        background = None if thread is threading.main_thread() else thread.name
+        with self._lock:
+            self.phases.append((name, seconds, background))
+        record_span("startup", seconds, name)
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def mark_ready(self):
+        """Notes the moment the bot can take its first request."""
+        if self.ready_at is None:
+            self.ready_at = time.perf_counter() - _process_started
+
+    def report(self, target: float = STARTUP_TARGET_SECONDS) -> str:
+        with self._lock:
+            phases = list(self.phases)
+        lines = ["Startup profile:"]
+        for name, seconds, background in phases:
+            where = f"  (background: {background})" if background else ""
+            lines.append(f"  {name:<28} {seconds * 1000:>9.1f} ms{where}")
+        if self.ready_at is not None:
+            verdict = "within" if self.ready_at <= target else "OVER"
+            lines.append(f"  {'ready after':<28} {self.ready_at * 1000:>9.1f} ms  ({verdict} the {target:g}s target)")
+        return "\n".join(lines)
+
+
+profile = StartupProfile()
+phase = profile.phase
+
+
+def once(phase_name: str):
+    """
+    Decorator deferring an expensive initialisation (secret lookup, database
+    seeding, index load) to its first call; later calls return the same result.
+    The first call is timed as a startup phase, and concurrent first callers
+    wait for it instead of repeating it. A call that raises, or returns a falsy
+    result such as a missing API key, raises ValueError and is retried next time.
+    """
+    def decorator(fn):
+        lock = threading.Lock()
+        done = []
+
+        @functools.wraps(fn)
+        def wrapper():
+            if done:
+                return done[0]
+            with lock:
+                if not done:
+                    with phase(phase_name):
+                        result = fn()
+                    if not result:
+                        raise ValueError(f"{phase_name}: {fn.__name__} returned {result!r}")
+                    done.append(result)
+            return done[0]
+
+        wrapper.initialized = lambda: bool(done)
+        return wrapper
+
+    return decorator
+
+
+def prewarm_in_background(*steps) -> threading.Thread:
+    """Runs warm-up steps (callables) one after the other in a daemon thread."""
+    def run():
+        for step in steps:
+            try:
+                step()
+            except Exception as e:
+                # The first real request retries the step and reports the error
+                logging.error(f"Prewarm step {getattr(step, '__name__', step)} failed: {e}")
+
+    thread = threading.Thread(target=run, name="prewarm", daemon=True)
+    thread.start()
+    return thread
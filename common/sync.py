@@ -0,0 +1,54 @@
+import logging
+import os
+import threading
+import time
+
+# Seconds between two background knowledge base refreshes
+SYNC_INTERVAL = int(os.getenv('SYNC_INTERVAL_SECONDS', '900'))
+
+
+class BackgroundSync(threading.Thread):
+    """
+    Calls refresh() every `interval` seconds in a daemon thread, so the serving
+    process keeps answering from the current index while a new one is built.
+    Errors are logged and retried at the next interval.
+    """
+
+    def __init__(self, refresh, interval: int = SYNC_INTERVAL, name: str = "knowledge-sync"):
+        super().__init__(name=name, daemon=True)
+        self.refresh = refresh
+        self.interval = interval
+        self.runs = 0
+        self.failures = 0
+        self.last_run = None
+        self.last_duration = None
+        self.last_error = None
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stopped.is_set():
+                break
+            started = time.perf_counter()
+            try:
+                self.refresh()
+                self.last_error = None
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e)
+                logging.error(f"Background sync failed, retrying in {self.interval}s: {e}")
+            self.runs += 1
+            self.last_run = time.time()
+            self.last_duration = time.perf_counter() - started
+            logging.info(f"Background sync finished in {self.last_duration:.1f}s")
+
+    def trigger(self):
+        """Runs a refresh now instead of waiting for the interval."""
+        self._wake.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
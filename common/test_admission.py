@@ -0,0 +1,232 @@
+import asyncio
+import ipaddress
+import threading
+import time
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+from common.admission import (DEFAULT_PRIORITY, AdmissionControl, BackendGate, ClientLimiter, Rejected,
+                              TokenBucket, add_fastapi_admission, body_cost, is_trusted, request_terms)
+
+PROXY = [ipaddress.ip_network("10.0.0.0/8")]
+
+
+def test_token_bucket_spends_and_refills():
+    bucket = TokenBucket(rate=10, burst=2)
+    assert bucket.take() == 0
+    assert bucket.take() == 0
+    wait = bucket.take()
+    assert 0 < wait <= 0.1
+    time.sleep(wait + 0.01)
+    assert bucket.take() == 0
+
+
+def test_token_bucket_caps_the_cost_at_the_burst():
+    bucket = TokenBucket(rate=1, burst=3)
+    assert bucket.take(cost=100) == 0
+    assert bucket.take() > 0
+
+
+def test_client_limiter_is_per_client_and_bounded():
+    limiter = ClientLimiter(rate=1, burst=1, max_clients=2)
+    assert limiter.check("a") == 0
+    assert limiter.check("a") > 0
+    assert limiter.check("b") == 0
+    assert limiter.check("c") == 0
+    # 'a' was the least recently seen client and got a fresh bucket
+    assert limiter.check("a") == 0
+
+
+def test_client_limiter_disabled():
+    limiter = ClientLimiter(rate=0, burst=0)
+    assert all(limiter.check("a") == 0 for _ in range(100))
+
+
+def test_headers_ignored_from_untrusted_peers():
+    headers = {"X-Client-ID": "someone-else", "X-Priority": "0", "X-Deadline-Seconds": "2"}
+    assert request_terms(headers, "203.0.113.9", trusted=False) == ("203.0.113.9", DEFAULT_PRIORITY, 2.0)
+
+
+def test_headers_honoured_from_trusted_proxies():
+    headers = {"X-Client-ID": "alice", "X-Priority": "42"}
+    assert is_trusted("10.1.2.3", PROXY)
+    assert not is_trusted("192.168.0.1", PROXY)
+    assert not is_trusted(None, PROXY)
+    assert request_terms(headers, "10.1.2.3", trusted=True) == ("alice", 9, None)
+
+
+def test_body_cost():
+    assert body_cost(None) == 1
+    assert body_cost(3999) == 1
+    assert body_cost(8000) == 3
+
+
+def test_gate_serves_waiters_by_priority():
+    gate = BackendGate("test-priority", max_concurrency=1, max_queue=10)
+    order = []
+    with gate.hold():
+        threads = []
+        for priority in (7, 1, 4):
+            def worker(priority=priority):
+                with gate.hold(priority, time.monotonic() + 5):
+                    order.append(priority)
+            thread = threading.Thread(target=worker)
+            thread.start()
+            threads.append(thread)
+            while gate.stats()["queued"] < len(threads):
+                time.sleep(0.001)
+    for thread in threads:
+        thread.join()
+    assert order == [1, 4, 7]
+    assert gate.stats()["active"] == 0
+
+
+def test_gate_rejects_when_the_queue_is_full():
+    gate = BackendGate("test-full", max_concurrency=1, max_queue=0)
+    with gate.hold():
+        with pytest.raises(Rejected) as error:
+            with gate.hold():
+                pass
+    assert error.value.status == 503
+    assert gate.stats()["active"] == 0
+
+
+def test_gate_rejects_early_when_the_wait_exceeds_the_deadline():
+    gate = BackendGate("test-deadline", max_concurrency=1, max_queue=10)
+    gate.avg_service = 10.0
+    with gate.hold():
+        started = time.monotonic()
+        with pytest.raises(Rejected):
+            with gate.hold(deadline=time.monotonic() + 1):
+                pass
+        assert time.monotonic() - started < 0.5
+
+
+def test_gate_times_out_a_queued_request():
+    gate = BackendGate("test-timeout", max_concurrency=1, max_queue=10)
+    with gate.hold():
+        with pytest.raises(Rejected):
+            with gate.hold(deadline=time.monotonic() + 0.05):
+                pass
+        assert gate.stats()["queued"] == 0
+
+
+def test_async_gate_passes_on_the_slot():
+    gate = BackendGate("test-async", max_concurrency=1, max_queue=10)
+
+    async def scenario():
+        async def job(i, results):
+            async with gate.hold_async(deadline=time.monotonic() + 5):
+                await asyncio.sleep(0.01)
+                results.append(i)
+
+        results = []
+        await asyncio.gather(*(job(i, results) for i in range(5)))
+        return results
+
+    assert sorted(asyncio.run(scenario())) == list(range(5))
+    assert gate.stats() == {**gate.stats(), "active": 0, "queued": 0}
+
+
+def test_admission_rate_limits_before_the_gate():
+    admission = AdmissionControl("test-rate", ClientLimiter(rate=1, burst=1), BackendGate("test-rate"))
+    with admission.admit("a"):
+        pass
+    with pytest.raises(Rejected) as error:
+        with admission.admit("a"):
+            pass
+    assert error.value.status == 429
+    assert int(error.value.headers()["Retry-After"]) >= 1
+
+
+def make_app(gate, limiter=None):
+    app = FastAPI()
+    admission = AdmissionControl("test-http", limiter or ClientLimiter(rate=0, burst=0), gate)
+    add_fastapi_admission(app, admission)
+
+    @app.api_route("/chat", methods=["GET", "POST", "HEAD"])
+    async def chat():
+        async def body():
+            assert gate.stats()["active"] == 1
+            for word in ("a", "b", "c"):
+                yield word
+        return StreamingResponse(body(), media_type="text/plain")
+
+    @app.get("/other")
+    async def other():
+        return {"active": gate.stats()["active"]}
+
+    return app
+
+
+def test_middleware_holds_the_slot_while_streaming():
+    gate = BackendGate("test-stream", max_concurrency=1)
+    with TestClient(make_app(gate)) as client:
+        assert client.post("/chat").text == "abc"
+        assert client.get("/other").json() == {"active": 0}
+    assert gate.stats()["active"] == 0
+
+
+def test_middleware_releases_the_slot_without_a_body():
+    gate = BackendGate("test-head", max_concurrency=1)
+    with TestClient(make_app(gate)) as client:
+        for _ in range(3):
+            assert client.head("/chat").status_code == 200
+    assert gate.stats()["active"] == 0
+
+
+def test_middleware_releases_the_slot_when_the_client_leaves_before_the_body():
+    gate = BackendGate("test-disconnect", max_concurrency=1)
+    app = make_app(gate)
+
+    async def scenario():
+        scope = {"type": "http", "method": "POST", "path": "/chat", "raw_path": b"/chat", "query_string": b"",
+                 "headers": [], "client": ("127.0.0.1", 1234), "server": ("test", 80), "scheme": "http",
+                 "http_version": "1.1", "root_path": "",
+                 "asgi": {"version": "3.0", "spec_version": "2.4"}}
+
+        async def receive():
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            # The connection is gone before the response starts
+            raise OSError("client disconnected")
+
+        with pytest.raises(Exception):
+            await app(scope, receive, send)
+        # Released by the time the app returns, not whenever the loop finalises leftovers
+        assert gate.stats()["active"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_middleware_answers_429():
+    gate = BackendGate("test-429", max_concurrency=1)
+    with TestClient(make_app(gate, ClientLimiter(rate=0.01, burst=1))) as client:
+        assert client.post("/chat").status_code == 200
+        response = client.post("/chat")
+        assert response.status_code == 429
+        assert "Retry-After" in response.headers
+
+
+def test_followers_take_no_slot():
+    gate = BackendGate("test-follower", max_concurrency=1, max_queue=0)
+    app = FastAPI()
+    admission = AdmissionControl("test-follower", ClientLimiter(rate=0, burst=0), gate)
+    add_fastapi_admission(app, admission, follower=lambda body: body == b"follow")
+
+    @app.post("/chat")
+    async def chat(request: Request):
+        return {"body": (await request.body()).decode(), "active": gate.stats()["active"]}
+
+    with TestClient(app) as client:
+        with gate.hold():
+            # The only slot is taken: a leader is turned away, a follower gets through
+            assert client.post("/chat", content=b"lead").status_code == 503
+            assert client.post("/chat", content=b"follow").json() == {"body": "follow", "active": 1}
+        # The body read by the middleware still reaches the endpoint
+        assert client.post("/chat", content=b"lead").json() == {"body": "lead", "active": 1}
+    assert gate.stats()["active"] == 0
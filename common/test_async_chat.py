@@ -0,0 +1,129 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+from fastapi.testclient import TestClient
+from openai import AsyncOpenAI
+
+from common import async_chat
+from common.admission import AdmissionControl, BackendGate, ClientLimiter
+from common.async_chat import AsyncChatService, create_chat_app
+from common.metrics import SPAN_SECONDS
+from common.prompts import PromptBuilder
+
+
+def make_app(stateless=False):
+    calls = []
+
+    async def respond(prompt, session_id=None):
+        calls.append((prompt, session_id))
+        for word in ("one ", "answer"):
+            await asyncio.sleep(0.05)
+            yield word
+
+    admission = AdmissionControl("test-chat", ClientLimiter(rate=0, burst=0),
+                                 BackendGate("test-chat", max_concurrency=1, max_queue=0))
+    return create_chat_app(respond, admission=admission, stateless=stateless), calls
+
+
+def ask_together(app, bodies):
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            async def post(i, body):
+                # The others arrive while the first one's call is in flight
+                await asyncio.sleep(0.02 * bool(i))
+                return await client.post("/chat", json=body)
+
+            return await asyncio.gather(*(post(i, body) for i, body in enumerate(bodies)))
+
+    return asyncio.run(scenario())
+
+
+def test_identical_prompts_share_one_call_and_one_slot():
+    app, calls = make_app()
+    # One backend slot and no queue: the followers would be turned away if they needed one
+    responses = ask_together(app, [{"prompt": "Leave policy?"}, {"prompt": "leave  policy"}, {"prompt": "LEAVE POLICY"}])
+    assert [response.status_code for response in responses] == [200] * 3
+    assert {response.text for response in responses} == {"one answer"}
+    assert len(calls) == 1
+    with TestClient(app) as client:
+        assert client.get("/stats").json()["coalescing"]["coalesced"] == 2
+
+
+def test_sessions_are_not_coalesced_unless_stateless():
+    app, calls = make_app()
+    with TestClient(app) as client:
+        for session_id in ("alice", "bob"):
+            assert client.post("/chat", json={"prompt": "hi", "session_id": session_id, "stream": False}).json() == \
+                {"response": "one answer"}
+    assert calls == [("hi", "alice"), ("hi", "bob")]
+
+    app, calls = make_app(stateless=True)
+    responses = ask_together(app, [{"prompt": "hi", "session_id": "alice"}, {"prompt": "hi", "session_id": "bob"}])
+    assert [response.text for response in responses] == ["one answer"] * 2
+    assert len(calls) == 1
+
+
+class FakeCompletions:
+    """Stands in for client.chat.completions: fails with the queued errors, then streams two deltas."""
+
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.calls = 0
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return self.chunks()
+
+    async def chunks(self):
+        for text in ("one ", "answer"):
+            await asyncio.sleep(0)
+            yield SimpleNamespace(usage=None, model="test", choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+
+def make_service(model, errors=()):
+    client = AsyncOpenAI(api_key="sk-test")
+    client.chat.completions = FakeCompletions(errors)
+    service = AsyncChatService(client, PromptBuilder("Be brief."), model=model, max_retries=1)
+    return service, client.chat.completions
+
+
+def llm_calls(model, outcome):
+    return SPAN_SECONDS.snapshot(span="llm_call", detail=f"openai/{model}", outcome=outcome)["count"]
+
+
+def connection_error():
+    return openai.APIConnectionError(request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+
+
+def test_stream_records_every_attempt(monkeypatch):
+    monkeypatch.setattr(async_chat, "OPENAI_RETRY_BASE_DELAY", 0)
+    service, completions = make_service("retry-model", [connection_error()])
+    assert asyncio.run(service.complete("hi")) == "one answer"
+    assert completions.calls == 2
+    assert (llm_calls("retry-model", "error"), llm_calls("retry-model", "ok")) == (1, 1)
+
+
+def test_stream_records_a_non_retryable_error():
+    service, _ = make_service("bad-request-model", [ValueError("bad request")])
+    with pytest.raises(ValueError):
+        asyncio.run(service.complete("hi"))
+    assert llm_calls("bad-request-model", "error") == 1
+
+
+def test_stream_records_a_caller_that_goes_away():
+    service, _ = make_service("cancelled-model")
+
+    async def first_delta_only():
+        deltas = service.stream("hi")
+        assert await deltas.__anext__() == "one "
+        await deltas.aclose()
+
+    asyncio.run(first_delta_only())
+    assert llm_calls("cancelled-model", "cancelled") == 1
+    assert llm_calls("cancelled-model", "error") == 0
@@ -0,0 +1,108 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from benchmarks.mock_server import MockConfluenceServer
+from common.confluence import ConfluenceCrawler, SyncResult
+
+LONG_AGO = datetime.now(timezone.utc) - timedelta(days=30)
+
+
+@pytest.fixture
+def confluence():
+    with MockConfluenceServer() as server:
+        for i in range(5):
+            server.put_page(i, f"Leave {i}", "LEG", f"<p>leave {i}</p>", modified=LONG_AGO)
+        server.put_page(10, "Revenue", "REV", "<p>revenue</p>", modified=LONG_AGO)
+        server.put_page(20, "Elsewhere", "OTHER", "<p>not crawled</p>", modified=LONG_AGO)
+        yield server
+
+
+def make_crawler(server, tmp_path):
+    return ConfluenceCrawler(server.url, "user", "token", spaces="LEG,REV",
+                             state_path=str(tmp_path / "state" / "sync.json"), page_size=2)
+
+
+def test_full_sync_follows_the_search_pages(confluence, tmp_path):
+    crawler = make_crawler(confluence, tmp_path)
+    result = crawler.sync()
+    assert result.full
+    assert sorted(result.changed, key=int) == ["0", "1", "2", "3", "4", "10"]
+    page = result.changed["10"]
+    assert (page.title, page.space, page.version, page.html) == ("Revenue", "REV", 1, "<p>revenue</p>")
+    assert page.url == f"{confluence.url}/spaces/REV/pages/10/Revenue"
+    # 6 pages, 2 per request, listed twice (with bodies, then IDs for deletions)
+    assert confluence.requests == 6
+    assert result.removed == []
+
+
+def test_incremental_sync_only_returns_new_versions(confluence, tmp_path):
+    crawler = make_crawler(confluence, tmp_path)
+    crawler.commit(crawler.sync())
+
+    confluence.put_page(1, "Leave 1", "LEG", "<p>leave 1, updated</p>")
+    confluence.put_page(11, "New revenue page", "REV", "<p>new</p>")
+    # Recently touched but still the same version: seen by the query, not returned
+    confluence.pages["2"]["modified"] = datetime.now(timezone.utc)
+
+    result = crawler.sync()
+    assert not result.full
+    assert sorted(result.changed) == ["1", "11"]
+    assert result.changed["1"].version == 2
+    assert result.removed == []
+
+
+def test_deleted_pages_are_reported(confluence, tmp_path):
+    crawler = make_crawler(confluence, tmp_path)
+    crawler.commit(crawler.sync())
+    confluence.delete_page(3)
+
+    result = crawler.sync()
+    assert result.changed == {}
+    assert result.removed == ["3"]
+    crawler.commit(result)
+    assert "3" not in crawler.pages
+    assert not crawler.sync()
+
+
+def test_commit_round_trips_through_the_state_file(confluence, tmp_path):
+    crawler = make_crawler(confluence, tmp_path)
+    result = crawler.sync()
+    crawler.commit(result)
+
+    with open(tmp_path / "state" / "sync.json") as f:
+        state = json.load(f)
+    assert state["last_sync"] == result.started_at
+    assert state["pages"]["10"] == {"title": "Revenue", "space": "REV", "version": 1,
+                                    "url": f"{confluence.url}/spaces/REV/pages/10/Revenue"}
+
+    # A new process resumes incrementally from the saved state
+    restarted = make_crawler(confluence, tmp_path)
+    assert restarted.pages == crawler.pages
+    assert not restarted.sync().full
+
+
+def test_uncommitted_sync_is_repeated(confluence, tmp_path):
+    crawler = make_crawler(confluence, tmp_path)
+    crawler.sync()
+    # Indexing failed: nothing was committed, so the next sync is full again
+    assert crawler.sync().full
+
+
+def test_changing_the_spaces_forces_a_full_sync(confluence, tmp_path):
+    crawler = make_crawler(confluence, tmp_path)
+    crawler.commit(crawler.sync())
+    widened = ConfluenceCrawler(confluence.url, "user", "token", spaces="LEG,REV,OTHER",
+                                state_path=str(tmp_path / "state" / "sync.json"))
+    result = widened.sync()
+    assert result.full
+    assert "20" in result.changed
+
+
+def test_corrupt_state_starts_over(tmp_path):
+    path = tmp_path / "sync.json"
+    path.write_text("{")
+    crawler = ConfluenceCrawler("http://confluence.invalid", "user", "token", state_path=str(path))
+    assert crawler.pages == {}
+    assert not SyncResult()
@@ -0,0 +1,27 @@
+import os
+import stat
+
+from common.credentials import OPENAI_KEY_REFERENCE, get_openai_api_key
+
+
+def install_op(directory, script):
+    path = directory / "op"
+    path.write_text(f"#!/bin/sh\n{script}\n")
+    path.chmod(path.stat().st_mode | stat.S_IXUSR)
+    return str(directory)
+
+
+def test_reads_the_key_with_the_1password_cli(tmp_path, monkeypatch):
+    monkeypatch.setenv("PATH", install_op(tmp_path, 'echo "sk-$2"') + os.pathsep + os.environ["PATH"])
+    assert get_openai_api_key() == f"sk-{OPENAI_KEY_REFERENCE}"
+    assert get_openai_api_key("op://Other/key") == "sk-op://Other/key"
+
+
+def test_empty_key(tmp_path, monkeypatch):
+    monkeypatch.setenv("PATH", install_op(tmp_path, "exit 1"))
+    assert get_openai_api_key() == ""
+
+
+def test_missing_cli(tmp_path, monkeypatch):
+    monkeypatch.setenv("PATH", str(tmp_path))
+    assert get_openai_api_key() is None
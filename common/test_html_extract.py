@@ -0,0 +1,47 @@
+import pytest
+
+from common import html_extract
+
+BACKENDS = [html_extract._extract_soup]
+if html_extract.lxml is not None:
+    BACKENDS.append(html_extract._extract_lxml)
+
+CASES = {
+    "table": ("<table><tr><td>a</td><td>b</td></tr><tr><td>c</td><td>d</td></tr></table>", "| a | b |\n| c | d |"),
+    "heading": ("<h2>Title</h2>", "## Title"),
+    "toc_macro": ('<div class="toc-macro"><a>Intro</a></div>', ""),
+    "children_macro": ('<div data-macro-name="children">Child page</div>', ""),
+    "paragraph": ("<p>Only paragraph</p>", "Only paragraph"),
+    "text_only": ("plain <b>bold</b> text", "plain bold text"),
+    "page": (
+        '<h1>Leave</h1><div class="toc-macro">Contents</div><p>Ask your <b>manager</b>.</p>'
+        "<ul><li>Annual</li><li>Sick</li></ul>"
+        "<table><thead><tr><th>Type</th><th>Days</th></tr></thead><tbody><tr><td>Annual</td><td>25</td></tr></tbody></table>"
+        "<script>var x = 1;</script>",
+        "# Leave\nAsk your manager.\n- Annual\n- Sick\n| Type | Days |\n| Annual | 25 |",
+    ),
+    "breaks_and_comments": ("<p>one<br>two</p><!-- comment --><h3>Sub</h3>", "one\ntwo\n### Sub"),
+}
+
+
+@pytest.mark.parametrize("extract", BACKENDS, ids=lambda fn: fn.__name__)
+@pytest.mark.parametrize("html, expected", list(CASES.values()), ids=list(CASES))
+def test_extract(extract, html, expected):
+    assert extract(html) == expected
+
+
+@pytest.mark.parametrize("html", [html for html, _ in CASES.values()], ids=list(CASES))
+def test_backends_agree(html):
+    assert len({extract(html) for extract in BACKENDS}) == 1
+
+
+def test_empty_page():
+    assert html_extract.extract_text("  \n") == ""
+
+
+def test_page_text_is_cached_per_version(tmp_path, monkeypatch):
+    monkeypatch.setattr(html_extract, "EXTRACT_CACHE_DIR", str(tmp_path))
+    assert html_extract.extract_page_text("<p>v1</p>", "42", 1) == "v1"
+    # Same page and version: served from the cache, even if the HTML differs
+    assert html_extract.extract_page_text("<p>changed</p>", "42", 1) == "v1"
+    assert html_extract.extract_page_text("<p>changed</p>", "42", 2) == "changed"
@@ -0,0 +1,107 @@
+import asyncio
+import json
+import logging
+import socket
+import urllib.error
+import urllib.request
+
+import pytest
+
+from common import metrics
+from common.metrics import SPAN_ERRORS, SPAN_SECONDS, LogAggregator, Registry, span, start_metrics_server
+
+
+def test_counter_exposition_escapes_labels():
+    registry = Registry()
+    requests = registry.counter("test_requests_total", "Requests", ("path",))
+    requests.inc(path="/chat")
+    requests.inc(2, path='say "hi"\n')
+    assert registry.counter("test_requests_total", "ignored") is requests
+    assert registry.render().splitlines() == [
+        "# HELP test_requests_total Requests",
+        "# TYPE test_requests_total counter",
+        'test_requests_total{path="/chat"} 1',
+        'test_requests_total{path="say \\"hi\\"\\n"} 2',
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    latency = registry.histogram("test_seconds", "Latency", ("op",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.7, 3.0):
+        latency.observe(value, op="x")
+    lines = registry.render().splitlines()
+    assert lines[2:] == [
+        'test_seconds_bucket{op="x",le="0.1"} 1',
+        'test_seconds_bucket{op="x",le="1.0"} 3',
+        'test_seconds_bucket{op="x",le="+Inf"} 4',
+        'test_seconds_count{op="x"} 4',
+        'test_seconds_sum{op="x"} 4.25',
+    ]
+    assert latency.snapshot(op="x") == {"count": 4, "sum": 4.25}
+
+
+def test_gauge():
+    gauge = Registry().gauge("test_active", "Active")
+    gauge.set(3)
+    gauge.dec()
+    assert gauge.value() == 2
+
+
+def test_span_records_outcome_and_parent(monkeypatch, caplog):
+    monkeypatch.setattr(metrics, "SPAN_LOG_SAMPLE_RATE", 1.0)
+    with caplog.at_level(logging.INFO):
+        with span("test_outer", "a"):
+            with span("test_inner", "a", items=3):
+                pass
+        with pytest.raises(ValueError):
+            with span("test_outer", "b"):
+                raise ValueError("boom")
+    assert SPAN_SECONDS.snapshot(span="test_outer", detail="a", outcome="ok")["count"] == 1
+    assert SPAN_SECONDS.snapshot(span="test_outer", detail="b", outcome="error")["count"] == 1
+    assert SPAN_ERRORS.value(span="test_outer", detail="b") == 1
+    inner = [json.loads(r.message) for r in caplog.records if '"span": "test_inner"' in r.message]
+    assert inner[0]["parent"] == "test_outer"
+    assert inner[0]["items"] == 3
+
+
+def test_cancelled_span_is_not_an_error():
+    async def scenario():
+        async def slow():
+            with span("test_cancel"):
+                await asyncio.sleep(10)
+
+        task = asyncio.ensure_future(slow())
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    assert SPAN_SECONDS.snapshot(span="test_cancel", detail="", outcome="cancelled")["count"] == 1
+    assert SPAN_ERRORS.value(span="test_cancel", detail="") == 0
+
+
+def test_log_aggregator(caplog):
+    aggregator = LogAggregator("Stored", every=2)
+    with caplog.at_level(logging.INFO):
+        for chunks in (3, 4, 5):
+            aggregator.add(chunks=chunks)
+        aggregator.flush()
+    assert [r.message for r in caplog.records] == ["Stored: 2 items, 7 chunks", "Stored: 3 items, 12 chunks"]
+
+
+def test_metrics_server():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = start_metrics_server(port, host="127.0.0.1")
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+            assert response.headers["Content-Type"] == metrics.CONTENT_TYPE
+            assert "# TYPE bot_span_seconds histogram" in response.read().decode()
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/other")
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,53 @@
+from types import SimpleNamespace
+
+import pytest
+
+from common.prompts import PromptBuilder, UsageTracker, request_cost
+
+
+def test_prompt_builder_keeps_a_stable_prefix():
+    builder = PromptBuilder("""
+        You are Rick.   
+        Be brief.
+    """)
+    history = [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "burp"}]
+    messages = builder.build("what now?", history)
+    assert messages[0] == {"role": "system", "content": "You are Rick.\nBe brief."}
+    assert messages[1:] == history + [{"role": "user", "content": "what now?"}]
+    assert PromptBuilder("You are Rick.\nBe brief.").prefix_id == builder.prefix_id
+
+
+def test_request_cost():
+    # 1000 uncached and 1000 cached input tokens, 500 output tokens of gpt-4o
+    assert request_cost("gpt-4o", 2000, 1000, 500) == pytest.approx((1000 * 2.50 + 1000 * 1.25 + 500 * 10.00) / 1e6)
+    assert request_cost("gpt-4", 1000, 0, 0) == pytest.approx(0.03)
+    assert request_cost("llama3.1", 1000, 0, 0) is None
+
+
+@pytest.mark.parametrize("model, base", [
+    ("gpt-4o-2024-08-06", "gpt-4o"),
+    ("gpt-4o-mini-2024-07-18", "gpt-4o-mini"),
+    ("gpt-4-0613", "gpt-4"),
+    ("gpt-4-turbo-2024-04-09", "gpt-4-turbo"),
+])
+def test_dated_snapshots_are_billed_like_their_base_model(model, base):
+    assert request_cost(model, 1000, 200, 100) == request_cost(base, 1000, 200, 100)
+
+
+def test_usage_tracker_accepts_sdk_objects_and_dicts():
+    tracker = UsageTracker("test")
+    tracker.record("gpt-4o-mini", SimpleNamespace(prompt_tokens=2000, completion_tokens=10,
+                                                  prompt_tokens_details=SimpleNamespace(cached_tokens=1024)))
+    # Assistant runs report no prompt_tokens_details
+    entry = tracker.record("gpt-4o-mini", {"prompt_tokens": 1000, "completion_tokens": 5})
+    assert entry["cached_tokens"] == 0
+    summary = tracker.summary()
+    assert (summary["requests"], summary["prompt_tokens"], summary["cached_tokens"]) == (2, 3000, 1024)
+    assert summary["cache_hit_rate"] == pytest.approx(1024 / 3000, abs=1e-4)
+    assert summary["cost"] > 0
+
+
+def test_usage_tracker_with_an_unknown_model():
+    tracker = UsageTracker("test")
+    assert tracker.record("mystery", {"prompt_tokens": 10, "completion_tokens": 1})["cost"] is None
+    assert tracker.summary()["cost"] == 0
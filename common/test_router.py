@@ -0,0 +1,204 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from benchmarks.mock_server import MockModelServer, StubConfig
+from common import router as router_module
+from common.router import (CancelToken, ModelRouter, OllamaBackend, OpenAIBackend, RouterError, _Cancelled,
+                           parse_backend)
+
+MESSAGES = [{"role": "user", "content": "How do I request legal support?"}]
+
+
+@pytest.fixture(scope="module")
+def stub():
+    with MockModelServer(config=StubConfig(tokens=8, latency=0.0, token_rate=0)) as server:
+        yield server
+
+
+@pytest.fixture(scope="module")
+def slow_stub():
+    # Sends its headers at once, then takes 5s to produce the first token
+    with MockModelServer(config=StubConfig(tokens=8, latency=5.0)) as server:
+        yield server
+
+
+@pytest.fixture
+def silent_server():
+    """Accepts connections and never answers; yields (url, closed connection count)."""
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen()
+    closed = []
+
+    def serve():
+        while True:
+            try:
+                connection, _ = listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=lambda: (drain(connection), closed.append(1)), daemon=True).start()
+
+    def drain(connection):
+        while connection.recv(65536):
+            pass
+        connection.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+    yield f"http://127.0.0.1:{listener.getsockname()[1]}", closed
+    listener.close()
+
+
+def unused_url():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{s.getsockname()[1]}"
+
+
+def test_flatten():
+    assert OllamaBackend.flatten(MESSAGES) == MESSAGES[0]["content"]
+    messages = [{"role": "system", "content": " Be brief. "}] + MESSAGES
+    assert OllamaBackend.flatten(messages) == "Be brief.\nUser: How do I request legal support?\nAssistant:"
+
+
+def test_flatten_names_the_assistant():
+    messages = [{"role": "system", "content": "You are Rick."}, *MESSAGES,
+                {"role": "assistant", "content": "*burp* Fill in a form."}, {"role": "user", "content": "Which one?"}]
+    assert OllamaBackend.flatten(messages, "Rick") == (
+        "You are Rick.\nUser: How do I request legal support?\nRick: *burp* Fill in a form.\nUser: Which one?\nRick:")
+
+
+def test_from_env_passes_the_assistant_label(monkeypatch):
+    monkeypatch.setenv("MODEL_BACKENDS", "ollama/llama3.1:latest,openai/gpt-4o-mini")
+    router = ModelRouter.from_env(default="ollama/unused", assistant_label="Rick")
+    try:
+        assert router.backends[0].assistant_label == "Rick"
+        assert parse_backend("ollama/llama3.1:latest").assistant_label == "Assistant"
+    finally:
+        router.close()
+
+
+def test_openai_key_from_the_environment_or_1password(monkeypatch):
+    monkeypatch.setattr(router_module, "get_openai_api_key", lambda: "sk-op")
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-env")
+    assert router_module._openai_api_key() == "sk-env"
+    monkeypatch.delenv("OPENAI_API_KEY")
+    assert router_module._openai_api_key() == "sk-op"
+
+
+def test_parse_backend():
+    backend = parse_backend("ollama/llama3.2-vision@http://gpu:11434/api/chat")
+    assert (backend.name, backend.url, backend.chat_api) == ("ollama/llama3.2-vision", "http://gpu:11434/api/chat", True)
+    assert backend.tasks == {"chat", "vision"}
+    assert isinstance(parse_backend("openai/gpt-4o-mini"), OpenAIBackend)
+    with pytest.raises(ValueError):
+        parse_backend("claude/x")
+
+
+@pytest.mark.parametrize("path", ["/api/generate", "/api/chat"])
+def test_ollama_backend(stub, path):
+    text = OllamaBackend("llama3.1:latest", url=stub.url + path).complete(MESSAGES, CancelToken())
+    assert len(text.split()) == 8
+
+
+def test_policies():
+    cheap, fast, slow = (OllamaBackend(name, cost=cost) for name, cost in (("cheap", 0.1), ("fast", 1), ("slow", 2)))
+    fast.health.record_success(0.1)
+    cheap.health.record_success(1.0)
+    slow.health.record_success(5.0)
+    backends = [slow, fast, cheap]
+    assert ModelRouter(backends, policy="ordered").candidates() == [slow, fast, cheap]
+    assert ModelRouter(backends, policy="cheapest").candidates() == [cheap, fast, slow]
+    assert ModelRouter(backends, policy="fastest").candidates() == [fast, cheap, slow]
+    assert ModelRouter(backends, slow_after=2.0).candidates() == [fast, cheap, slow]
+    with pytest.raises(ValueError):
+        ModelRouter(backends, policy="random")
+
+
+def test_failover_and_circuit_breaker(stub, monkeypatch):
+    monkeypatch.setattr(router_module, "CIRCUIT_FAILURES", 2)
+    down = OllamaBackend("down", url=unused_url() + "/api/generate")
+    up = OllamaBackend("up", url=stub.url + "/api/generate")
+    with ModelRouter([down, up]) as router:
+        for _ in range(2):
+            assert router.chat(MESSAGES).backend == "ollama/up"
+        assert router.failovers == 2
+        assert not down.health.available
+        assert router.candidates() == [up]
+
+
+def test_all_backends_failing():
+    with ModelRouter([OllamaBackend("down", url=unused_url() + "/api/generate")]) as router:
+        with pytest.raises(RouterError):
+            router.chat(MESSAGES)
+
+
+def test_hedge_wins_and_the_loser_is_stopped(stub, silent_server):
+    url, closed = silent_server
+    stalled = OllamaBackend("stalled", url=url + "/api/generate")
+    with ModelRouter([stalled, OllamaBackend("fast", url=stub.url + "/api/generate")], hedge_after=0.05) as router:
+        result = router.chat(MESSAGES)
+        assert (result.backend, result.hedged) == ("ollama/fast", True)
+        # The abandoned call hangs up right away instead of waiting for BACKEND_TIMEOUT
+        deadline = time.monotonic() + 2
+        while not closed and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert closed
+        # Losing a race is neither a failure nor a latency sample
+        assert stalled.health.snapshot()["failures"] == 0
+
+
+@pytest.mark.parametrize("stage", ["headers", "body"])
+def test_cancel_interrupts_a_stalled_read(stage, slow_stub, silent_server):
+    url = silent_server[0] if stage == "headers" else slow_stub.url
+    backend = OllamaBackend("stalled", url=url + "/api/generate")
+    cancel = CancelToken()
+    threading.Timer(0.1, cancel.set).start()
+    started = time.monotonic()
+    with pytest.raises(_Cancelled):
+        backend.complete(MESSAGES, cancel, timeout=30)
+    assert time.monotonic() - started < 2
+
+
+def test_cancel_token_runs_closers_once():
+    calls = []
+    cancel = CancelToken()
+    cancel.add(lambda: calls.append("a"))
+    cancel.set()
+    cancel.set()
+    cancel.add(lambda: calls.append("late"))
+    assert calls == ["a", "late"]
+    assert cancel.is_set()
+
+
+def test_close_stops_calls_in_flight(silent_server):
+    router = ModelRouter([OllamaBackend("stalled", url=silent_server[0] + "/api/generate")])
+    errors = []
+
+    def call():
+        try:
+            router.chat(MESSAGES)
+        except RouterError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=call)
+    thread.start()
+    time.sleep(0.1)
+    router.close()
+    thread.join(2)
+    assert not thread.is_alive()
+    assert errors
+
+
+def test_cancel_interrupts_a_stalled_openai_stream(slow_stub, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setenv("OPENAI_BASE_URL", slow_stub.url + "/v1")
+    backend = OpenAIBackend("gpt-4o-mini")
+    cancel = CancelToken()
+    threading.Timer(0.2, cancel.set).start()
+    started = time.monotonic()
+    with pytest.raises(Exception):
+        backend.complete(MESSAGES, cancel, timeout=30)
+    assert time.monotonic() - started < 2
@@ -0,0 +1,135 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from common.sessions import MemorySessionStore, SessionLocks, SQLiteSessionStore, compact
+
+
+def turn(i):
+    return [{"role": "user", "content": f"question {i}"}, {"role": "assistant", "content": f"answer {i}"}]
+
+
+def test_compact_keeps_the_last_messages_from_a_user_turn():
+    history = [{"role": "system", "content": "rules"}] + turn(1) + turn(2)
+    assert compact(history, 3) == turn(2)
+    assert compact(history, 4) == turn(1) + turn(2)
+    assert compact([{"role": "user", "content": "  hi \n"}]) == [{"role": "user", "content": "hi"}]
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemorySessionStore(ttl=0.2, max_messages=4)
+    return SQLiteSessionStore(str(tmp_path / "sessions.sqlite"), ttl=0.2, max_messages=4)
+
+
+def test_append_and_trim(store):
+    for i in range(3):
+        store.append("a", turn(i))
+    assert store.get("a") == turn(1) + turn(2)
+    assert store.get("b") == []
+    store.delete("a")
+    assert store.get("a") == []
+
+
+def test_idle_sessions_expire(store):
+    store.append("a", turn(1))
+    time.sleep(0.3)
+    assert store.get("a") == []
+    store.append("a", turn(2))
+    assert store.get("a") == turn(2)
+
+
+def test_evict_expired(store):
+    store.append("old", turn(1))
+    time.sleep(0.3)
+    store.append("new", turn(2))
+    assert store.evict_expired() == 1
+    assert len(store) == 1
+
+
+def test_memory_get_keeps_a_session_alive():
+    store = MemorySessionStore(ttl=0.3)
+    store.append("read", turn(1))
+    store.append("idle", turn(2))
+    time.sleep(0.2)
+    assert store.get("read") == turn(1)
+    time.sleep(0.2)
+    # 'idle' expired; 'read' was refreshed by get and must survive the sweep
+    assert store.evict_expired() == 1
+    assert store.get("read") == turn(1)
+
+
+def test_memory_store_sweeps_on_writes():
+    store = MemorySessionStore(ttl=0.1, sweep_every=2)
+    store.append("a", turn(1))
+    time.sleep(0.2)
+    store.append("b", turn(2))
+    assert len(store) == 1
+    assert store.evictions == 1
+
+
+def test_memory_store_evicts_the_least_recently_used():
+    store = MemorySessionStore(max_sessions=2)
+    store.append("a", turn(1))
+    store.append("b", turn(2))
+    store.get("a")
+    store.append("c", turn(3))
+    assert store.get("b") == []
+    assert store.get("a") == turn(1)
+
+
+def test_sqlite_appends_from_several_connections_are_not_lost(tmp_path):
+    # Separate stores stand in for worker processes sharing the file
+    path = str(tmp_path / "sessions.sqlite")
+    stores = [SQLiteSessionStore(path, max_messages=1000) for _ in range(4)]
+
+    def worker(store, offset):
+        for i in range(25):
+            store.append("shared", turn(offset + i))
+
+    threads = [threading.Thread(target=worker, args=(store, n * 100)) for n, store in enumerate(stores)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(stores[0].get("shared")) == 4 * 25 * 2
+
+
+def test_session_locks_serialise_one_session():
+    locks = SessionLocks()
+    inside = []
+
+    def worker(session_id):
+        with locks.hold(session_id):
+            inside.append(session_id)
+            assert inside.count(session_id) == 1
+            time.sleep(0.01)
+            inside.remove(session_id)
+
+    threads = [threading.Thread(target=worker, args=(s,)) for s in ["a", "a", "b", "a"]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(locks) == 0
+
+
+def test_session_locks_async():
+    locks = SessionLocks()
+    order = []
+
+    async def worker(i):
+        async with locks.hold_async("a"):
+            order.append(("in", i))
+            await asyncio.sleep(0.01)
+            order.append(("out", i))
+
+    async def scenario():
+        await asyncio.gather(*(worker(i) for i in range(3)))
+
+    asyncio.run(scenario())
+    assert [step for step, _ in order] == ["in", "out"] * 3
+    assert len(locks) == 0
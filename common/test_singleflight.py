@@ -0,0 +1,136 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from common.singleflight import AsyncSingleFlight, SingleFlight, normalize_prompt
+
+
+def test_normalize_prompt():
+    assert normalize_prompt("  How do I  request\nleave?? ") == normalize_prompt("how do i request leave")
+    assert normalize_prompt("leave policy") != normalize_prompt("sick policy")
+
+
+def run_together(n, target):
+    threads = [threading.Thread(target=target) for _ in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_do_shares_one_call():
+    flight = SingleFlight("test-do")
+    calls = []
+    results = []
+
+    def fn():
+        calls.append(1)
+        time.sleep(0.1)
+        return "answer"
+
+    run_together(5, lambda: results.append(flight.do("q", fn)))
+    assert results == ["answer"] * 5
+    assert len(calls) == 1
+    assert flight.stats.snapshot()["coalesced"] == 4
+    assert not flight.in_flight("q")
+
+
+def test_do_shares_the_error_and_forgets_the_key():
+    flight = SingleFlight("test-error")
+    errors = []
+
+    def fn():
+        time.sleep(0.05)
+        raise ValueError("backend down")
+
+    def call():
+        try:
+            flight.do("q", fn)
+        except ValueError as e:
+            errors.append(e)
+
+    run_together(3, call)
+    assert len(errors) == 3
+    # Nothing is cached: the next call runs again
+    assert flight.do("q", lambda: "ok") == "ok"
+
+
+def test_stream_replays_from_the_start():
+    flight = SingleFlight("test-stream")
+    started = threading.Event()
+
+    def tokens():
+        started.set()
+        for token in "abc":
+            time.sleep(0.02)
+            yield token
+
+    first = flight.stream("q", tokens)
+    assert next(first) == "a"
+    assert flight.in_flight("q")
+    # Joins after the first token and still sees the whole answer
+    assert "".join(flight.stream("q", lambda: iter("never called"))) == "abc"
+    assert "".join(first) == "bc"
+    assert flight.stats.snapshot()["executions"] == 1
+
+
+def test_async_do_survives_a_cancelled_caller():
+    flight = AsyncSingleFlight("test-async-do")
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    async def scenario():
+        first = asyncio.ensure_future(flight.do("q", fn))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(flight.do("q", fn))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(scenario()) == "answer"
+    assert len(calls) == 1
+
+
+def test_async_stream():
+    flight = AsyncSingleFlight("test-async-stream")
+
+    async def tokens():
+        for token in "abc":
+            await asyncio.sleep(0.01)
+            yield token
+
+    async def collect():
+        return "".join([token async for token in flight.stream("q", tokens)])
+
+    async def scenario():
+        first = asyncio.ensure_future(collect())
+        await asyncio.sleep(0)
+        assert flight.in_flight("q")
+        results = await asyncio.gather(first, collect(), collect())
+        assert not flight.in_flight("q")
+        return results
+
+    assert asyncio.run(scenario()) == ["abc"] * 3
+    assert flight.stats.snapshot() == {**flight.stats.snapshot(), "calls": 3, "executions": 1, "coalesced": 2}
+
+
+def test_async_stream_error_reaches_every_caller():
+    flight = AsyncSingleFlight("test-async-error")
+
+    async def tokens():
+        yield "a"
+        raise RuntimeError("cut off")
+
+    async def collect():
+        return [token async for token in flight.stream("q", tokens)]
+
+    async def scenario():
+        return await asyncio.gather(collect(), collect(), return_exceptions=True)
+
+    assert all(isinstance(result, RuntimeError) for result in asyncio.run(scenario()))
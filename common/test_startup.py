@@ -0,0 +1,72 @@
+import threading
+import time
+
+import pytest
+
+from common.startup import StartupProfile, once, prewarm_in_background
+
+
+def test_once_runs_a_single_time_across_threads():
+    calls = []
+
+    @once("test_phase")
+    def load():
+        calls.append(1)
+        time.sleep(0.05)
+        return "index"
+
+    threads = [threading.Thread(target=load) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert load() == "index"
+    assert len(calls) == 1
+    assert load.initialized()
+
+
+@pytest.mark.parametrize("missing", [None, ""])
+def test_once_does_not_cache_a_missing_result(missing):
+    results = [missing, "sk-test"]
+
+    @once("secret_lookup")
+    def api_key():
+        return results.pop(0)
+
+    with pytest.raises(ValueError):
+        api_key()
+    assert not api_key.initialized()
+    # The next call looks the secret up again
+    assert api_key() == "sk-test"
+
+
+def test_once_retries_after_an_error():
+    attempts = []
+
+    @once("test_retry")
+    def connect():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ConnectionError("down")
+        return "client"
+
+    with pytest.raises(ConnectionError):
+        connect()
+    assert connect() == "client"
+
+
+def test_profile_report():
+    profile = StartupProfile()
+    with profile.phase("import"):
+        pass
+    profile.mark_ready()
+    report = profile.report(target=60)
+    assert "import" in report
+    assert "within the 60s target" in report
+
+
+def test_prewarm_survives_a_failing_step():
+    done = []
+    thread = prewarm_in_background(lambda: 1 / 0, lambda: done.append(1))
+    thread.join(1)
+    assert done == [1]
@@ -0,0 +1,89 @@
+import threading
+import time
+
+from common.sync import BackgroundSync
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_refreshes_every_interval():
+    calls = []
+    sync = BackgroundSync(lambda: calls.append(1), interval=0.02)
+    sync.start()
+    try:
+        wait_for(lambda: sync.runs >= 3)
+    finally:
+        sync.stop()
+        sync.join(1)
+    assert not sync.is_alive()
+    assert sync.failures == 0 and sync.last_error is None
+
+
+def test_failure_is_recorded_and_retried():
+    outcomes = iter([RuntimeError("confluence down"), None])
+
+    def refresh():
+        error = next(outcomes)
+        if error:
+            raise error
+
+    sync = BackgroundSync(refresh, interval=0.02)
+    sync.start()
+    try:
+        wait_for(lambda: sync.runs >= 1)
+        assert sync.failures == 1
+        wait_for(lambda: sync.runs >= 2)
+    finally:
+        sync.stop()
+        sync.join(1)
+    # The next successful run clears the error
+    assert sync.failures == 1 and sync.last_error is None
+
+
+def test_triggers_during_a_run_never_overlap():
+    running = 0
+    overlaps = []
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def refresh():
+        nonlocal running
+        running += 1
+        overlaps.append(running > 1)
+        calls.append(1)
+        started.set()
+        release.wait(1)
+        running -= 1
+
+    sync = BackgroundSync(refresh, interval=60)
+    sync.start()
+    try:
+        sync.trigger()
+        assert started.wait(1)
+        # Triggers while a refresh runs collapse into one follow-up run
+        for _ in range(5):
+            sync.trigger()
+        release.set()
+        wait_for(lambda: sync.runs >= 2)
+        time.sleep(0.05)
+    finally:
+        sync.stop()
+        sync.join(1)
+    assert len(calls) == 2
+    assert not any(overlaps)
+
+
+def test_stop_before_the_interval():
+    calls = []
+    sync = BackgroundSync(lambda: calls.append(1), interval=60)
+    sync.start()
+    sync.stop()
+    sync.join(1)
+    assert not sync.is_alive()
+    assert calls == []